@@ -0,0 +1,159 @@
+import argparse
+import csv
+import multiprocessing
+import os
+import sys
+import time
+
+import wash as wash_lib
+
+# Appended to the name of each input file, before the extension, to name its
+# output file.
+OUT_SUFFIX = '_out'
+
+
+def out_path_for(in_path, suffix=OUT_SUFFIX):
+    """Returns the path that the washed lots of in_path are written to.
+
+    Args:
+        in_path: The path of an input csv file.
+        suffix: A string, added to the file name before the extension.
+    Returns:
+        The path of the output file, in the same directory as in_path.
+    """
+    base, ext = os.path.splitext(in_path)
+    return base + suffix + (ext or '.csv')
+
+
+def find_input_files(paths, suffix=OUT_SUFFIX):
+    """Lists the input files to wash.
+
+    Args:
+        paths: A list of paths. A directory stands for every .csv file in it
+            whose name does not end with suffix, that is, every file that is
+            not an output. Any other path is a manifest, a text file with the
+            path of one input file per line. Relative paths in a manifest are
+            relative to the manifest's directory, and blank lines and lines
+            starting with # are skipped.
+        suffix: A string, the suffix of output files, as for out_path_for.
+    Returns:
+        A list of paths of input files, in the order they were found.
+    """
+    in_paths = []
+    for path in paths:
+        if os.path.isdir(path):
+            in_paths.extend(
+                os.path.join(path, name) for name in sorted(os.listdir(path))
+                if name.endswith('.csv') and
+                not name.endswith(suffix + '.csv'))
+            continue
+        manifest_dir = os.path.dirname(path)
+        with open(path) as f:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith('#'):
+                    in_paths.append(os.path.join(manifest_dir, line))
+    return in_paths
+
+
+def wash_file(task):
+    """Washes the lots in one file and writes them out. Runs in a worker.
+
+    Args:
+        task: A tuple of the input path, the output path and the name of the
+            wash engine, a key of wash_lib.ENGINES.
+    Returns:
+        A tuple of the input path, the number of lots that were written, the
+        wall time in seconds, and a string describing why the file could not
+        be washed, or None if it was.
+    """
+    in_path, out_path, engine = task
+    start = time.time()
+    try:
+        lots = wash_lib.read_lots(in_path)
+        wash_lib.ENGINES[engine](lots)
+        wash_lib.write_lots(lots, out_path)
+    except Exception as e:
+        # One bad file shouldn't stop the rest of the batch, whatever is
+        # wrong with it, such as a row with a blank buy date.
+        return (in_path, 0, time.time() - start,
+                '{}: {}'.format(type(e).__name__, e))
+    return in_path, lots.size(), time.time() - start, None
+
+
+def wash_files(in_paths, engine='event', jobs=None, suffix=OUT_SUFFIX):
+    """Washes each input file independently, writing outputs side by side.
+
+    Args:
+        in_paths: A list of paths of input files.
+        engine: The name of the wash engine to use, a key of wash_lib.ENGINES.
+        jobs: The number of worker processes to use, or None to use one per
+            CPU. If 1, the files are washed in this process.
+        suffix: A string, the suffix of output files, as for out_path_for.
+    Yields:
+        A tuple for each file, in the order of in_paths, as returned by
+        wash_file.
+    """
+    tasks = [(in_path, out_path_for(in_path, suffix), engine)
+             for in_path in in_paths]
+    if jobs == 1:
+        for task in tasks:
+            yield wash_file(task)
+        return
+    pool = multiprocessing.Pool(jobs)
+    try:
+        # Most files are small, so they are handed out several at a time to
+        # keep the workers from waiting on the pool.
+        chunksize = max(1, len(tasks) // (4 * (jobs or os.cpu_count() or 1)))
+        for result in pool.imap(wash_file, tasks, chunksize):
+            yield result
+    finally:
+        pool.close()
+        pool.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Washes many files of lots in one process.')
+    parser.add_argument('paths', nargs='+',
+                        help='Directories of input csv files, or manifests '
+                        'listing one input file per line.')
+    parser.add_argument('-e', '--engine', choices=sorted(wash_lib.ENGINES),
+                        default='event')
+    parser.add_argument('-j', '--jobs', type=int,
+                        help='The number of worker processes to use. Defaults '
+                        'to one per CPU.')
+    parser.add_argument('--suffix', default=OUT_SUFFIX,
+                        help='Added to the name of each input file to name '
+                        'its output file.')
+    parser.add_argument('--summary', metavar='summary_file',
+                        help='Write the per-file results to this csv file.')
+    parsed = parser.parse_args()
+
+    in_paths = find_input_files(parsed.paths, parsed.suffix)
+    summary_file = None
+    if parsed.summary:
+        summary_file = open(parsed.summary, 'w', newline='')
+        summary = csv.writer(summary_file)
+        summary.writerow(['File', 'Lots', 'Seconds', 'Error'])
+    start = time.time()
+    num_failed = 0
+    try:
+        for in_path, num_lots, seconds, error in wash_files(
+                in_paths, parsed.engine, parsed.jobs, parsed.suffix):
+            if error:
+                num_failed += 1
+                print('Failed: {}: {}'.format(in_path, error))
+            if summary_file:
+                summary.writerow([in_path, num_lots,
+                                  '{:.4f}'.format(seconds), error or ''])
+    finally:
+        if summary_file:
+            summary_file.close()
+    print('{} washed, {} failed in {:.2f}s'.format(
+        len(in_paths) - num_failed, num_failed, time.time() - start))
+    return 1 if num_failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,105 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import batch_wash
+import lots as lots_lib
+import wash
+
+TESTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tests')
+
+
+class TestBatchWash(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def copy_test(self, name):
+        path = os.path.join(self.dir, name)
+        shutil.copy(os.path.join(TESTS_DIR, name), path)
+        return path
+
+    def test_out_path_for(self):
+        self.assertEqual(os.path.join('a', 'b_out.csv'),
+                         batch_wash.out_path_for(os.path.join('a', 'b.csv')))
+        self.assertEqual('b.done.csv',
+                         batch_wash.out_path_for('b.csv', '.done'))
+
+    def test_find_input_files(self):
+        self.copy_test('irs_example_1.csv')
+        self.copy_test('irs_example_1_out.csv')
+        with open(os.path.join(self.dir, 'notes.txt'), 'w') as f:
+            f.write('not a csv file')
+        manifest = os.path.join(self.dir, 'manifest.txt')
+        with open(manifest, 'w') as f:
+            f.write('# Comment\n\nb.csv\n/c.csv\n')
+        self.assertEqual([os.path.join(self.dir, 'irs_example_1.csv')],
+                         batch_wash.find_input_files([self.dir]))
+        self.assertEqual([os.path.join(self.dir, 'b.csv'), '/c.csv'],
+                         batch_wash.find_input_files([manifest]))
+
+    def test_wash_files(self):
+        names = ['irs_example_1.csv',
+                 'long_chain_with_different_num_shares.csv']
+        in_paths = [self.copy_test(name) for name in names]
+        bad_headers = os.path.join(self.dir, 'bad_headers.csv')
+        with open(bad_headers, 'w') as f:
+            f.write('Num Shares,Symbol\n1,ABC\n')
+        empty = os.path.join(self.dir, 'empty.csv')
+        open(empty, 'w').close()
+        missing = os.path.join(self.dir, 'missing.csv')
+        headers = ','.join(lots_lib.Lots.HEADERS[field]
+                           for field in lots_lib.Lot.FIELD_NAMES)
+        short_row = os.path.join(self.dir, 'short_row.csv')
+        with open(short_row, 'w') as f:
+            f.write(headers + '\n1,ABC\n')
+        no_buy_date = os.path.join(self.dir, 'no_buy_date.csv')
+        with open(no_buy_date, 'w') as f:
+            f.write(headers + '\n10,ABC,,,,100,,,,,,,,,,\n')
+        bad_paths = [bad_headers, empty, missing, short_row, no_buy_date]
+
+        results = list(batch_wash.wash_files(in_paths + bad_paths, jobs=1))
+        self.assertEqual(in_paths + bad_paths,
+                         [result[0] for result in results])
+        for in_path, (_, num_lots, seconds, error) in zip(in_paths, results):
+            self.assertIsNone(error)
+            self.assertGreaterEqual(seconds, 0)
+            with open(in_path) as f:
+                expected = lots_lib.Lots.create_from_csv_data(f)
+            wash.event_wash_all_lots(expected)
+            with open(batch_wash.out_path_for(in_path)) as f:
+                self.assertEqual(expected,
+                                 lots_lib.Lots.create_from_csv_data(f))
+            self.assertEqual(expected.size(), num_lots)
+        for _, num_lots, _, error in results[len(in_paths):]:
+            self.assertEqual(0, num_lots)
+        errors = [result[3] for result in results[len(in_paths):]]
+        self.assertTrue(errors[0].startswith('BadHeadersError: '))
+        self.assertEqual('BadHeadersError: No headers, the file is empty',
+                         errors[1])
+        self.assertTrue(errors[2].startswith('FileNotFoundError: '))
+        # The malformed rows don't stop the files after them.
+        self.assertIsNotNone(errors[3])
+        self.assertIsNotNone(errors[4])
+        for path in bad_paths:
+            self.assertFalse(os.path.exists(batch_wash.out_path_for(path)))
+
+    def test_malformed_row_in_worker(self):
+        in_path = self.copy_test('irs_example_1.csv')
+        bad_path = os.path.join(self.dir, 'a_bad.csv')
+        with open(bad_path, 'w') as f:
+            f.write(','.join(lots_lib.Lots.HEADERS[field]
+                             for field in lots_lib.Lot.FIELD_NAMES) +
+                    '\n10,ABC,,,,100,,,,,,,,,,\n')
+        results = list(batch_wash.wash_files([bad_path, in_path], jobs=2))
+        self.assertIsNotNone(results[0][3])
+        self.assertIsNone(results[1][3])
+        self.assertTrue(os.path.exists(batch_wash.out_path_for(in_path)))
+
+
+if __name__ == '__main__':
+    unittest.main()
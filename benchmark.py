@@ -0,0 +1,797 @@
+import argparse
+import collections
+import copy
+import csv
+import datetime
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import timeit
+
+import logger as logger_lib
+import lot_table
+import lots as lots_lib
+import snapshot as snapshot_lib
+import wash as wash_lib
+import wash_server
+import yearly_wash
+
+
+def generate_lots(num_lots, trades_per_day=10, loss_ratio=0.5,
+                  unsold_ratio=0.1, split_ratio=0.0, max_split_rows=3,
+                  num_symbols=1, seed=0):
+    """Generates a synthetic trading history.
+
+    Lots are bought starting on 1/2/2014, with trades_per_day lots bought on
+    every day. Each lot is held for between 1 and 90 days. Some lots are sold
+    in parts on different days, which is written as one row per part, all
+    with the same buy_lot.
+
+    Args:
+        num_lots: An integer, the number of lots (rows) to generate.
+        trades_per_day: An integer, the number of lots bought each day.
+        loss_ratio: A float, the fraction of sold lots that are sold for a
+            loss.
+        unsold_ratio: A float, the fraction of lots that are not sold.
+        split_ratio: A float, the fraction of bought lots that are sold in
+            parts.
+        max_split_rows: An integer, the largest number of parts that a lot
+            is sold in.
+        num_symbols: An integer, the number of different symbols. Each lot
+            gets one of them at random.
+        seed: The seed for the random number generator, so that the same
+            history can be generated again.
+    Returns:
+        A Lots object.
+    """
+    rand = random.Random(seed)
+    start_date = datetime.date(2014, 1, 2)
+    symbols = ['ABC'] if num_symbols == 1 else [
+        'S{}'.format(i) for i in range(num_symbols)]
+    lots = []
+    num_bought = 0
+    while len(lots) < num_lots:
+        buy_date = start_date + datetime.timedelta(
+            days=num_bought // trades_per_day)
+        symbol = rand.choice(symbols)
+        price = rand.randint(1000, 10000)
+        num_rows = 1
+        buy_lot = ''
+        if rand.random() < split_ratio:
+            num_rows = min(rand.randint(2, max_split_rows),
+                           num_lots - len(lots))
+            buy_lot = 'B{}'.format(num_bought)
+        num_bought += 1
+        for _ in range(num_rows):
+            num_shares = rand.randint(1, 100)
+            basis = num_shares * price
+            sell_date = None
+            proceeds = 0
+            if rand.random() >= unsold_ratio:
+                sell_date = buy_date + datetime.timedelta(
+                    days=rand.randint(1, 90))
+                if rand.random() < loss_ratio:
+                    proceeds = int(basis * rand.uniform(0.5, 0.99))
+                else:
+                    proceeds = int(basis * rand.uniform(1.01, 1.5))
+            lots.append(lots_lib.Lot(num_shares, symbol, '', buy_date,
+                                     buy_date, basis, basis, sell_date,
+                                     proceeds, '', 0,
+                                     'Line {}'.format(len(lots)), buy_lot, [],
+                                     False, False))
+    return lots_lib.Lots(lots)
+
+
+def _best_replacement_lot_by_scan(loss_lot, lots):
+    """Finds a replacement lot by sorting and scanning all of the lots.
+
+    This is how wash_lib.best_replacement_lot worked before the lots were
+    indexed by buy date, and is kept as a baseline.
+    """
+    lots.sort(key=lots_lib.Lot.original_buy_date_key)
+    for lot in lots:
+        if wash_lib.is_possible_replacement(loss_lot, lot):
+            return lot
+    return None
+
+
+def benchmark_replacement_lookup(parsed):
+    """Times finding a replacement lot, with and without the buy date index.
+
+    Args:
+        parsed: The parsed command line arguments.
+    """
+    lots = generate_lots(parsed.num_lots, parsed.trades_per_day)
+    loss_lots = [lot for lot in lots if lot.is_loss()][:parsed.num_losses]
+
+    def lookup(find):
+        return lambda: [find(loss_lot, lots) for loss_lot in loss_lots]
+
+    print('{} lots, {} trades per day, {} losses'.format(
+        lots.size(), parsed.trades_per_day, len(loss_lots)))
+    for name, find in [('scan', _best_replacement_lot_by_scan),
+                       ('index', wash_lib.best_replacement_lot)]:
+        seconds = min(timeit.repeat(lookup(find), number=1,
+                                    repeat=parsed.repeat))
+        print('{:>6}: {:10.1f} us per loss'.format(
+            name, seconds / len(loss_lots) * 1e6))
+
+
+def benchmark_candidates(parsed):
+    """Times washing lots with and without numpy to filter the candidates.
+
+    With many trades per day, the windows are long, and most of the lots at
+    the start of them are already replacements by the time a loss is
+    washed.
+
+    Args:
+        parsed: The parsed command line arguments.
+    """
+    lots_lib._import_numpy()
+    if not lots_lib._HAS_NUMPY:
+        print('Install numpy library to compare with it.')
+        return
+    print('{} lots, {} trades per day'.format(parsed.num_lots,
+                                              parsed.trades_per_day))
+    original_has_numpy = lots_lib._HAS_NUMPY
+    try:
+        for name, has_numpy in [('python', False), ('numpy', True)]:
+            lots_lib._HAS_NUMPY = has_numpy
+            seconds = min(timeit.repeat(
+                lambda: wash_lib.event_wash_all_lots(generate_lots(
+                    parsed.num_lots, parsed.trades_per_day, split_ratio=0.2)),
+                number=1, repeat=parsed.repeat))
+            print('{:>6}: {:8.3f} s'.format(name, seconds))
+    finally:
+        lots_lib._HAS_NUMPY = original_has_numpy
+
+
+def _split_by_deepcopy(lot, num_shares):
+    """Splits a lot the way that wash_lib._split_lot did before Lot.split.
+
+    This is kept as a baseline.
+    """
+    existing_lot_portion = float(num_shares) / float(lot.num_shares)
+    new_lot_portion = float(lot.num_shares - num_shares) / float(lot.num_shares)
+
+    new_lot = copy.deepcopy(lot)
+    new_lot.num_shares -= num_shares
+    new_lot.basis = int(round(new_lot.basis * new_lot_portion))
+    new_lot.adjusted_basis = int(round(new_lot.adjusted_basis *
+                                       new_lot_portion))
+    new_lot.proceeds = int(round(new_lot.proceeds * new_lot_portion))
+    new_lot.adjustment = int(round(new_lot.adjustment * new_lot_portion))
+
+    lot.num_shares = num_shares
+    lot.basis = int(round(lot.basis * existing_lot_portion))
+    lot.adjusted_basis = int(round(lot.adjusted_basis * existing_lot_portion))
+    lot.proceeds = int(round(lot.proceeds * existing_lot_portion))
+    lot.adjustment = int(round(lot.adjustment * existing_lot_portion))
+    return new_lot
+
+
+def benchmark_split(parsed):
+    """Times splitting a lot, with copy.deepcopy and with Lot.split.
+
+    Args:
+        parsed: The parsed command line arguments.
+    """
+    lot = lots_lib.Lot(1000000, 'ABC', '', datetime.date(2014, 1, 2),
+                       datetime.date(2013, 12, 1), 100000000, 100050000,
+                       datetime.date(2014, 2, 3), 90000000, 'W', 50000,
+                       'Line 1', '_1', ['_2', '_3', '_4'], True, True)
+
+    def split(do_split):
+        return lambda: [do_split(copy.copy(lot), 600000)
+                        for _ in range(parsed.num_splits)]
+
+    print('{} splits'.format(parsed.num_splits))
+    for name, do_split in [('deepcopy', _split_by_deepcopy),
+                           ('split', lots_lib.Lot.split)]:
+        seconds = min(timeit.repeat(split(do_split), number=1,
+                                    repeat=parsed.repeat))
+        print('{:>8}: {:10.2f} us per split'.format(
+            name, seconds / parsed.num_splits * 1e6))
+
+
+def _parse_dates_by_strptime(values):
+    """Parses dates the way that lots_lib.Lots.iter_csv_data did before.
+
+    This is kept as a baseline.
+    """
+    return [datetime.datetime.strptime(value, '%m/%d/%Y').date()
+            for value in values if value]
+
+
+def _parse_dates_with_memo(values):
+    """Parses dates the way that lots_lib.Lots.iter_csv_data does."""
+    dates = {'': None}
+    result = []
+    for value in values:
+        try:
+            date = dates[value]
+        except KeyError:
+            date = dates[value] = lots_lib._parse_date(value)
+        if date:
+            result.append(date)
+    return result
+
+
+def benchmark_parse(parsed):
+    """Times parsing csv data into lots, and parsing just the dates in it.
+
+    Args:
+        parsed: The parsed command line arguments.
+    """
+    data = io.StringIO()
+    generate_lots(parsed.num_lots, parsed.trades_per_day,
+                  split_ratio=0.1).write_csv_data(data)
+    rows = data.getvalue().splitlines()
+    date_columns = [lots_lib.Lot.FIELD_NAMES.index(field)
+                    for field in ['buy_date', 'adjusted_buy_date',
+                                  'sell_date']]
+    values = [row[column] for row in csv.reader(rows[1:])
+              for column in date_columns]
+
+    print('{} lots, {} trades per day'.format(parsed.num_lots,
+                                              parsed.trades_per_day))
+    seconds = min(timeit.repeat(
+        lambda: list(lots_lib.Lots.iter_csv_data(rows)), number=1,
+        repeat=parsed.repeat))
+    print('{:>8}: {:10.0f} lots per second'.format(
+        'lots', parsed.num_lots / seconds))
+    for name, parse in [('strptime', _parse_dates_by_strptime),
+                        ('memo', _parse_dates_with_memo)]:
+        seconds = min(timeit.repeat(lambda: parse(values), number=1,
+                                    repeat=parsed.repeat))
+        print('{:>8}: {:10.0f} lots per second of dates'.format(
+            name, parsed.num_lots / seconds))
+
+
+def generate_chain(num_lots):
+    """Generates lots that wash into a single chain, like daily DRIP buys.
+
+    Each lot is bought on the day after the one before it, and sold at a loss
+    on the day after that, so each loss is washed by the next lot and the
+    replacement_for chain grows by one with every lot.
+
+    Args:
+        num_lots: An integer, the number of lots to generate.
+    Returns:
+        A Lots object.
+    """
+    start_date = datetime.date(2014, 1, 2)
+    lots = []
+    for i in range(num_lots):
+        buy_date = start_date + datetime.timedelta(days=i)
+        lots.append(lots_lib.Lot(10, 'ABC', '', buy_date, buy_date, 1000,
+                                 1000, buy_date + datetime.timedelta(days=1),
+                                 900, '', 0, 'Line {}'.format(i), '', [],
+                                 False, False))
+    return lots_lib.Lots(lots)
+
+
+def benchmark_chain(parsed):
+    """Times washing lots that form one long replacement chain.
+
+    Args:
+        parsed: The parsed command line arguments.
+    """
+    for num_lots in parsed.num_lots:
+        seconds = min(timeit.repeat(
+            lambda: wash_lib.event_wash_all_lots(generate_chain(num_lots)),
+            number=1, repeat=parsed.repeat))
+        print('{:>8} lots: {:8.3f} s'.format(num_lots, seconds))
+
+
+def generate_drip(num_buys):
+    """Generates one large loss and many small buys around its sale.
+
+    The loss is for as many shares as all of the buys together, which are
+    spread over the 30 days on either side of the sale, like dividend
+    reinvestments. So the loss is washed against every buy.
+
+    Args:
+        num_buys: An integer, the number of small buys.
+    Returns:
+        A Lots object.
+    """
+    sell_date = datetime.date(2014, 3, 1)
+    lots = [lots_lib.Lot(num_buys, 'ABC', '', datetime.date(2013, 1, 2),
+                         datetime.date(2013, 1, 2), num_buys * 1000,
+                         num_buys * 1000, sell_date, num_buys * 900, '', 0,
+                         'Line 0', '', [], False, False)]
+    for i in range(num_buys):
+        buy_date = sell_date + datetime.timedelta(days=i % 61 - 30)
+        lots.append(lots_lib.Lot(1, 'ABC', '', buy_date, buy_date, 950, 950,
+                                 None, 0, '', 0, 'Line {}'.format(i + 1), '',
+                                 [], False, False))
+    return lots_lib.Lots(lots)
+
+
+def benchmark_drip(parsed):
+    """Times washing one loss against many small buys.
+
+    The loss is washed against all of them in one step, and one piece at a
+    time, as a baseline.
+
+    Args:
+        parsed: The parsed command line arguments.
+    """
+    for num_buys in parsed.num_buys:
+        times = []
+        for batch in [True, False]:
+            times.append(min(timeit.repeat(
+                lambda: wash_lib.EventWasher(generate_drip(num_buys),
+                                             batch=batch).wash_all(),
+                number=1, repeat=parsed.repeat)))
+        print('{:>6} buys: batch {:8.3f} s, one at a time {:8.3f} s'.format(
+            num_buys, *times))
+
+
+def benchmark_io(parsed):
+    """Times writing and reading washed lots, as csv data and as a snapshot.
+
+    Args:
+        parsed: The parsed command line arguments.
+    """
+    lots = generate_lots(parsed.num_lots, split_ratio=0.1)
+    wash_lib.event_wash_all_lots(lots)
+
+    def write_csv(path):
+        with open(path, 'w', newline='') as f:
+            lots.write_csv_data(f)
+
+    def read_csv(path):
+        with open(path, newline='') as f:
+            return lots_lib.Lots.create_from_csv_data(f)
+
+    def write_snapshot(path):
+        with open(path, 'wb') as f:
+            snapshot_lib.write_snapshot(list(lots), f)
+
+    def read_snapshot(path):
+        with snapshot_lib.Snapshot(path) as snapshot:
+            return lots_lib.Lots(snapshot.lots())
+
+    print('{} lots'.format(parsed.num_lots))
+    for name, write, read in [('csv', write_csv, read_csv),
+                              ('snapshot', write_snapshot, read_snapshot)]:
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            write_seconds = min(timeit.repeat(lambda: write(path), number=1,
+                                              repeat=parsed.repeat))
+            read_seconds = min(timeit.repeat(lambda: read(path), number=1,
+                                             repeat=parsed.repeat))
+            print('{:>8}: write {:8.3f} s, read {:8.3f} s, {:10d} bytes'.format(
+                name, write_seconds, read_seconds, os.path.getsize(path)))
+        finally:
+            os.remove(path)
+
+
+def _resident_bytes():
+    """Returns the resident set size of this process. Only works on Linux."""
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+def benchmark_memory(parsed):
+    """Measures the memory used per lot by each way of storing lots.
+
+    Each backend loads the same csv file in a new process, so that memory
+    freed by generating the lots or by another backend is not reused. Only
+    the lots themselves are measured, not the index that a Lots object keeps
+    of them.
+
+    Args:
+        parsed: The parsed command line arguments.
+    """
+    if parsed.load:
+        with open(parsed.load, newline='') as f:
+            data = f.readlines()
+        before = _resident_bytes()
+        if parsed.backend == 'table':
+            lots = lot_table.LotTable.create_from_csv_data(data)
+        else:
+            lots = list(lots_lib.Lots.iter_csv_data(data))
+        print('{:>6}: {:10.1f} bytes per lot'.format(
+            parsed.backend, float(_resident_bytes() - before) / len(lots)))
+        return
+
+    fd, path = tempfile.mkstemp(suffix='.csv')
+    try:
+        with os.fdopen(fd, 'w', newline='') as f:
+            generate_lots(parsed.num_lots).write_csv_data(f)
+        print('{} lots'.format(parsed.num_lots))
+        for backend in ['lot', 'table']:
+            sys.stdout.write(subprocess.check_output(
+                [sys.executable, os.path.abspath(__file__), 'memory',
+                 '--backend', backend, '--load', path],
+                universal_newlines=True))
+    finally:
+        os.remove(path)
+
+
+def _simple_str_by_scan(lots, loss_lots, replacement_lots):
+    """Renders lots the way that Lots._simple_str did before the id sets.
+
+    This is kept as a baseline. It sorts a copy of the lots and looks every lot
+    up in the highlighted lists.
+    """
+    sorted_lots = copy.copy(lots.lots())
+    sorted_lots.sort(key=lots_lib.Lot.original_buy_date_key)
+    lot_strings = [' '.join([lots.SHORT_HEADERS[field]
+                             for field in lots_lib.Lot.FIELD_NAMES])]
+    for lot in sorted_lots:
+        str_data = str(lot)
+        if id(lot) in map(id, loss_lots):
+            str_data = '* ' + str_data
+        elif id(lot) in map(id, replacement_lots):
+            str_data = 'o ' + str_data
+        lot_strings.append(str_data)
+    return '\n'.join(lot_strings)
+
+
+def benchmark_render(parsed):
+    """Times rendering lots for the debug view, before and after the id sets.
+
+    Args:
+        parsed: The parsed command line arguments.
+    """
+    lots = generate_lots(parsed.num_lots, parsed.trades_per_day)
+    loss_lots = [lot for lot in lots if lot.is_loss()][:parsed.num_highlighted]
+    replacement_lots = lots.lots()[-parsed.num_highlighted:]
+
+    print('{} lots, {} highlighted'.format(
+        lots.size(), len(loss_lots) + len(replacement_lots)))
+    for name, render in [
+            ('scan', lambda: _simple_str_by_scan(lots, loss_lots,
+                                                 replacement_lots)),
+            ('ids', lambda: lots._simple_str(loss_lots, None,
+                                             replacement_lots))]:
+        seconds = min(timeit.repeat(render, number=1, repeat=parsed.repeat))
+        print('{:>5}: {:8.3f} s per render'.format(name, seconds))
+
+
+def _equal_by_scan(lots, other_lots):
+    """Compares lots the way that Lots.__eq__ did before Lot.key.
+
+    This is kept as a baseline.
+    """
+    if lots.size() != other_lots.size():
+        return False
+    for lot in lots.lots():
+        if lot not in other_lots.lots():
+            return False
+    return True
+
+
+def benchmark_compare(parsed):
+    """Times comparing two Lots objects, with and without Lot.key.
+
+    The second object has the same lots in a different order, with one lot
+    changed, as when comparing the outputs of two runs.
+
+    Args:
+        parsed: The parsed command line arguments.
+    """
+    lots = generate_lots(parsed.num_lots, parsed.trades_per_day)
+    other_lots = copy.deepcopy(lots.lots())
+    random.Random(0).shuffle(other_lots)
+    other_lots[0].adjustment += 1
+    other_lots = lots_lib.Lots(other_lots)
+
+    print('{} lots'.format(lots.size()))
+    for name, compare in [('scan', _equal_by_scan),
+                          ('key', lots_lib.Lots.__eq__),
+                          ('diff', lots_lib.Lots.diff)]:
+        seconds = min(timeit.repeat(lambda: compare(lots, other_lots),
+                                    number=1, repeat=parsed.repeat))
+        print('{:>5}: {:8.3f} s'.format(name, seconds))
+
+
+def benchmark_service(parsed):
+    """Times washing an account with wash.py, and with a WashService.
+
+    The history is made of periods of trading a year apart. The service is
+    timed for the first request, the same request again, and a request with
+    the proceeds of the last lot changed, which only re-washes the window of
+    the last period.
+
+    Args:
+        parsed: The parsed command line arguments.
+    """
+    lots = []
+    for period in range(parsed.periods):
+        shift = datetime.timedelta(days=365 * period)
+        for lot in generate_lots(parsed.num_lots // parsed.periods,
+                                 parsed.trades_per_day, seed=period):
+            lot.buy_date += shift
+            lot.adjusted_buy_date += shift
+            if lot.sell_date:
+                lot.sell_date += shift
+            lot.buy_lot = 'P{}{}'.format(period, lot.buy_lot)
+            lots.append(lot)
+    data = io.StringIO(newline='')
+    lots_lib.Lots(lots).write_csv_data(data)
+    lots[-1].proceeds += 1
+    edited_data = io.StringIO(newline='')
+    lots_lib.Lots(lots).write_csv_data(edited_data)
+
+    fd, in_path = tempfile.mkstemp(suffix='.csv')
+    fd_out, out_path = tempfile.mkstemp(suffix='.csv')
+    os.close(fd_out)
+    try:
+        with os.fdopen(fd, 'w', newline='') as f:
+            f.write(data.getvalue())
+        seconds = min(timeit.repeat(
+            lambda: subprocess.check_call(
+                [sys.executable, os.path.join(
+                    os.path.dirname(os.path.abspath(__file__)), 'wash.py'),
+                 '-q', '-w', in_path, '-o', out_path]),
+            number=1, repeat=parsed.repeat))
+    finally:
+        os.remove(in_path)
+        os.remove(out_path)
+    print('{} lots in {} periods'.format(len(lots), parsed.periods))
+    print('{:>8}: {:8.3f} s'.format('wash.py', seconds))
+
+    times = {'first': [], 'repeat': [], 'edit': []}
+    for _ in range(parsed.repeat):
+        service = wash_server.WashService()
+        for name, request_data in [('first', data), ('repeat', data),
+                                   ('edit', edited_data)]:
+            request = {'account': 'a', 'csv': request_data.getvalue()}
+            start = timeit.default_timer()
+            service.handle(request)
+            times[name].append(timeit.default_timer() - start)
+    for name in ['first', 'repeat', 'edit']:
+        print('{:>8}: {:8.3f} s'.format(name, min(times[name])))
+
+
+def benchmark_years(parsed):
+    """Times washing a history one year at a time, against all at once.
+
+    For each number of years, the history is written to one file per buy
+    year. The years before the last one are washed with yearly_wash first, so
+    the time for yearly_wash is that of adding the newest year, as it would be
+    run once a year.
+
+    Args:
+        parsed: The parsed command line arguments.
+    """
+    for num_years in parsed.years:
+        lots = generate_lots(parsed.lots_per_year * num_years,
+                             parsed.trades_per_day, split_ratio=0.1)
+        by_year = collections.OrderedDict()
+        for lot in sorted(lots, key=lots_lib.Lot.original_buy_date_key):
+            by_year.setdefault(lot.buy_date.year, []).append(lot)
+        temp_dir = tempfile.mkdtemp()
+        try:
+            paths = []
+            for year, year_lots in by_year.items():
+                paths.append(os.path.join(temp_dir, '{}.csv'.format(year)))
+                with open(paths[-1], 'w', newline='') as f:
+                    lots_lib.Lots(year_lots).write_csv_data(f)
+
+            def wash_together():
+                all_lots = []
+                for path in paths:
+                    with open(path, newline='') as f:
+                        all_lots.extend(lots_lib.Lots.iter_csv_data(f))
+                wash_lib.event_wash_all_lots(lots_lib.Lots(all_lots))
+
+            checkpoints = yearly_wash.Checkpoints(
+                os.path.join(temp_dir, 'checkpoints'))
+            yearly_wash.wash_years(paths[:-1], checkpoints)
+            together_seconds = min(timeit.repeat(
+                wash_together, number=1, repeat=parsed.repeat))
+            yearly_seconds = min(timeit.repeat(
+                lambda: yearly_wash.wash_years(paths, checkpoints),
+                number=1, repeat=parsed.repeat))
+        finally:
+            shutil.rmtree(temp_dir)
+        print('{:>3} years, {:>7} lots: together {:8.3f} s, newest year '
+              '{:8.3f} s'.format(len(paths), lots.size(), together_seconds,
+                                 yearly_seconds))
+
+
+def _git_commit():
+    """Returns the git commit that this file is checked out at, or None."""
+    try:
+        with open(os.devnull, 'w') as devnull:
+            return subprocess.check_output(
+                ['git', 'rev-parse', 'HEAD'], stderr=devnull,
+                cwd=os.path.dirname(os.path.abspath(__file__)),
+                universal_newlines=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def benchmark_pipeline(parsed):
+    """Times parsing, washing and writing a synthetic trading history.
+
+    Each step is timed separately, and the fastest of the repeats is kept.
+    If a json file is given, the results are appended to the list of results
+    in it, along with the commit and the parameters, so that they can be
+    compared with other commits.
+
+    Args:
+        parsed: The parsed command line arguments.
+    """
+    params = {
+        'num_lots': parsed.num_lots,
+        'trades_per_day': parsed.trades_per_day,
+        'loss_ratio': parsed.loss_ratio,
+        'unsold_ratio': parsed.unsold_ratio,
+        'split_ratio': parsed.split_ratio,
+        'max_split_rows': parsed.max_split_rows,
+        'num_symbols': parsed.num_symbols,
+        'seed': parsed.seed,
+        'engine': parsed.engine,
+        'by_symbol': parsed.by_symbol,
+    }
+    fd, in_path = tempfile.mkstemp(suffix='.csv')
+    fd_out, out_path = tempfile.mkstemp(suffix='.csv')
+    os.close(fd_out)
+    times = {'parse': [], 'wash': [], 'write': []}
+    try:
+        with os.fdopen(fd, 'w', newline='') as f:
+            generate_lots(parsed.num_lots, parsed.trades_per_day,
+                          parsed.loss_ratio, parsed.unsold_ratio,
+                          parsed.split_ratio, parsed.max_split_rows,
+                          parsed.num_symbols, parsed.seed).write_csv_data(f)
+        for _ in range(parsed.repeat):
+            start = timeit.default_timer()
+            with open(in_path, newline='') as f:
+                lots = lots_lib.Lots.create_from_csv_data(f)
+            times['parse'].append(timeit.default_timer() - start)
+
+            start = timeit.default_timer()
+            if parsed.by_symbol:
+                lots = wash_lib.wash_partitions(
+                    wash_lib.partition_lots(lots), parsed.engine, parsed.jobs)
+            else:
+                wash_lib.ENGINES[parsed.engine](lots,
+                                                logger_lib.NullLogger())
+            times['wash'].append(timeit.default_timer() - start)
+
+            start = timeit.default_timer()
+            with open(out_path, 'w', newline='') as f:
+                lots.write_csv_data(f)
+            times['write'].append(timeit.default_timer() - start)
+    finally:
+        os.remove(in_path)
+        os.remove(out_path)
+
+    seconds = dict((step, min(step_times))
+                   for step, step_times in times.items())
+    print('{} lots'.format(parsed.num_lots))
+    for step in ['parse', 'wash', 'write']:
+        print('{:>6}: {:10.3f} s {:10.0f} lots per second'.format(
+            step, seconds[step], parsed.num_lots / seconds[step]))
+
+    if parsed.json:
+        results = []
+        if os.path.exists(parsed.json):
+            with open(parsed.json) as f:
+                results = json.load(f)
+        results.append({
+            'commit': _git_commit(),
+            'python': platform.python_version(),
+            'date': datetime.datetime.now().isoformat(),
+            'params': params,
+            'seconds': seconds,
+        })
+        with open(parsed.json, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-r', '--repeat', type=int, default=3)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    lookup_parser = subparsers.add_parser('replacement_lookup')
+    lookup_parser.add_argument('-n', '--num_lots', type=int, default=20000)
+    lookup_parser.add_argument('-t', '--trades_per_day', type=int, default=50)
+    lookup_parser.add_argument('-l', '--num_losses', type=int, default=200)
+    lookup_parser.set_defaults(func=benchmark_replacement_lookup)
+
+    candidates_parser = subparsers.add_parser('candidates')
+    candidates_parser.add_argument('-n', '--num_lots', type=int,
+                                   default=50000)
+    candidates_parser.add_argument('-t', '--trades_per_day', type=int,
+                                   default=500)
+    candidates_parser.set_defaults(func=benchmark_candidates)
+
+    split_parser = subparsers.add_parser('split')
+    split_parser.add_argument('-n', '--num_splits', type=int, default=20000)
+    split_parser.set_defaults(func=benchmark_split)
+
+    parse_parser = subparsers.add_parser('parse')
+    parse_parser.add_argument('-n', '--num_lots', type=int, default=50000)
+    parse_parser.add_argument('-t', '--trades_per_day', type=int, default=10)
+    parse_parser.set_defaults(func=benchmark_parse)
+
+    chain_parser = subparsers.add_parser('chain')
+    chain_parser.add_argument('-n', '--num_lots', type=int, nargs='+',
+                              default=[1000, 2000, 4000])
+    chain_parser.set_defaults(func=benchmark_chain)
+
+    drip_parser = subparsers.add_parser('drip')
+    drip_parser.add_argument('-n', '--num_buys', type=int, nargs='+',
+                             default=[100, 1000, 4000])
+    drip_parser.set_defaults(func=benchmark_drip)
+
+    io_parser = subparsers.add_parser('io')
+    io_parser.add_argument('-n', '--num_lots', type=int, default=50000)
+    io_parser.set_defaults(func=benchmark_io)
+
+    memory_parser = subparsers.add_parser('memory')
+    memory_parser.add_argument('-n', '--num_lots', type=int, default=100000)
+    memory_parser.add_argument('-b', '--backend', choices=['lot', 'table'])
+    # Used internally, to measure one backend in a separate process.
+    memory_parser.add_argument('--load', metavar='csv_file',
+                               help=argparse.SUPPRESS)
+    memory_parser.set_defaults(func=benchmark_memory)
+
+    render_parser = subparsers.add_parser('render')
+    render_parser.add_argument('-n', '--num_lots', type=int, default=50000)
+    render_parser.add_argument('-t', '--trades_per_day', type=int, default=10)
+    render_parser.add_argument('-l', '--num_highlighted', type=int,
+                               default=50)
+    render_parser.set_defaults(func=benchmark_render)
+
+    compare_parser = subparsers.add_parser('compare')
+    compare_parser.add_argument('-n', '--num_lots', type=int, default=5000)
+    compare_parser.add_argument('-t', '--trades_per_day', type=int,
+                                default=10)
+    compare_parser.set_defaults(func=benchmark_compare)
+
+    service_parser = subparsers.add_parser('service')
+    service_parser.add_argument('-n', '--num_lots', type=int, default=5000)
+    service_parser.add_argument('-t', '--trades_per_day', type=int,
+                                default=10)
+    service_parser.add_argument('-p', '--periods', type=int, default=1)
+    service_parser.set_defaults(func=benchmark_service)
+
+    years_parser = subparsers.add_parser('years')
+    years_parser.add_argument('-y', '--years', type=int, nargs='+',
+                              default=[2, 4, 8])
+    years_parser.add_argument('-l', '--lots_per_year', type=int,
+                              default=2000)
+    years_parser.add_argument('-t', '--trades_per_day', type=int, default=10)
+    years_parser.set_defaults(func=benchmark_years)
+
+    pipeline_parser = subparsers.add_parser('pipeline')
+    pipeline_parser.add_argument('-n', '--num_lots', type=int, default=10000)
+    pipeline_parser.add_argument('-t', '--trades_per_day', type=int,
+                                 default=10)
+    pipeline_parser.add_argument('--loss_ratio', type=float, default=0.5)
+    pipeline_parser.add_argument('--unsold_ratio', type=float, default=0.1)
+    pipeline_parser.add_argument('--split_ratio', type=float, default=0.1)
+    pipeline_parser.add_argument('--max_split_rows', type=int, default=3)
+    pipeline_parser.add_argument('--num_symbols', type=int, default=1)
+    pipeline_parser.add_argument('--seed', type=int, default=0)
+    pipeline_parser.add_argument('-e', '--engine',
+                                 choices=sorted(wash_lib.ENGINES),
+                                 default='event')
+    pipeline_parser.add_argument('-s', '--by_symbol', action='store_true')
+    pipeline_parser.add_argument('-j', '--jobs', type=int)
+    pipeline_parser.add_argument('--json', metavar='json_file')
+    pipeline_parser.set_defaults(func=benchmark_pipeline)
+
+    parsed = parser.parse_args()
+    parsed.func(parsed)
+
+
+if __name__ == "__main__":
+    main()
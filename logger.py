@@ -1,9 +1,25 @@
 import abc
+import collections
+import json
+import timeit
 
+import lots as lots_lib
 
-class Logger(object):
-    __metaclass__ = abc.ABCMeta
 
+class _NullTimer(object):
+    """A timer that does nothing, for loggers that don't keep stats."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class Logger(object, metaclass=abc.ABCMeta):
     @abc.abstractmethod
     def print_lots(self,
                    message,
@@ -24,6 +40,25 @@ class Logger(object):
         """
         raise NotImplementedError()
 
+    def count(self, name, value=1):
+        """Adds to a counter. Does nothing unless a subclass keeps stats.
+
+        Args:
+            name: A string, the name of the counter.
+            value: An integer to add to the counter.
+        """
+        pass
+
+    def timer(self, name):
+        """Times a phase of the wash. Does nothing unless a subclass keeps stats.
+
+        Args:
+            name: A string, the name of the phase.
+        Returns:
+            A context manager, which times the code run inside of it.
+        """
+        return _NULL_TIMER
+
 
 class TermLogger(Logger):
     def print_lots(self,
@@ -33,10 +68,10 @@ class TermLogger(Logger):
                    split_off_loss_lots=None,
                    replacement_lots=None,
                    split_off_replacement_lots=None):
-        print ''
+        print()
         lots.do_print(loss_lots, split_off_loss_lots, replacement_lots,
                       split_off_replacement_lots)
-        raw_input(message + '. Hit enter to continue>')
+        input(message + '. Hit enter to continue>')
 
 
 class NullLogger(Logger):
@@ -48,3 +83,194 @@ class NullLogger(Logger):
                    replacement_lots=None,
                    split_off_replacement_lots=None):
         pass
+
+
+class _Timer(object):
+    """Adds the time spent inside of it to a StatsLogger."""
+
+    def __init__(self, stats_logger, name):
+        self._stats_logger = stats_logger
+        self._name = name
+        self._start = None
+
+    def __enter__(self):
+        self._start = timeit.default_timer()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._stats_logger.seconds[self._name] += (
+            timeit.default_timer() - self._start)
+        return False
+
+
+class StatsLogger(Logger):
+    """Keeps counters and timers of what the wash engines do.
+
+    Printing lots is passed on to another logger, so that the stats can be
+    kept while the lots are printed or not.
+    """
+
+    def __init__(self, logger=None):
+        """Creates a StatsLogger.
+
+        Args:
+            logger: The Logger to print lots with, or None to not print them.
+        """
+        self._logger = logger or NullLogger()
+        self.counts = collections.Counter()
+        self.seconds = collections.Counter()
+
+    def print_lots(self,
+                   message,
+                   lots,
+                   loss_lots=None,
+                   split_off_loss_lots=None,
+                   replacement_lots=None,
+                   split_off_replacement_lots=None):
+        self._logger.print_lots(message, lots, loss_lots, split_off_loss_lots,
+                                replacement_lots, split_off_replacement_lots)
+
+    def count(self, name, value=1):
+        self.counts[name] += value
+
+    def timer(self, name):
+        return _Timer(self, name)
+
+    def stats(self):
+        """Returns the counters and timers.
+
+        Returns:
+            A dict with the counters under 'counts' and the number of seconds
+            spent in each phase under 'seconds'.
+        """
+        return {'counts': dict(self.counts), 'seconds': dict(self.seconds)}
+
+    def print_stats(self, as_json=False):
+        """Prints out the counters and timers.
+
+        Args:
+            as_json: If True, prints the stats as a json object. Otherwise,
+                prints a table.
+        """
+        if as_json:
+            print(json.dumps(self.stats(), sort_keys=True))
+            return
+        for name in sorted(self.counts):
+            print('{:<24} {:>12}'.format(name, self.counts[name]))
+        for name in sorted(self.seconds):
+            print('{:<24} {:>12.3f} s'.format(name, self.seconds[name]))
+
+
+class TraceLogger(Logger):
+    """Records each step of the wash to a file, in JSON Lines format.
+
+    Each line is a json object for one call to print_lots, with the message,
+    the ids of the highlighted lots, and only the fields of lots that changed
+    since they were last recorded. The first step records every lot, and after
+    that only the lots highlighted in this step or the one before are looked
+    at, unless lots were added or removed some other way. So each step costs
+    about the same no matter how many lots there are. replay_trace.py can
+    print the lots at any step.
+    """
+
+    # Without sort_keys or indent, json can use its faster C encoder.
+    _ENCODER = json.JSONEncoder(separators=(',', ':'))
+
+    def __init__(self, trace_file):
+        """Creates a TraceLogger.
+
+        Args:
+            trace_file: A file object to write to. Should be buffered.
+        """
+        self._trace_file = trace_file
+        self._step = 0
+        # Lot id to a tuple of the field values and the csv row of the lot when
+        # it was last recorded.
+        self._rows = {}
+        # The wash engines change the highlighted lots after printing them,
+        # so they are looked at again in the next step.
+        self._last_highlighted = []
+        # The Lots object of the last step, and its change_counts then.
+        self._last_lots = None
+        self._last_counts = None
+
+    @staticmethod
+    def _lot_id(lot):
+        return lot._lot_number
+
+    @staticmethod
+    def _values(lot):
+        return [getattr(lot, field) for field in lots_lib.Lot.FIELD_NAMES]
+
+    def _record(self, lot, changes):
+        """Records the fields of lot that changed since it was last recorded.
+
+        Args:
+            lot: A Lot.
+            changes: A list to add a [lot id, changed fields] pair to.
+        """
+        lot_id = self._lot_id(lot)
+        values = self._values(lot)
+        old_values, old_row = self._rows.get(lot_id, (None, {}))
+        if values == old_values:
+            return
+        row = lots_lib.Lots.csv_row(lot)
+        changes.append([lot_id, dict(
+            (field, value) for field, value in row.items()
+            if old_row.get(field) != value)])
+        self._rows[lot_id] = (values, row)
+
+    def print_lots(self,
+                   message,
+                   lots,
+                   loss_lots=None,
+                   split_off_loss_lots=None,
+                   replacement_lots=None,
+                   split_off_replacement_lots=None):
+        self._step += 1
+        record = {'step': self._step, 'message': message}
+        changes = []
+        highlighted = []
+        for key, highlighted_lots in [
+                ('loss', loss_lots),
+                ('split_off_loss', split_off_loss_lots),
+                ('replacement', replacement_lots),
+                ('split_off_replacement', split_off_replacement_lots)]:
+            highlighted_lots = [lot for lot in highlighted_lots or [] if lot]
+            if highlighted_lots:
+                record[key] = [self._lot_id(lot) for lot in highlighted_lots]
+                highlighted.extend(highlighted_lots)
+        num_new = len(set(self._lot_id(lot) for lot in highlighted
+                          if self._lot_id(lot) not in self._rows))
+        num_added, num_removed = lots.change_counts()
+        if (lots is not self._last_lots or
+                num_removed != self._last_counts[1] or
+                num_added - self._last_counts[0] != num_new or
+                lots.size() != len(self._rows) + num_new):
+            # Lots were added or removed without being highlighted, so look
+            # at all of them. Comparing the counts, and not only the number
+            # of lots, catches a removal and an addition that cancel out.
+            lot_ids = set()
+            for lot in lots:
+                lot_ids.add(self._lot_id(lot))
+                if self._lot_id(lot) not in self._rows:
+                    self._record(lot, changes)
+            removed = [lot_id for lot_id in self._rows
+                       if lot_id not in lot_ids]
+            if removed:
+                record['removed'] = sorted(removed)
+                for lot_id in removed:
+                    del self._rows[lot_id]
+        for lot in self._last_highlighted:
+            # Unless it was removed since.
+            if self._lot_id(lot) in self._rows:
+                self._record(lot, changes)
+        for lot in highlighted:
+            self._record(lot, changes)
+        self._last_highlighted = highlighted
+        self._last_lots = lots
+        self._last_counts = (num_added, num_removed)
+        if changes:
+            record['lots'] = changes
+        self._trace_file.write(self._ENCODER.encode(record))
+        self._trace_file.write('\n')
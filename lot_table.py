@@ -0,0 +1,145 @@
+import array
+import datetime
+
+import lots as lots_lib
+
+
+def _to_ordinal(date):
+    if date:
+        return date.toordinal()
+    return 0
+
+
+def _from_ordinal(ordinal):
+    if ordinal:
+        return datetime.date.fromordinal(ordinal)
+    return None
+
+
+class LotTable(object):
+    """Stores lots in columns, instead of as one object per lot.
+
+    Integers and dates (as day ordinals, with 0 for None) are stored in typed
+    arrays, and strings are shared between all of the lots that have the same
+    value. The lots are accessed through TableLot objects, which only hold the
+    table and a row number, and behave like a lots_lib.Lot.
+    """
+
+    # Fields stored in an array of integers.
+    _INT_FIELDS = ['num_shares', 'basis', 'adjusted_basis', 'proceeds',
+                   'adjustment', '_lot_number']
+    # Fields stored in an array of day ordinals.
+    _DATE_FIELDS = ['buy_date', 'adjusted_buy_date', 'sell_date']
+    # Fields stored in an array of 0 or 1.
+    _BOOL_FIELDS = ['is_replacement', 'loss_processed']
+    # Fields stored in a list of strings.
+    _STRING_FIELDS = ['symbol', 'description', 'adjustment_code',
+                      'form_position', 'buy_lot']
+
+    def __init__(self):
+        self._columns = {}
+        for field in self._INT_FIELDS + self._DATE_FIELDS:
+            self._columns[field] = array.array('l')
+        for field in self._BOOL_FIELDS:
+            self._columns[field] = array.array('b')
+        for field in self._STRING_FIELDS:
+            self._columns[field] = []
+        # ReplacementChains, which are immutable, so they are shared with the
+        # lots that they came from.
+        self._columns['replacement_for'] = []
+        self._strings = {}
+
+    def __len__(self):
+        return len(self._columns['num_shares'])
+
+    def _intern(self, value):
+        return self._strings.setdefault(value, value)
+
+    def append(self, lot):
+        """Adds a copy of a lot to the table.
+
+        Args:
+            lot: A lots_lib.BaseLot.
+        Returns:
+            A TableLot for the new row.
+        """
+        columns = self._columns
+        for field in self._INT_FIELDS:
+            columns[field].append(getattr(lot, field))
+        for field in self._DATE_FIELDS:
+            columns[field].append(_to_ordinal(getattr(lot, field)))
+        for field in self._BOOL_FIELDS:
+            columns[field].append(1 if getattr(lot, field) else 0)
+        for field in self._STRING_FIELDS:
+            columns[field].append(self._intern(getattr(lot, field)))
+        columns['replacement_for'].append(
+            lots_lib.ReplacementChain.of(lot.replacement_for))
+        return TableLot(self, len(self) - 1)
+
+    def lots(self):
+        """Returns a list of TableLot objects, one for each row."""
+        return [TableLot(self, row) for row in range(len(self))]
+
+    @staticmethod
+    def create_from_csv_data(data):
+        """Creates a LotTable from csv data.
+
+        Args:
+            data: An iterable of strings, in the format read by
+                lots_lib.Lots.create_from_csv_data.
+        Returns:
+            A LotTable.
+        """
+        table = LotTable()
+        for lot in lots_lib.Lots.iter_csv_data(data):
+            table.append(lot)
+        return table
+
+
+class TableLot(lots_lib.BaseLot):
+    """A view of one row of a LotTable, which can be used like a Lot."""
+
+    __slots__ = ('_table', '_row')
+
+    def __init__(self, table, row):
+        self._table = table
+        self._row = row
+
+    def clone(self):
+        new_lot = self._table.append(self)
+        new_lot._lot_number = lots_lib.new_lot_number()
+        return new_lot
+
+
+def _field_property(field, from_column, to_column):
+    def getter(lot):
+        return from_column(lot._table._columns[field][lot._row])
+
+    def setter(lot, value):
+        lots_lib.sort_field_will_change(lot, field)
+        lot._table._columns[field][lot._row] = to_column(value)
+
+    return property(getter, setter)
+
+
+def _identity(value):
+    return value
+
+
+for _field in LotTable._INT_FIELDS:
+    setattr(TableLot, _field, _field_property(_field, _identity, _identity))
+for _field in LotTable._DATE_FIELDS:
+    setattr(TableLot, _field,
+            _field_property(_field, _from_ordinal, _to_ordinal))
+for _field in LotTable._BOOL_FIELDS:
+    setattr(TableLot, _field, _field_property(_field, bool, int))
+for _field in LotTable._STRING_FIELDS:
+    setattr(TableLot, _field, _field_property(_field, _identity, _identity))
+TableLot.replacement_for = _field_property(
+    'replacement_for', _identity, lots_lib.ReplacementChain.of)
+# The dates are stored as ordinals already.
+TableLot.buy_ordinal = property(
+    lambda lot: lot._table._columns['buy_date'][lot._row])
+TableLot.sell_ordinal = property(
+    lambda lot: (lot._table._columns['sell_date'][lot._row] or
+                 lots_lib.NOT_SOLD))
@@ -0,0 +1,93 @@
+import datetime
+import os
+import unittest
+
+import lot_table
+import lots as lots_lib
+import wash
+
+
+class TestLotTable(unittest.TestCase):
+
+    def setUp(self):
+        self.lot = lots_lib.Lot(
+            10, 'ABC', 'A', datetime.date(2014, 9, 15), datetime.date(
+                2014, 9, 14), 2000, 2100, datetime.date(2014, 10, 5), 1800,
+            'W', 200, 'form1', 'lot1', ['lot3', 'lot4'], True, True)
+        self.unsold_lot = lots_lib.Lot(
+            20, 'ABC', 'A', datetime.date(2014, 9, 25), datetime.date(
+                2014, 9, 25), 3000, 3000, None, 0, '', 0, '', 'lot2', [],
+            False, False)
+
+    def test_append(self):
+        table = lot_table.LotTable()
+        table_lot = table.append(self.lot)
+        table_unsold_lot = table.append(self.unsold_lot)
+        self.assertEqual(2, len(table))
+        self.assertEqual(self.lot, table_lot)
+        self.assertEqual(self.unsold_lot, table_unsold_lot)
+        self.assertIsNone(table_unsold_lot.sell_date)
+        self.assertIs(False, table_unsold_lot.is_replacement)
+        self.assertEqual([table_lot, table_unsold_lot], table.lots())
+        for lot, table_lot in [(self.lot, table_lot),
+                               (self.unsold_lot, table_unsold_lot)]:
+            self.assertEqual(lot.buy_ordinal, table_lot.buy_ordinal)
+            self.assertEqual(lot.sell_ordinal, table_lot.sell_ordinal)
+            self.assertEqual(lots_lib.Lot.sell_date_key(lot),
+                             lots_lib.Lot.sell_date_key(table_lot))
+        self.assertEqual(lots_lib.NOT_SOLD, table_unsold_lot.sell_ordinal)
+
+    def test_set_fields(self):
+        table = lot_table.LotTable()
+        table_lot = table.append(self.unsold_lot)
+        table_lot.adjusted_buy_date = datetime.date(2014, 9, 1)
+        table_lot.adjusted_basis = 3100
+        table_lot.replacement_for = ['lot1']
+        table_lot.is_replacement = True
+        self.assertEqual(datetime.date(2014, 9, 1),
+                         table.lots()[0].adjusted_buy_date)
+        self.assertEqual(3100, table.lots()[0].adjusted_basis)
+        self.assertEqual(['lot1'], table.lots()[0].replacement_for)
+        self.assertIs(True, table.lots()[0].is_replacement)
+
+    def test_sort_after_set_fields(self):
+        table = lot_table.LotTable()
+        table.append(self.lot)
+        table.append(self.unsold_lot)
+        lots = lots_lib.Lots(table.lots())
+        lots.sort(key=lots_lib.Lot.buy_date_key)
+        self.assertEqual([self.lot, self.unsold_lot], lots.lots())
+        # Another view of the same row moves it.
+        table.lots()[0].adjusted_buy_date = datetime.date(2014, 9, 30)
+        lots.sort(key=lots_lib.Lot.buy_date_key)
+        self.assertEqual([self.unsold_lot], lots.lots()[:1])
+
+    def test_clone(self):
+        table = lot_table.LotTable()
+        table_lot = table.append(self.lot)
+        new_lot = table_lot.clone()
+        self.assertEqual(2, len(table))
+        self.assertEqual(table_lot, new_lot)
+        self.assertGreater(new_lot._lot_number, table_lot._lot_number)
+        new_lot.replacement_for = new_lot.replacement_for.appended('lot5')
+        self.assertEqual(['lot3', 'lot4'], table_lot.replacement_for)
+        self.assertEqual(['lot3', 'lot4', 'lot5'], new_lot.replacement_for)
+
+    def test_wash(self):
+        # Washing the lots in a table gives the same result as washing Lot
+        # objects.
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            'tests', 'multiple_small_replacement_lots.csv')
+        with open(path) as f:
+            expected = lots_lib.Lots.create_from_csv_data(f)
+        with open(path) as f:
+            lots = lots_lib.Lots(
+                lot_table.LotTable.create_from_csv_data(f).lots())
+        wash.event_wash_all_lots(expected)
+        wash.event_wash_all_lots(lots)
+        self.assertEqual(5, lots.size())
+        self.assertTrue(lots.contents_equal(expected))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,20 +1,55 @@
-import copy
+import bisect
+import collections
 import csv
 import datetime
-
-_HAS_TERMINALTABLES = False
-try:
-    import terminaltables
-    _HAS_TERMINALTABLES = True
-except ImportError:
-    print 'Install terminaltables library for formatting tables.'
-
-_HAS_COLORCLASS = False
-try:
-    import colorclass
-    _HAS_COLORCLASS = True
-except ImportError:
-    print 'Install colorclass library for color coding changes.'
+import heapq
+import itertools
+import operator
+import weakref
+
+# The optional libraries that lots are displayed with. They are imported by
+# _import_display_libraries the first time that lots are displayed, since most
+# runs never display any, and importing them slows down starting up. These are
+# None until then.
+_HAS_TERMINALTABLES = None
+_HAS_COLORCLASS = None
+
+
+def _import_display_libraries():
+    """Imports terminaltables and colorclass, if they are installed."""
+    global _HAS_TERMINALTABLES, _HAS_COLORCLASS, terminaltables, colorclass
+    if _HAS_TERMINALTABLES is not None:
+        return
+    try:
+        import terminaltables
+        _HAS_TERMINALTABLES = True
+    except ImportError:
+        _HAS_TERMINALTABLES = False
+        print('Install terminaltables library for formatting tables.')
+    try:
+        import colorclass
+        _HAS_COLORCLASS = True
+    except ImportError:
+        _HAS_COLORCLASS = False
+        print('Install colorclass library for color coding changes.')
+
+
+# numpy is optional, and only speeds up finding replacement lots in large
+# windows. It is imported by _import_numpy the first time that one is
+# searched, and _HAS_NUMPY is None until then.
+_HAS_NUMPY = None
+
+
+def _import_numpy():
+    """Imports numpy, if it is installed."""
+    global _HAS_NUMPY, numpy
+    if _HAS_NUMPY is not None:
+        return
+    try:
+        import numpy
+        _HAS_NUMPY = True
+    except ImportError:
+        _HAS_NUMPY = False
 
 
 # This is a global value for the number of lots that have been created. It is
@@ -22,13 +57,247 @@ except ImportError:
 # which is done in a number of different places.
 _LOT_COUNT = 0
 
+# The sell ordinal of lots that are not sold, which is after every date.
+NOT_SOLD = datetime.date.max.toordinal() + 1
+
+
+def new_lot_number():
+    """Returns the lot number for a newly created lot."""
+    global _LOT_COUNT
+    lot_number = _LOT_COUNT
+    _LOT_COUNT += 1
+    return lot_number
+
+
+def reserve_lot_numbers(lots):
+    """Makes sure that lots created from now on are numbered after lots.
+
+    Lot numbers are only unique within a process, so this is needed before new
+    lots are split off of lots that were created in another process.
+
+    Args:
+        lots: An iterable of Lot objects.
+    """
+    global _LOT_COUNT
+    for lot in lots:
+        _LOT_COUNT = max(_LOT_COUNT, lot._lot_number + 1)
+
+
+def _parse_date(value):
+    """Parses a date in mm/dd/yyyy format.
+
+    This is the same as datetime.datetime.strptime(value, '%m/%d/%Y').date(),
+    but several times faster for dates in the expected format.
+
+    Args:
+        value: A string.
+    Returns:
+        A datetime.date.
+    Raises:
+        ValueError: If the string is not a date in mm/dd/yyyy format.
+    """
+    parts = value.split('/')
+    # Only ASCII digits, in fields of the lengths that strptime accepts.
+    if (len(parts) == 3 and 1 <= len(parts[0]) <= 2 and
+            1 <= len(parts[1]) <= 2 and len(parts[2]) == 4 and
+            value.isascii() and all(part.isdigit() for part in parts)):
+        return datetime.date(int(parts[2]), int(parts[0]), int(parts[1]))
+    # Let strptime accept or reject anything unusual.
+    return datetime.datetime.strptime(value, '%m/%d/%Y').date()
+
+
+def split_amount(amount, num_shares, total_shares):
+    """Finds the part of an amount of cents that belongs to some shares.
+
+    This is amount * num_shares / total_shares, rounded to the nearest cent
+    with halves rounded up. The other shares get amount minus the result, so
+    the two parts always add up to the amount. This is the same as giving
+    the leftover cent to the part with the largest remainder, and to the
+    first part if they tie.
+
+    Args:
+        amount: An integer number of cents.
+        num_shares: An integer, the number of shares to find the part of.
+        total_shares: A positive integer, the number of shares that the
+            amount is for.
+    Returns:
+        An integer number of cents.
+    """
+    part, remainder = divmod(amount * num_shares, total_shares)
+    if 2 * remainder >= total_shares:
+        part += 1
+    return part
+
 
 class BadHeadersError(Exception):
     """Raised if the headers that are parsed are not in the correct format."""
 
 
-class Lot(object):
-    """Models a single lot of stock."""
+class _Spine(object):
+    """A run of ReplacementChains that were each appended to the one before.
+
+    Only the longest chain in a spine, its tip, can be appended to without
+    starting a new spine, so a chain in the spine contains exactly the buy
+    lots that were added to the spine up to its length, plus those of the
+    chain that the spine started from.
+    """
+
+    __slots__ = ('base', 'tip', 'depths')
+
+    def __init__(self, base):
+        # The chain that this spine was appended to.
+        self.base = base
+        # The length of the longest chain in this spine.
+        self.tip = base._length
+        # Buy lot to the length of the first chain in this spine with it.
+        self.depths = {}
+
+
+class ReplacementChain(object):
+    """An immutable list of the buy lots that a lot is a replacement for.
+
+    Each chain is the chain that it was appended to, plus one buy lot. When a
+    loss is washed, the replacement's chain is the loss's chain plus the
+    loss's buy lot, so chains share their earlier buy lots instead of copying
+    them, and appending is O(1) no matter how long the chain is.
+
+    Checking whether a buy lot is in a chain takes one dict lookup per _Spine
+    that the chain goes through, which is one unless the chain branched off of
+    another one, for example when a loss was split and both parts were washed.
+
+    A chain compares equal to a list with the same buy lots.
+    """
+
+    __slots__ = ('_parent', '_buy_lot', '_length', '_spine')
+
+    def __init__(self, buy_lots=()):
+        """Creates a chain.
+
+        Args:
+            buy_lots: An iterable of strings, the buy lots in order.
+        """
+        chain = _EMPTY_CHAIN.extended(buy_lots) if buy_lots else None
+        self._parent = chain and chain._parent
+        self._buy_lot = chain and chain._buy_lot
+        self._length = chain._length if chain else 0
+        self._spine = chain and chain._spine
+
+    @staticmethod
+    def of(buy_lots):
+        """Returns buy_lots as a chain, without copying it if it is one."""
+        if isinstance(buy_lots, ReplacementChain):
+            return buy_lots
+        if not buy_lots:
+            return _EMPTY_CHAIN
+        return _EMPTY_CHAIN.extended(buy_lots)
+
+    def appended(self, buy_lot):
+        """Returns a new chain with buy_lot after the buy lots of this one.
+
+        Args:
+            buy_lot: A string.
+        Returns:
+            A ReplacementChain. This chain is not changed.
+        """
+        spine = self._spine
+        if spine is None or spine.tip != self._length:
+            # This chain was already appended to, so start a new spine.
+            spine = _Spine(self)
+        chain = ReplacementChain.__new__(ReplacementChain)
+        chain._parent = self
+        chain._buy_lot = buy_lot
+        chain._length = self._length + 1
+        chain._spine = spine
+        spine.tip = chain._length
+        spine.depths.setdefault(buy_lot, chain._length)
+        return chain
+
+    def extended(self, buy_lots):
+        """Returns a new chain with buy_lots after the buy lots of this one.
+
+        Args:
+            buy_lots: An iterable of strings, such as another chain.
+        Returns:
+            A ReplacementChain. This chain is not changed.
+        """
+        if not self._length and isinstance(buy_lots, ReplacementChain):
+            return buy_lots
+        chain = self
+        for buy_lot in buy_lots:
+            chain = chain.appended(buy_lot)
+        return chain
+
+    def __len__(self):
+        return self._length
+
+    def __contains__(self, buy_lot):
+        spine = self._spine
+        length = self._length
+        while spine is not None:
+            depth = spine.depths.get(buy_lot)
+            if depth is not None and depth <= length:
+                return True
+            length = spine.base._length
+            spine = spine.base._spine
+        return False
+
+    def __iter__(self):
+        buy_lots = []
+        node = self
+        while node._length:
+            buy_lots.append(node._buy_lot)
+            node = node._parent
+        return reversed(buy_lots)
+
+    def __eq__(self, other):
+        if self is other:
+            return True
+        if isinstance(other, ReplacementChain):
+            if self._length != other._length:
+                return False
+        elif not isinstance(other, (list, tuple)):
+            return NotImplemented
+        return list(self) == list(other)
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        if equal is NotImplemented:
+            return equal
+        return not equal
+
+    __hash__ = None
+
+    def __repr__(self):
+        return 'ReplacementChain({!r})'.format(list(self))
+
+    # Chains are immutable, and may be too long to copy or pickle
+    # recursively.
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __reduce__(self):
+        return (ReplacementChain, (list(self),))
+
+
+_EMPTY_CHAIN = ReplacementChain()
+
+
+# The fields that split divides between lots in proportion to their shares.
+_SPLIT_FIELDS = ['basis', 'adjusted_basis', 'proceeds', 'adjustment']
+
+
+class BaseLot(object):
+    """The methods shared by Lot and lot_table.TableLot.
+
+    Subclasses provide each of the fields in FIELD_NAMES, and _lot_number, as
+    attributes.
+    """
+
+    __slots__ = ()
 
     # A list of the field names for a Lot.
     FIELD_NAMES = ['num_shares', 'symbol', 'description', 'buy_date',
@@ -37,64 +306,69 @@ class Lot(object):
                    'form_position', 'buy_lot', 'replacement_for',
                    'is_replacement', 'loss_processed']
 
-    def __init__(self, num_shares, symbol, description, buy_date,
-                 adjusted_buy_date, basis, adjusted_basis, sell_date, proceeds,
-                 adjustment_code, adjustment, form_position, buy_lot,
-                 replacement_for, is_replacement, loss_processed):
-        """Initializes a lot.
+    def clone(self):
+        """Returns a deep copy of this lot.
+
+        Unlike copy.deepcopy, the copy gets its own lot number, so that it is
+        sorted after all of the existing lots that it would otherwise tie
+        with.
+        """
+        raise NotImplementedError()
+
+    def split(self, num_shares):
+        """Splits this lot in two.
+
+        This lot keeps num_shares of its shares, and the rest are moved to a
+        new lot. The basis, adjusted basis, proceeds and adjustment are divided
+        between the two lots in proportion to their number of shares, with
+        split_amount, so the two lots add up to the amounts of the original.
 
         Args:
-            num_shares: An integer.
-            symbol: A string, the stock symbol.
-            description: A string, an arbitrary description of this lot.
-            buy_date: A datetime.date, the original buy date of the shares.
-            adjusted_buy_date: A datetime.date, the possibly-adjusted buy date
-                of the shares.
-            basis: An integer, the number of cents that the lot was bought for.
-            adjusted_basis: An integer, the possibly-adjusted number of cents
-                that the lot was bought for.
-            sell_date: A datetime.date or None.
-            proceeds: An integer, the number of cents that the lot was sold
-                for, or 0 if the lot is not sold.
-            adjustment_code: A string, basically 'W' in case this was a wash
-                sale.
-            adjustment: An integer, the number of cents of the disallowed loss,
-                or 0 if the lot is not sold.
-            form_position: A string, an arbitrary value that helps to determine
-                which lots are related when a lot is split.
-            buy_lot: A string, an arbitrary value that indicates that can be
-                used to indicate that multiple entries are part of the same
-                logical lot. An empty string indicates that this is a unique
-                lot.
-            replacement_for: A list of strings, possibly empty, the buy lots,
-                possibly a chain of them, that this is a replacement for.
-            is_replacement: A boolean, if true then this lot has been used as
-                replacement shares. Useful because a lot can only be used as
-                replacement shares once.
-            loss_processed: A boolean, whether this lot is a loss and has
-                already been processed for a potential wash sale.
+            num_shares: An integer, the number of shares that this lot should
+                contain.
+        Returns:
+            The new lot, with the other self.num_shares - num_shares shares.
         """
+        total_shares = self.num_shares
+        new_lot = self.clone()
+        new_lot.num_shares = total_shares - num_shares
+        for field in _SPLIT_FIELDS:
+            amount = getattr(self, field)
+            part = split_amount(amount, num_shares, total_shares)
+            setattr(self, field, part)
+            setattr(new_lot, field, amount - part)
         self.num_shares = num_shares
-        self.symbol = symbol
-        self.description = description
-        self.buy_date = buy_date
-        self.adjusted_buy_date = adjusted_buy_date
-        self.basis = basis
-        self.adjusted_basis = adjusted_basis
-        self.sell_date = sell_date
-        self.proceeds = proceeds
-        self.adjustment_code = adjustment_code
-        self.adjustment = adjustment
-        self.form_position = form_position
-        self.buy_lot = buy_lot
-        self.replacement_for = replacement_for
-        self.is_replacement = is_replacement
-        self.loss_processed = loss_processed
+        return new_lot
 
-        # The lot number is only used to sort otherwise equivalent lots.
-        global _LOT_COUNT
-        self._lot_number = _LOT_COUNT
-        _LOT_COUNT += 1
+    def split_many(self, num_shares):
+        """Splits this lot into several lots.
+
+        The result is the same as splitting this lot with split, then
+        splitting the new lot, and so on, without making the intermediate
+        lots.
+
+        Args:
+            num_shares: A list of integers. This lot keeps the first number of
+                shares, and each new lot but the last gets the next number of
+                shares. Together they must be fewer than self.num_shares.
+        Returns:
+            A list of len(num_shares) new lots. The last one has the shares
+            that are left.
+        """
+        total_shares = self.num_shares
+        amounts = [getattr(self, field) for field in _SPLIT_FIELDS]
+        new_lots = [self.clone() for _ in num_shares]
+        for lot, lot_shares in zip([self] + new_lots, num_shares):
+            for i, field in enumerate(_SPLIT_FIELDS):
+                part = split_amount(amounts[i], lot_shares, total_shares)
+                setattr(lot, field, part)
+                amounts[i] -= part
+            lot.num_shares = lot_shares
+            total_shares -= lot_shares
+        new_lots[-1].num_shares = total_shares
+        for field, amount in zip(_SPLIT_FIELDS, amounts):
+            setattr(new_lots[-1], field, amount)
+        return new_lots
 
     def is_loss(self):
         """Determines whether this lot is a loss.
@@ -128,6 +402,28 @@ class Lot(object):
     def __ne__(self, other):
         return not self == other
 
+    def key(self):
+        """Returns a hashable key of every field of this lot.
+
+        Two lots have the same key if and only if they are equal. Lots are not
+        hashable themselves, because their fields change as they are washed.
+        """
+        return (self.num_shares, self.symbol, self.description, self.buy_date,
+                self.adjusted_buy_date, self.basis, self.adjusted_basis,
+                self.sell_date, self.proceeds, self.adjustment_code,
+                self.adjustment, self.form_position, self.buy_lot,
+                tuple(self.replacement_for), self.is_replacement,
+                self.loss_processed)
+
+    def identity_key(self):
+        """Returns a hashable key of the fields that washing does not change.
+
+        Lots with the same identity key are the same trade, or portions of a
+        trade that was split, possibly with different adjustments.
+        """
+        return (self.symbol, self.buy_lot, self.buy_date, self.sell_date,
+                self.form_position)
+
     def __str__(self):
         return ' '.join(self.str_data())
 
@@ -151,56 +447,331 @@ class Lot(object):
                 '{}'.format(self.is_replacement),
                 '{}'.format(self.loss_processed)]
 
-    @staticmethod
-    def cmp_by_buy_date(a, b):
-        """Sorts two lots based on their (possibly adjusted) buy dates."""
-        if a.adjusted_buy_date != b.adjusted_buy_date:
-            return (a.adjusted_buy_date - b.adjusted_buy_date).days
-        if a.sell_date != b.sell_date:
-            if a.sell_date is None:
-                return 1
-            if b.sell_date is None:
-                return -1
-            return (a.sell_date - b.sell_date).days
-        if a.form_position != b.form_position:
-            if a.form_position < b.form_position:
-                return -1
-            return 1
-        return a._lot_number < b._lot_number
+    # The buy date and sell date as day ordinals, which are faster to compare
+    # than dates. Lots that are not sold have a sell ordinal after every date.
+    # Lot stores them, and these compute them for other subclasses.
+    buy_ordinal = property(lambda self: self.buy_date.toordinal())
+    sell_ordinal = property(
+        lambda self: self.sell_date.toordinal() if self.sell_date
+        else NOT_SOLD)
 
-    @staticmethod
-    def cmp_by_original_buy_date(a, b):
-        """Sorts two lots based on their original buy dates."""
-        if a.buy_date != b.buy_date:
-            return (a.buy_date - b.buy_date).days
-        if a.sell_date != b.sell_date:
-            if a.sell_date is None:
-                return 1
-            if b.sell_date is None:
-                return -1
-            return (a.sell_date - b.sell_date).days
-        if a.form_position != b.form_position:
-            if a.form_position < b.form_position:
-                return -1
-            return 1
-        return a._lot_number < b._lot_number
+    def _sort_keys(self):
+        """Returns the buy date, original buy date and sell date sort keys.
 
-    @staticmethod
-    def cmp_by_sell_date(a, b):
-        """Sorts two lots based on their sell dates."""
-        if a.sell_date != b.sell_date:
-            if a.sell_date is None:
-                return 1
-            if b.sell_date is None:
-                return -1
-            return (a.sell_date - b.sell_date).days
-        if a.buy_date != b.buy_date:
-            return (a.buy_date - b.buy_date).days
-        if a.form_position != b.form_position:
-            if a.form_position < b.form_position:
-                return -1
-            return 1
-        return a._lot_number < b._lot_number
+        Each key orders lots by one date, and then by the other date, the form
+        position and the lot number, so no two lots have the same key. Dates
+        are day ordinals.
+        """
+        buy_ordinal = self.buy_ordinal
+        sell_ordinal = self.sell_ordinal
+        return ((self.adjusted_buy_date.toordinal(), sell_ordinal,
+                 self.form_position, self._lot_number),
+                (buy_ordinal, sell_ordinal, self.form_position,
+                 self._lot_number),
+                (sell_ordinal, buy_ordinal, self.form_position,
+                 self._lot_number))
+
+    # The sort keys, computed when they are needed. Lot stores them instead.
+    _buy_date_key = property(lambda self: self._sort_keys()[0])
+    _original_buy_date_key = property(lambda self: self._sort_keys()[1])
+    _sell_date_key = property(lambda self: self._sort_keys()[2])
+
+    # Key functions to sort lots with, as in lots.sort(key=Lot.sell_date_key).
+    # buy_date_key sorts by the (possibly adjusted) buy date,
+    # original_buy_date_key by the original buy date and sell_date_key by the
+    # sell date.
+    buy_date_key = staticmethod(operator.attrgetter('_buy_date_key'))
+    original_buy_date_key = staticmethod(
+        operator.attrgetter('_original_buy_date_key'))
+    sell_date_key = staticmethod(operator.attrgetter('_sell_date_key'))
+
+
+# The Lot fields that the sort keys and ordinals depend on. They are
+# properties, which update the sort keys and ordinals when they are set, and
+# are stored in slots named with a leading underscore.
+_SORT_FIELDS = ['buy_date', 'adjusted_buy_date', 'sell_date', 'form_position']
+
+# The fields that each of the key functions depends on.
+_KEY_FIELDS = {
+    BaseLot.buy_date_key: frozenset(
+        ['adjusted_buy_date', 'sell_date', 'form_position']),
+    BaseLot.original_buy_date_key: frozenset(
+        ['buy_date', 'sell_date', 'form_position']),
+    BaseLot.sell_date_key: frozenset(
+        ['buy_date', 'sell_date', 'form_position']),
+}
+
+# The Lots objects that are sorted by one of the key functions, by id. They are
+# told before a lot's field that their order depends on is set. Lots objects
+# compare by their lots, so they can't be kept in a set.
+_SORTED_LOTS = weakref.WeakValueDictionary()
+
+
+def sort_field_will_change(lot, field):
+    """Tells the sorted Lots objects that a field of a lot is about to be set.
+
+    Lot calls this itself. Other BaseLot subclasses must call it before they
+    set one of the fields that the sort keys depend on, so that Lots.sort
+    knows to move the lot. Other fields are ignored.
+
+    Args:
+        lot: A BaseLot.
+        field: The name of the field.
+    """
+    for lots in _SORTED_LOTS.values():
+        if field in _KEY_FIELDS[lots._sorted_by]:
+            lots._lot_will_move(lot)
+
+
+class Lot(BaseLot):
+    """Models a single lot of stock."""
+
+    # There may be millions of lots, so don't give each one a __dict__.
+    __slots__ = ([field for field in BaseLot.FIELD_NAMES
+                  if field not in _SORT_FIELDS] +
+                 ['_' + field for field in _SORT_FIELDS] +
+                 ['_lot_number', 'buy_ordinal', 'sell_ordinal',
+                  '_buy_date_key', '_original_buy_date_key', '_sell_date_key'])
+
+    def __init__(self, num_shares, symbol, description, buy_date,
+                 adjusted_buy_date, basis, adjusted_basis, sell_date, proceeds,
+                 adjustment_code, adjustment, form_position, buy_lot,
+                 replacement_for, is_replacement, loss_processed):
+        """Initializes a lot.
+
+        Args:
+            num_shares: An integer.
+            symbol: A string, the stock symbol.
+            description: A string, an arbitrary description of this lot.
+            buy_date: A datetime.date, the original buy date of the shares.
+            adjusted_buy_date: A datetime.date, the possibly-adjusted buy date
+                of the shares.
+            basis: An integer, the number of cents that the lot was bought for.
+            adjusted_basis: An integer, the possibly-adjusted number of cents
+                that the lot was bought for.
+            sell_date: A datetime.date or None.
+            proceeds: An integer, the number of cents that the lot was sold
+                for, or 0 if the lot is not sold.
+            adjustment_code: A string, basically 'W' in case this was a wash
+                sale.
+            adjustment: An integer, the number of cents of the disallowed loss,
+                or 0 if the lot is not sold.
+            form_position: A string, an arbitrary value that helps to determine
+                which lots are related when a lot is split.
+            buy_lot: A string, an arbitrary value that indicates that can be
+                used to indicate that multiple entries are part of the same
+                logical lot. An empty string indicates that this is a unique
+                lot.
+            replacement_for: A ReplacementChain or a list of strings, possibly
+                empty, the buy lots, possibly a chain of them, that this is a
+                replacement for. Stored as a ReplacementChain.
+            is_replacement: A boolean, if true then this lot has been used as
+                replacement shares. Useful because a lot can only be used as
+                replacement shares once.
+            loss_processed: A boolean, whether this lot is a loss and has
+                already been processed for a potential wash sale.
+        """
+        self.num_shares = num_shares
+        self.symbol = symbol
+        self.description = description
+        self._buy_date = buy_date
+        self._adjusted_buy_date = adjusted_buy_date
+        self.basis = basis
+        self.adjusted_basis = adjusted_basis
+        self._sell_date = sell_date
+        self.proceeds = proceeds
+        self.adjustment_code = adjustment_code
+        self.adjustment = adjustment
+        self._form_position = form_position
+        self.buy_lot = buy_lot
+        self.replacement_for = ReplacementChain.of(replacement_for)
+        self.is_replacement = is_replacement
+        self.loss_processed = loss_processed
+
+        # The lot number is only used to sort otherwise equivalent lots.
+        self._lot_number = new_lot_number()
+        self._update_sort_keys()
+
+    def _update_sort_keys(self):
+        self.buy_ordinal = self._buy_date.toordinal()
+        if self._sell_date:
+            self.sell_ordinal = self._sell_date.toordinal()
+        else:
+            self.sell_ordinal = NOT_SOLD
+        (self._buy_date_key, self._original_buy_date_key,
+         self._sell_date_key) = self._sort_keys()
+
+    def clone(self):
+        # Every field is immutable, so there is no need for copy.deepcopy, and
+        # the replacement_for chain is shared.
+        return Lot(self.num_shares, self.symbol, self.description,
+                   self.buy_date, self.adjusted_buy_date, self.basis,
+                   self.adjusted_basis, self.sell_date, self.proceeds,
+                   self.adjustment_code, self.adjustment, self.form_position,
+                   self.buy_lot, self.replacement_for,
+                   self.is_replacement, self.loss_processed)
+
+
+def _sort_field_property(field):
+    """Returns a property for a field of Lot that the sort keys depend on."""
+    # The slot's own descriptor, so that reading the field is as fast as
+    # reading any other slot.
+    slot = getattr(Lot, '_' + field)
+
+    def setter(lot, value):
+        if _SORTED_LOTS:
+            sort_field_will_change(lot, field)
+        slot.__set__(lot, value)
+        lot._update_sort_keys()
+
+    return property(slot.__get__, setter)
+
+
+for _field in _SORT_FIELDS:
+    setattr(Lot, _field, _sort_field_property(_field))
+
+
+# The number of lots at the start of a window that are checked in Python
+# before the rest of it is filtered with numpy. One of them is usually a
+# replacement, and checking them takes less time than building the masks.
+_NUM_SCANNED_FIRST = 64
+# Windows with at most this many lots are only checked in Python.
+_MIN_MASKED_WINDOW = 1024
+
+
+class _CandidateArrays(object):
+    """The fields that decide whether lots can be replacements, as arrays.
+
+    The arrays are parallel to a copy of the buy date index of a Lots object,
+    with buy_lot interned to integer ids, so the lots in a window that can't
+    replace a loss are masked out with a few numpy operations instead of one
+    Python check per lot. Lots that are added after the arrays are built are
+    checked in Python, and removed lots are masked out, until there are enough
+    of them that the arrays are built again.
+    """
+
+    def __init__(self, lots, keys):
+        """Builds the arrays.
+
+        Args:
+            lots: A list of BaseLot objects, ordered by
+                Lot.original_buy_date_key.
+            keys: A list of the original_buy_date_key of each lot.
+        """
+        num_lots = len(lots)
+        self.lots = lots
+        self.keys = keys
+        # The sell ordinal is the second part of the key.
+        self.sell_ordinals = numpy.fromiter(
+            (key[1] for key in keys), numpy.int64, num_lots)
+        self.buy_lot_ids = {}
+        self.buy_lots = numpy.fromiter(
+            (self.buy_lot_ids.setdefault(lot.buy_lot, len(self.buy_lot_ids))
+             for lot in lots), numpy.int64, num_lots)
+        # True for the lots that are removed, or are known to have
+        # is_replacement or loss_processed set. Those flags are only set
+        # during a wash, so they are updated as the lots are found to have
+        # them.
+        self.taken = numpy.fromiter(
+            (bool(lot.is_replacement or lot.loss_processed) for lot in lots),
+            numpy.bool_, num_lots)
+        # The lots added since, ordered by their parallel keys. They are
+        # forgotten once they are found to have is_replacement or
+        # loss_processed set, as most lots that are split off soon are.
+        self.added_lots = []
+        self.added_keys = []
+        self.num_removed = 0
+
+    def add(self, key, lot):
+        """Notes a lot that was added to the Lots object."""
+        i = bisect.bisect_right(self.added_keys, key)
+        self.added_keys.insert(i, key)
+        self.added_lots.insert(i, lot)
+
+    def remove(self, key, lot):
+        """Notes a lot that was removed from the Lots object."""
+        # Keys are unique, so an equal key is the same lot.
+        i = bisect.bisect_left(self.keys, key)
+        if i < len(self.keys) and self.keys[i] == key:
+            self.taken[i] = True
+            self.num_removed += 1
+        i = bisect.bisect_left(self.added_keys, key)
+        if i < len(self.added_keys) and self.added_keys[i] == key:
+            del self.added_keys[i]
+            del self.added_lots[i]
+
+    def candidates(self, loss_lot, after, end):
+        """Finds the lots in a window that may replace a loss.
+
+        Args:
+            loss_lot: A BaseLot, the loss.
+            after: The original_buy_date_key of the lot before the window.
+            end: A one element tuple of the buy ordinal after the last one to
+                include.
+        Returns:
+            An iterator of BaseLot objects, ordered by
+            Lot.original_buy_date_key.
+        """
+        i = bisect.bisect_right(self.keys, after)
+        j = bisect.bisect_left(self.keys, end)
+        found = self._untaken(loss_lot, i, j)
+        added = self._untaken_added(loss_lot, after, end)
+        if not added:
+            return found
+        return heapq.merge(found, added, key=Lot.original_buy_date_key)
+
+    def _untaken(self, loss_lot, i, j):
+        """Yields the lots from index i to j that may replace a loss."""
+        lots = self.lots
+        taken = self.taken
+        sell_ordinal = loss_lot.sell_ordinal
+        buy_lot_id = None
+        if loss_lot.buy_lot != '':
+            buy_lot_id = self.buy_lot_ids.get(loss_lot.buy_lot)
+        # Usually one of the first few lots is a replacement, so the window is
+        # masked in chunks that double in size, instead of all at once.
+        size = _NUM_SCANNED_FIRST
+        while i < j:
+            k = min(i + size, j)
+            mask = self.sell_ordinals[i:k] >= sell_ordinal
+            mask &= ~taken[i:k]
+            if buy_lot_id is not None:
+                mask &= self.buy_lots[i:k] != buy_lot_id
+            for index in (numpy.flatnonzero(mask) + i).tolist():
+                lot = lots[index]
+                if lot.is_replacement or lot.loss_processed:
+                    taken[index] = True
+                    continue
+                yield lot
+            i = k
+            size *= 2
+
+    def _untaken_added(self, loss_lot, after, end):
+        """Returns the added lots in a window that may replace a loss.
+
+        The lots that are replacements or losses are forgotten, so that later
+        windows don't check them again.
+        """
+        i = bisect.bisect_right(self.added_keys, after)
+        j = bisect.bisect_left(self.added_keys, end)
+        found = []
+        taken = []
+        for k in range(i, j):
+            lot = self.added_lots[k]
+            if lot.is_replacement or lot.loss_processed:
+                taken.append(k)
+            elif (lot.sell_ordinal >= loss_lot.sell_ordinal and
+                    (loss_lot.buy_lot == '' or
+                     lot.buy_lot != loss_lot.buy_lot)):
+                found.append(lot)
+        for k in reversed(taken):
+            del self.added_keys[k]
+            del self.added_lots[k]
+        return found
+
+
+# The differences between two Lots objects, as returned by Lots.diff.
+LotsDiff = collections.namedtuple('LotsDiff', ['added', 'removed', 'changed'])
 
 
 class Lots(object):
@@ -261,8 +832,36 @@ class Lots(object):
                 i += 1
         self._lots = lots
 
+        # An index of the lots by their original buy date, used to find the
+        # lots bought within a date window without looking at every lot. The
+        # two lists are parallel, and ordered by Lot.original_buy_date_key.
+        # Since the index is only updated when lots are added, the buy date,
+        # sell date and form position of a lot must not change after it is
+        # added.
+        self._buy_date_lots = sorted(lots, key=Lot.original_buy_date_key)
+        self._buy_date_keys = [Lot.original_buy_date_key(lot)
+                               for lot in self._buy_date_lots]
+        # The index as _CandidateArrays, built when a large window is first
+        # searched for replacement candidates, or None.
+        self._candidates = None
+        # The number of lots that were added and removed since this object
+        # was created.
+        self._num_added = 0
+        self._num_removed = 0
+
+        # The key function of _KEY_FIELDS that the lots were last sorted by,
+        # or None, with the keys of the lots that were sorted. Lots added
+        # since are after them. _moved has the indexes of the sorted lots
+        # whose keys may have changed since.
+        self._sorted_by = None
+        self._sorted_keys = []
+        self._moved = set()
+
     def lots(self):
-        """Returns the list of Lot objects."""
+        """Returns the list of Lot objects.
+
+        The list may be changed, but must only be reordered with sort.
+        """
         return self._lots
 
     def add(self, lot):
@@ -272,19 +871,195 @@ class Lots(object):
             lot: The Lot to add.
         """
         self._lots.append(lot)
+        key = Lot.original_buy_date_key(lot)
+        i = bisect.bisect_right(self._buy_date_keys, key)
+        self._buy_date_keys.insert(i, key)
+        self._buy_date_lots.insert(i, lot)
+        if self._candidates is not None:
+            self._candidates.add(key, lot)
+        self._num_added += 1
+
+    def remove(self, lots):
+        """Removes lots from this object.
+
+        Args:
+            lots: A list of Lot objects that are in this object.
+        """
+        ids = set(id(lot) for lot in lots)
+        self._lots = [lot for lot in self._lots if id(lot) not in ids]
+        self._forget_order()
+        index = [(key, lot)
+                 for key, lot in zip(self._buy_date_keys, self._buy_date_lots)
+                 if id(lot) not in ids]
+        self._buy_date_keys = [key for key, _ in index]
+        self._buy_date_lots = [lot for _, lot in index]
+        if self._candidates is not None:
+            for lot in lots:
+                self._candidates.remove(Lot.original_buy_date_key(lot), lot)
+        self._num_removed += len(ids)
+
+    def lots_bought_between(self, start_date, end_date):
+        """Finds the lots that were originally bought within a date window.
+
+        Args:
+            start_date: A datetime.date, the first buy date to include.
+            end_date: A datetime.date, the last buy date to include.
+        Returns:
+            A list of Lot objects, ordered by Lot.original_buy_date_key.
+        """
+        start, end = self._window(start_date, end_date)
+        return self._buy_date_lots[
+            bisect.bisect_left(self._buy_date_keys, start):
+            bisect.bisect_left(self._buy_date_keys, end)]
+
+    @staticmethod
+    def _window(start_date, end_date):
+        """Returns the bounds of a buy date window, to bisect the keys with."""
+        # A one element tuple sorts before every key with the same date.
+        return (start_date.toordinal(),), (end_date.toordinal() + 1,)
+
+    def replacement_candidates(self, loss_lot, start_date, end_date):
+        """Finds the lots bought within a date window that may replace a loss.
+
+        This is lots_bought_between, except that some of the lots that
+        wash.is_possible_replacement rules out by their sell date, buy lot,
+        is_replacement or loss_processed may be left out, so each lot must
+        still be checked with it. If numpy is installed, the lots after the
+        first few in a large window are filtered with numpy. The others are
+        not filtered.
+
+        Args:
+            loss_lot: A Lot object, the loss to find replacements for.
+            start_date: A datetime.date, the first buy date to include.
+            end_date: A datetime.date, the last buy date to include.
+        Returns:
+            An iterator of Lot objects, ordered by
+            Lot.original_buy_date_key.
+        """
+        start, end = self._window(start_date, end_date)
+        i = bisect.bisect_left(self._buy_date_keys, start)
+        j = bisect.bisect_left(self._buy_date_keys, end)
+        if j - i > _MIN_MASKED_WINDOW:
+            _import_numpy()
+            if _HAS_NUMPY:
+                first = i + _NUM_SCANNED_FIRST
+                return itertools.chain(
+                    self._buy_date_lots[i:first],
+                    self._masked_candidates(
+                        loss_lot, self._buy_date_keys[first - 1], end))
+        return iter(self._buy_date_lots[i:j])
+
+    def _masked_candidates(self, loss_lot, after, end):
+        """Yields _CandidateArrays.candidates, only once they are needed."""
+        yield from self._candidate_arrays().candidates(loss_lot, after, end)
+
+    def _candidate_arrays(self):
+        """Returns the _CandidateArrays, building them if needed."""
+        candidates = self._candidates
+        if candidates is None or max(
+                len(candidates.added_keys),
+                candidates.num_removed) > max(len(candidates.keys) // 8,
+                                              _NUM_SCANNED_FIRST):
+            candidates = _CandidateArrays(list(self._buy_date_lots),
+                                          list(self._buy_date_keys))
+            self._candidates = candidates
+        return candidates
+
+    def replacement_flags_cleared(self):
+        """Notes that is_replacement or loss_processed was cleared on lots.
+
+        replacement_candidates assumes that these flags are only ever set
+        once lots are added, as they are during a wash, so this must be
+        called if either of them is cleared afterwards.
+        """
+        self._candidates = None
 
     def size(self):
         """Returns the number of lots."""
         return len(self._lots)
 
-    def sort(self, **kwargs):
-        self._lots.sort(**kwargs)
+    def change_counts(self):
+        """Returns the number of lots added and removed since creation.
+
+        Returns:
+            A tuple of two integers, the number of lots that were added with
+            add, and the number that were removed with remove.
+        """
+        return self._num_added, self._num_removed
+
+    def sort(self, key):
+        """Sorts the lots.
+
+        The lots remember if they were last sorted by one of the Lot key
+        functions. Sorting by it again only moves the lots that were added, or
+        had a field that the key depends on set, since then. Each one is
+        reinserted by bisection, unless there are so many that sorting every
+        lot is faster.
+
+        Args:
+            key: A key function, such as Lot.sell_date_key.
+        """
+        if key is self._sorted_by:
+            num_moved = (len(self._moved) + len(self._lots) -
+                         len(self._sorted_keys))
+            if num_moved <= max(len(self._lots) // 32, 1):
+                self._reinsert_moved()
+                return
+        self._lots.sort(key=key)
+        if key in _KEY_FIELDS:
+            self._sorted_by = key
+            self._sorted_keys = list(map(key, self._lots))
+            self._moved = set()
+            _SORTED_LOTS[id(self)] = self
+        else:
+            self._forget_order()
+
+    def _reinsert_moved(self):
+        """Moves the lots that are out of order, for sort."""
+        key = self._sorted_by
+        lots = self._lots
+        keys = self._sorted_keys
+        moved = lots[len(keys):]
+        del lots[len(keys):]
+        for i in sorted(self._moved, reverse=True):
+            moved.append(lots.pop(i))
+            del keys[i]
+        self._moved = set()
+        for lot in moved:
+            lot_key = key(lot)
+            # The keys are unique, so this is where a full sort puts the lot.
+            i = bisect.bisect_left(keys, lot_key)
+            keys.insert(i, lot_key)
+            lots.insert(i, lot)
+
+    def _lot_will_move(self, lot):
+        """Notes that a lot's sort key is about to change.
+
+        Args:
+            lot: A BaseLot, which is not necessarily in this object.
+        """
+        # The lot's key hasn't changed yet, so it finds the lot if it was
+        # sorted, and not moved already. Keys are unique, so an equal key is
+        # the same lot, or another view of it, like a TableLot of the same
+        # row.
+        key = self._sorted_by(lot)
+        i = bisect.bisect_left(self._sorted_keys, key)
+        if i < len(self._sorted_keys) and self._sorted_keys[i] == key:
+            self._moved.add(i)
+
+    def _forget_order(self):
+        """Stops tracking the order of the lots until they are sorted."""
+        self._sorted_by = None
+        self._sorted_keys = []
+        self._moved = set()
+        _SORTED_LOTS.pop(id(self), None)
 
     def contents_equal(self, other):
-        """Returns True if the individual lots are the same.
+        """Returns True if the individual lots are the same, in the same order.
 
-        This is different than __eq__ because the individual Lot objects do not
-        need to have the same id(), just be equivalent.
+        This is different than __eq__ because the lots must be in the same
+        order. The individual Lot objects do not need to have the same id(),
+        just be equivalent.
         """
         for this, that in zip(self._lots, other._lots):
             if this != that:
@@ -292,22 +1067,89 @@ class Lots(object):
         return True
 
     def __eq__(self, other):
+        """Returns True if both objects have the same lots, in any order."""
         if len(self._lots) != len(other._lots):
             return False
-        for lot in self._lots:
-            if lot not in other._lots:
-                return False
-        return True
+        return (collections.Counter(lot.key() for lot in self._lots) ==
+                collections.Counter(lot.key() for lot in other._lots))
 
     def __ne__(self, other):
         return not self == other
 
+    def diff(self, other):
+        """Finds the differences between the lots in two Lots objects.
+
+        Lots that are equal are matched with each other, in any order. The
+        remaining lots are matched by BaseLot.identity_key, in the order that
+        they are in each object, and reported as changed.
+
+        Args:
+            other: A Lots object.
+        Returns:
+            A LotsDiff, where added are the lots only in other, removed are the
+            lots only in this object, and changed are (lot in this object, lot
+            in other) tuples. Each list is empty if the objects are equal.
+        """
+        unmatched = collections.defaultdict(collections.deque)
+        for lot in other._lots:
+            unmatched[lot.key()].append(lot)
+        removed = []
+        for lot in self._lots:
+            equal_lots = unmatched.get(lot.key())
+            if equal_lots:
+                equal_lots.popleft()
+            else:
+                removed.append(lot)
+        added_ids = set(id(lot) for lots in unmatched.values()
+                        for lot in lots)
+        added = [lot for lot in other._lots if id(lot) in added_ids]
+
+        added_by_identity = collections.defaultdict(collections.deque)
+        for lot in added:
+            added_by_identity[lot.identity_key()].append(lot)
+        changed = []
+        still_removed = []
+        for lot in removed:
+            candidates = added_by_identity.get(lot.identity_key())
+            if candidates:
+                changed.append((lot, candidates.popleft()))
+            else:
+                still_removed.append(lot)
+        changed_ids = set(id(new_lot) for _, new_lot in changed)
+        return LotsDiff(
+            added=[lot for lot in added if id(lot) not in changed_ids],
+            removed=still_removed,
+            changed=changed)
+
     def __str__(self):
-        global _HAS_TERMINALTABLES
+        return self.format_table()
+
+    def format_table(self,
+                     loss_lots=None,
+                     split_off_loss_lots=None,
+                     replacement_lots=None,
+                     split_off_replacement_lots=None):
+        """Formats this Lots object as a table, like do_print prints it.
+
+        Any lots in the optional lists are highlighted.
+
+        Args:
+            loss_lots: A list of Lot objects.
+            split_off_loss_lots: A list of Lot objects.
+            replacement_lots: A list of Lot objects.
+            split_off_replacement_lots: A list of Lot objects.
+        Returns:
+            A string representing this Lots object.
+        """
+        _import_display_libraries()
         if _HAS_TERMINALTABLES:
-            return self._terminaltables_str()
+            return self._terminaltables_str(loss_lots, split_off_loss_lots,
+                                            replacement_lots,
+                                            split_off_replacement_lots)
         else:
-            return self._simple_str()
+            return self._simple_str(loss_lots, split_off_loss_lots,
+                                    replacement_lots,
+                                    split_off_replacement_lots)
 
     def __iter__(self):
         return iter(self._lots)
@@ -317,55 +1159,49 @@ class Lots(object):
                  split_off_loss_lots=None,
                  replacement_lots=None,
                  split_off_replacement_lots=None):
-        global _HAS_TERMINALTABLES
+        _import_display_libraries()
         if _HAS_TERMINALTABLES:
-            print self._terminaltables_str(loss_lots, split_off_loss_lots,
+            print(self._terminaltables_str(loss_lots, split_off_loss_lots,
                                            replacement_lots,
-                                           split_off_replacement_lots)
+                                           split_off_replacement_lots))
         else:
-            print self._simple_str(loss_lots, split_off_loss_lots,
-                                   replacement_lots,
-                                   split_off_replacement_lots)
+            # Print each line as it is made, so that the whole table is never
+            # held in memory.
+            for line in self._simple_lines(loss_lots, split_off_loss_lots,
+                                           replacement_lots,
+                                           split_off_replacement_lots):
+                print(line)
 
     @staticmethod
-    def _classify_lot(lot,
-                      loss_lots=None,
-                      split_off_loss_lots=None,
-                      replacement_lots=None,
-                      split_off_replacement_lots=None):
-        """Classifies the provided lot based on the lists of lots provided.
+    def _classify_lots(loss_lots=None,
+                       split_off_loss_lots=None,
+                       replacement_lots=None,
+                       split_off_replacement_lots=None):
+        """Classifies the lots in the lists of lots provided.
+
+        A lot that is in more than one list is classified by the first of them.
 
         Args:
-            lot: A Lot to classify.
             loss_lots: A list of Lot objects.
             split_off_loss_lots: A list of Lot objects.
             replacement_lots: A list of Lot objects.
             split_off_replacement_lots: A list of Lot objects.
 
         Returns:
-            (characters, color) or ()
+            A dict of id(lot) to (characters, color), for every lot in the
+            lists.
             characters: A string containing classification characters, like * .
             color: A string containing the color to highlight the lot as.
         """
-        characters = ''
-        color = ''
-        if loss_lots and id(lot) in map(id, loss_lots):
-            characters += '*'
-            color = 'red'
-        elif split_off_loss_lots and id(lot) in map(id, split_off_loss_lots):
-            characters += 'x'
-            color = 'magenta'
-        elif replacement_lots and id(lot) in map(id, replacement_lots):
-            characters += 'o'
-            color = 'green'
-        elif split_off_replacement_lots and id(lot) in map(
-                id, split_off_replacement_lots):
-            characters += '+'
-            color = 'blue'
-
-        if characters or color:
-            return (characters, color)
-        return ()
+        classifications = {}
+        for lots, classification in [
+                (loss_lots, ('*', 'red')),
+                (split_off_loss_lots, ('x', 'magenta')),
+                (replacement_lots, ('o', 'green')),
+                (split_off_replacement_lots, ('+', 'blue'))]:
+            for lot in lots or []:
+                classifications.setdefault(id(lot), classification)
+        return classifications
 
     @staticmethod
     def _color_string(color, s):
@@ -381,6 +1217,14 @@ class Lots(object):
             return colorclass.Color('{' + color + '}' + s + '{/' + color + '}')
         return s
 
+    def _sorted_lots(self):
+        """Returns the lots ordered by Lot.original_buy_date_key.
+
+        This is the buy date index, which add and remove keep in order, so it
+        is not sorted again for every table. It must not be modified.
+        """
+        return self._buy_date_lots
+
     def _terminaltables_str(self,
                             loss_lots=None,
                             split_off_loss_lots=None,
@@ -398,47 +1242,64 @@ class Lots(object):
         Returns:
             A string representing this Lots object.
         """
-        # Make a shallow copy so that we can sort but id(lot) still works.
-        lots = copy.copy(self._lots)
-        lots.sort(cmp=Lot.cmp_by_original_buy_date)
+        classifications = Lots._classify_lots(loss_lots, split_off_loss_lots,
+                                              replacement_lots,
+                                              split_off_replacement_lots)
+        # terminaltables needs every row up front to size the columns.
         lots_data = [[self.SHORT_HEADERS[field] for field in Lot.FIELD_NAMES]]
         lots_data[0].append('Matched')
-        for lot in lots:
+        for lot in self._sorted_lots():
             str_data = lot.str_data()
-            classification = Lots._classify_lot(
-                lot, loss_lots, split_off_loss_lots, replacement_lots,
-                split_off_replacement_lots)
+            classification = classifications.get(id(lot))
             if classification:
                 str_data.append(classification[0])
                 color = classification[1]
-                str_data = map(lambda x: Lots._color_string(color, x), str_data)
+                str_data = [Lots._color_string(color, x) for x in str_data]
             else:
                 str_data.append('')
             lots_data.append(str_data)
         return terminaltables.AsciiTable(lots_data).table
 
-    def _simple_str(self,
-                    loss_lots=None,
-                    split_off_loss_lots=None,
-                    replacement_lots=None,
-                    split_off_replacement_lots=None):
-        # Make a shallow copy so that we can sort but id(lot) still works.
-        lots = copy.copy(self._lots)
-        lots.sort(cmp=Lot.cmp_by_original_buy_date)
-        lot_strings = []
-        lot_strings.append(' '.join([self.SHORT_HEADERS[field]
-                                     for field in Lot.FIELD_NAMES]))
-        for lot in lots:
-            classification = Lots._classify_lot(
-                lot, loss_lots, split_off_loss_lots, replacement_lots,
-                split_off_replacement_lots)
+    def _simple_lines(self,
+                      loss_lots=None,
+                      split_off_loss_lots=None,
+                      replacement_lots=None,
+                      split_off_replacement_lots=None):
+        """Generates the lines of a simple table of this Lots object.
+
+        Any lots in the optional lists are highlighted.
+
+        Args:
+            loss_lots: A list of Lot objects.
+            split_off_loss_lots: A list of Lot objects.
+            replacement_lots: A list of Lot objects.
+            split_off_replacement_lots: A list of Lot objects.
+        Yields:
+            A string for the header, and then one for each lot.
+        """
+        _import_display_libraries()
+        classifications = Lots._classify_lots(loss_lots, split_off_loss_lots,
+                                              replacement_lots,
+                                              split_off_replacement_lots)
+        yield ' '.join([self.SHORT_HEADERS[field]
+                        for field in Lot.FIELD_NAMES])
+        for lot in self._sorted_lots():
             str_data = str(lot)
+            classification = classifications.get(id(lot))
             if classification:
                 str_data = classification[0] + ' ' + str_data
                 color = classification[1]
                 str_data = Lots._color_string(color, str_data)
-            lot_strings.append(str_data)
-        return '\n'.join(lot_strings)
+            yield str_data
+
+    def _simple_str(self,
+                    loss_lots=None,
+                    split_off_loss_lots=None,
+                    replacement_lots=None,
+                    split_off_replacement_lots=None):
+        return '\n'.join(self._simple_lines(loss_lots, split_off_loss_lots,
+                                            replacement_lots,
+                                            split_off_replacement_lots))
 
     __repl__ = __str__
 
@@ -456,16 +1317,41 @@ class Lots(object):
         Returns:
             A Lots object
         """
+        return Lots(list(Lots.iter_csv_data(data)))
+
+    @staticmethod
+    def iter_csv_data(data, first_buy_lot_number=1):
+        """Parses csv data into lots, one row at a time.
+
+        The data has the same format as for create_from_csv_data. Rows are only
+        read as the lots are consumed, so this can be used for files that don't
+        fit in memory. The buy_lot field is populated the same way that Lots
+        populates it.
+
+        Args:
+            data: An iterable of strings, where each one is a CSV row.
+            first_buy_lot_number: An integer, the number used in the buy_lot
+                of the first row that has no buy_lot. Useful if the rows
+                follow other rows that were already read.
+        Yields:
+            Lot objects, in the same order as the rows.
+        """
 
         def convert_to_int(value):
             if value:
                 return int(value)
             return 0
 
+        # Most lots share their dates with many others, so each date string
+        # is only parsed once.
+        dates = {'': None}
+
         def convert_to_date(value):
-            if value:
-                return datetime.datetime.strptime(value, '%m/%d/%Y').date()
-            return None
+            try:
+                return dates[value]
+            except KeyError:
+                date = dates[value] = _parse_date(value)
+                return date
 
         def convert_to_bool(value):
             if value:
@@ -477,36 +1363,71 @@ class Lots(object):
                 return value.split('|')
             return []
 
-        reader = csv.DictReader(data, fieldnames=Lot.FIELD_NAMES)
-        header_row = reader.next()
-        if header_row != Lots.HEADERS:
+        reader = csv.reader(data)
+        header_row = next(reader, None)
+        if header_row is None:
+            # An empty file has no headers, so it is reported as bad headers.
+            raise BadHeadersError('No headers, the file is empty')
+        if header_row != [Lots.HEADERS[field] for field in Lot.FIELD_NAMES]:
             raise BadHeadersError(str(header_row) + str(Lots.HEADERS))
-        lots = []
+        num_fields = len(Lot.FIELD_NAMES)
+        buy_lot_number = first_buy_lot_number
         for row in reader:
-            row['num_shares'] = convert_to_int(row['num_shares'])
-            row['buy_date'] = convert_to_date(row['buy_date'])
-            row['adjusted_buy_date'] = convert_to_date(row['adjusted_buy_date'])
-            if not row['adjusted_buy_date']:
-                row['adjusted_buy_date'] = copy.deepcopy(row['buy_date'])
-            row['basis'] = convert_to_int(row['basis'])
-            row['adjusted_basis'] = convert_to_int(row['adjusted_basis'])
-            if not row['adjusted_basis']:
-                row['adjusted_basis'] = row['basis']
-            row['sell_date'] = convert_to_date(row['sell_date'])
-            row['proceeds'] = convert_to_int(row['proceeds'])
-            row['adjustment'] = convert_to_int(row['adjustment'])
-            row['replacement_for'] = convert_to_string_list(row[
-                'replacement_for'])
-            row['is_replacement'] = convert_to_bool(row['is_replacement'])
-            row['loss_processed'] = convert_to_bool(row['loss_processed'])
-            lots.append(Lot(**row))
-        return Lots(lots)
+            if not row:
+                continue
+            # Missing trailing values are treated as blank.
+            row.extend([''] * (num_fields - len(row)))
+            (num_shares, symbol, description, buy_date, adjusted_buy_date,
+             basis, adjusted_basis, sell_date, proceeds, adjustment_code,
+             adjustment, form_position, buy_lot, replacement_for,
+             is_replacement, loss_processed) = row[:num_fields]
+            buy_date = convert_to_date(buy_date)
+            if buy_date is None:
+                raise ValueError('No buy date in row: {}'.format(
+                    ','.join(row)))
+            basis = convert_to_int(basis)
+            if not buy_lot:
+                buy_lot = '_{}'.format(buy_lot_number)
+                buy_lot_number += 1
+            yield Lot(convert_to_int(num_shares),
+                      symbol,
+                      description,
+                      buy_date,
+                      convert_to_date(adjusted_buy_date) or buy_date,
+                      basis,
+                      convert_to_int(adjusted_basis) or basis,
+                      convert_to_date(sell_date),
+                      convert_to_int(proceeds),
+                      adjustment_code,
+                      convert_to_int(adjustment),
+                      form_position,
+                      buy_lot,
+                      convert_to_string_list(replacement_for),
+                      convert_to_bool(is_replacement),
+                      convert_to_bool(loss_processed))
 
-    def write_csv_data(self, output_file):
-        """Writes this lots data as CSV data to an output file.
+    @staticmethod
+    def csv_writer(output_file):
+        """Starts writing lots as CSV data to an output file.
 
         Args:
             output_file: A file-like object to write to.
+        Returns:
+            A csv.DictWriter that the headers have already been written to.
+            Lots can be written to it with writer.writerow(Lots.csv_row(lot)).
+        """
+        writer = csv.DictWriter(output_file, fieldnames=Lot.FIELD_NAMES)
+        writer.writerow(Lots.HEADERS)
+        return writer
+
+    @staticmethod
+    def csv_row(lot):
+        """Converts a lot into a row of CSV data.
+
+        Args:
+            lot: A Lot.
+        Returns:
+            A dict of Lot field name to string.
         """
 
         def convert_from_int(value):
@@ -529,32 +1450,37 @@ class Lots(object):
                 return '|'.join(value)
             return ''
 
-        writer = csv.DictWriter(output_file, fieldnames=Lot.FIELD_NAMES)
-        writer.writerow(self.HEADERS)
+        row = {}
+        row['num_shares'] = convert_from_int(lot.num_shares)
+        row['symbol'] = lot.symbol
+        row['description'] = lot.description
+        row['buy_date'] = convert_from_date(lot.buy_date)
+        if lot.buy_date == lot.adjusted_buy_date:
+            row['adjusted_buy_date'] = ''
+        else:
+            row['adjusted_buy_date'] = convert_from_date(lot.adjusted_buy_date)
+        row['basis'] = convert_from_int(lot.basis)
+        if lot.basis == lot.adjusted_basis:
+            row['adjusted_basis'] = ''
+        else:
+            row['adjusted_basis'] = convert_from_int(lot.adjusted_basis)
+        row['sell_date'] = convert_from_date(lot.sell_date)
+        row['proceeds'] = convert_from_int(lot.proceeds)
+        row['adjustment_code'] = lot.adjustment_code
+        row['adjustment'] = convert_from_int(lot.adjustment)
+        row['form_position'] = lot.form_position
+        row['buy_lot'] = lot.buy_lot
+        row['replacement_for'] = convert_from_string_list(lot.replacement_for)
+        row['is_replacement'] = convert_from_bool(lot.is_replacement)
+        row['loss_processed'] = convert_from_bool(lot.loss_processed)
+        return row
+
+    def write_csv_data(self, output_file):
+        """Writes this lots data as CSV data to an output file.
+
+        Args:
+            output_file: A file-like object to write to.
+        """
+        writer = Lots.csv_writer(output_file)
         for lot in self._lots:
-            row = {}
-            row['num_shares'] = convert_from_int(lot.num_shares)
-            row['symbol'] = lot.symbol
-            row['description'] = lot.description
-            row['buy_date'] = convert_from_date(lot.buy_date)
-            if lot.buy_date == lot.adjusted_buy_date:
-                row['adjusted_buy_date'] = ''
-            else:
-                row['adjusted_buy_date'] = convert_from_date(
-                    lot.adjusted_buy_date)
-            row['basis'] = convert_from_int(lot.basis)
-            if lot.basis == lot.adjusted_basis:
-                row['adjusted_basis'] = ''
-            else:
-                row['adjusted_basis'] = convert_from_int(lot.adjusted_basis)
-            row['sell_date'] = convert_from_date(lot.sell_date)
-            row['proceeds'] = convert_from_int(lot.proceeds)
-            row['adjustment_code'] = lot.adjustment_code
-            row['adjustment'] = convert_from_int(lot.adjustment)
-            row['form_position'] = lot.form_position
-            row['buy_lot'] = lot.buy_lot
-            row['replacement_for'] = convert_from_string_list(
-                lot.replacement_for)
-            row['is_replacement'] = convert_from_bool(lot.is_replacement)
-            row['loss_processed'] = convert_from_bool(lot.loss_processed)
-            writer.writerow(row)
+            writer.writerow(Lots.csv_row(lot))
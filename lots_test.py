@@ -1,7 +1,10 @@
 import copy
 import datetime
+import io
+import pickle
+import random
 import unittest
-import StringIO
+from unittest import mock
 
 import lots as lots_lib
 
@@ -62,7 +65,7 @@ class TestLots(unittest.TestCase):
             datetime.date(2014, 11, 5), 1800, '', 0, '', '', [], False, False))
         lots = lots_lib.Lots(lots_rows)
 
-        actual_output = StringIO.StringIO()
+        actual_output = io.StringIO()
         lots.write_csv_data(actual_output)
 
         expected_csv_data = [
@@ -93,12 +96,23 @@ class TestLots(unittest.TestCase):
             '20,ABC,A,09/25/2014,,3000,,11/05/2014,1800,,,,_1,,,'
         ]
         lots = lots_lib.Lots.create_from_csv_data(csv_data)
-        actual_output = StringIO.StringIO()
+        actual_output = io.StringIO()
         lots.write_csv_data(actual_output)
         actual_output.seek(0)
         self.assertSequenceEqual(
             [line.rstrip() for line in actual_output.readlines()], csv_data)
 
+    def test_parse_date(self):
+        for value in ['09/15/2014', '9/5/2014', '12/31/1999', '02/29/2016']:
+            self.assertEqual(
+                datetime.datetime.strptime(value, '%m/%d/%Y').date(),
+                lots_lib._parse_date(value))
+        for value in ['2014-09-15', '13/01/2014', '02/30/2014', '09/15/14',
+                      '09/15', '06/001/2014', '006/1/2014',
+                      '\u0661/1/2014', '1/\u0661/2014']:
+            with self.assertRaises(ValueError):
+                lots_lib._parse_date(value)
+
     def test_is_loss(self):
         loss_lot = lots_lib.Lot(10, 'ABC', 'A', datetime.date(2014, 9, 15),
                                 datetime.date(2014, 9, 15), 2000, 2000,
@@ -117,6 +131,82 @@ class TestLots(unittest.TestCase):
                                   0, '', 0, 'form1', 'lot1', [], True, False)
         self.assertFalse(unsold_lot.is_loss())
 
+    def test_split(self):
+        lot = lots_lib.Lot(18, 'ABC', 'A', datetime.date(2014, 9, 15),
+                           datetime.date(2014, 9, 14), 1001, 1101,
+                           datetime.date(2014, 10, 5), 901, 'W', 200, 'form1',
+                           'lot1', ['lot3'], True, True)
+        new_lot = lot.split(10)
+
+        expected_lot = lots_lib.Lot(
+            10, 'ABC', 'A', datetime.date(2014, 9, 15), datetime.date(
+                2014, 9, 14), 556, 612, datetime.date(2014, 10, 5), 501, 'W',
+            111, 'form1', 'lot1', ['lot3'], True, True)
+        expected_new_lot = lots_lib.Lot(
+            8, 'ABC', 'A', datetime.date(2014, 9, 15), datetime.date(
+                2014, 9, 14), 445, 489, datetime.date(2014, 10, 5), 400, 'W',
+            89, 'form1', 'lot1', ['lot3'], True, True)
+        self.assertEqual(expected_lot, lot)
+        self.assertEqual(expected_new_lot, new_lot)
+        # The replacement_for chain is immutable, so it is shared.
+        self.assertIs(lot.replacement_for, new_lot.replacement_for)
+        self.assertGreater(new_lot._lot_number, lot._lot_number)
+
+    def test_split_amount(self):
+        self.assertEqual(3, lots_lib.split_amount(10, 1, 3))
+        self.assertEqual(7, lots_lib.split_amount(10, 2, 3))
+        # Halves go to the part that is asked for, and the other part gets
+        # the rest.
+        self.assertEqual(5, lots_lib.split_amount(9, 1, 2))
+        self.assertEqual(-4, lots_lib.split_amount(-9, 1, 2))
+
+    def test_split_conserves_amounts(self):
+        rand = random.Random(0)
+        for _ in range(1000):
+            num_shares = rand.randint(2, 1000)
+            amounts = [rand.randint(0, 10 ** rand.randint(1, 12))
+                       for _ in range(4)]
+            lot = lots_lib.Lot(num_shares, 'ABC', 'A',
+                               datetime.date(2014, 9, 15),
+                               datetime.date(2014, 9, 15), amounts[0],
+                               amounts[1], datetime.date(2014, 10, 5),
+                               amounts[2], 'W', amounts[3], 'form1', 'lot1',
+                               [], False, False)
+            kept_shares = rand.randint(1, num_shares - 1)
+            new_lot = lot.split(kept_shares)
+            self.assertEqual(num_shares, lot.num_shares + new_lot.num_shares)
+            self.assertEqual(
+                amounts, [lot.basis + new_lot.basis,
+                          lot.adjusted_basis + new_lot.adjusted_basis,
+                          lot.proceeds + new_lot.proceeds,
+                          lot.adjustment + new_lot.adjustment])
+            # Each part is within a cent of its exact share.
+            self.assertLessEqual(
+                abs(lot.basis * num_shares - amounts[0] * kept_shares),
+                num_shares)
+
+    def test_split_many(self):
+        def create_lot():
+            return lots_lib.Lot(10, 'ABC', 'A', datetime.date(2014, 9, 15),
+                                datetime.date(2014, 9, 14), 1001, 1101,
+                                datetime.date(2014, 10, 5), 901, 'W', 200,
+                                'form1', 'lot1', ['lot3'], True, True)
+        lot = create_lot()
+        new_lots = lot.split_many([1, 3, 2])
+
+        expected_lot = create_lot()
+        expected_new_lots = []
+        remaining_lot = expected_lot
+        for num_shares in [1, 3, 2]:
+            remaining_lot = remaining_lot.split(num_shares)
+            expected_new_lots.append(remaining_lot)
+        self.assertEqual(expected_lot, lot)
+        self.assertEqual(expected_new_lots, new_lots)
+        self.assertEqual([3, 2, 4], [new_lot.num_shares
+                                     for new_lot in new_lots])
+        self.assertEqual(1001, lot.basis + sum(new_lot.basis
+                                               for new_lot in new_lots))
+
     def test_compare_by_buy_date(self):
         lots = []
         lots.append(lots_lib.Lot(1, '', '', datetime.date(2014, 9, 2),
@@ -170,7 +260,7 @@ class TestLots(unittest.TestCase):
             datetime.date(2014, 9, 3), 0, 0, datetime.date(2014, 10, 6), 0, '',
             0, 'form1', '', [], False, False))
 
-        lots.sort(cmp=lots_lib.Lot.cmp_by_buy_date)
+        lots.sort(key=lots_lib.Lot.buy_date_key)
         self.assertTrue(lots == expected)
 
     def test_compare_by_original_buy_date(self):
@@ -226,7 +316,7 @@ class TestLots(unittest.TestCase):
             datetime.date(2014, 9, 3), 0, 0, datetime.date(2014, 10, 6), 0, '',
             0, 'form1', '', [], False, False))
 
-        lots.sort(cmp=lots_lib.Lot.cmp_by_original_buy_date)
+        lots.sort(key=lots_lib.Lot.original_buy_date_key)
         self.assertTrue(lots == expected)
 
     def test_compare_by_sell_date(self):
@@ -282,9 +372,74 @@ class TestLots(unittest.TestCase):
             datetime.date(2014, 9, 2), 0, 0, None, 0, '', 0, 'form1', '', [],
             False, False))
 
-        lots.sort(cmp=lots_lib.Lot.cmp_by_sell_date)
+        lots.sort(key=lots_lib.Lot.sell_date_key)
         self.assertTrue(lots == expected)
 
+    def test_sort_keys_follow_fields(self):
+        def create_lot(buy_day):
+            return lots_lib.Lot(1, '', '', datetime.date(2014, 9, buy_day),
+                datetime.date(2014, 9, buy_day), 0, 0, None, 0, '', 0, 'form1',
+                '', [], False, False)
+        lot1 = create_lot(2)
+        lot2 = create_lot(2)
+        lot3 = create_lot(1)
+        lots = [lot2, lot3, lot1]
+        # Otherwise equal lots are in the order that they were created.
+        lots.sort(key=lots_lib.Lot.buy_date_key)
+        self.assertEqual(list(map(id, [lot3, lot1, lot2])),
+                         list(map(id, lots)))
+
+        lot1.adjusted_buy_date = datetime.date(2014, 8, 31)
+        lot3.sell_date = datetime.date(2014, 10, 1)
+        lots.sort(key=lots_lib.Lot.buy_date_key)
+        self.assertEqual(list(map(id, [lot1, lot3, lot2])),
+                         list(map(id, lots)))
+        lots.sort(key=lots_lib.Lot.sell_date_key)
+        self.assertEqual(list(map(id, [lot3, lot1, lot2])),
+                         list(map(id, lots)))
+        self.assertEqual(lot1._sort_keys(),
+                         (lot1.buy_date_key(lot1),
+                          lot1.original_buy_date_key(lot1),
+                          lot1.sell_date_key(lot1)))
+
+    def test_sort_moves_changed_lots(self):
+        rand = random.Random(0)
+
+        def create_lot():
+            buy_date = datetime.date(2014, 1, 1) + datetime.timedelta(
+                days=rand.randint(0, 60))
+            return lots_lib.Lot(1, '', '', buy_date, buy_date, 0, 0,
+                buy_date + datetime.timedelta(days=rand.randint(0, 60)), 0,
+                '', 0, 'form1', '', [], False, False)
+
+        lots = lots_lib.Lots([create_lot() for _ in range(200)])
+        for key in [lots_lib.Lot.sell_date_key, lots_lib.Lot.buy_date_key,
+                    lots_lib.Lot.original_buy_date_key]:
+            for num_changes in [0, 1, 3, 50]:
+                lots.sort(key=key)
+                for _ in range(num_changes):
+                    lot = rand.choice(lots.lots())
+                    lot.adjusted_buy_date -= datetime.timedelta(days=5)
+                    lot.sell_date += datetime.timedelta(days=1)
+                    lots.add(create_lot())
+                expected = sorted(lots.lots(), key=key)
+                lots.sort(key=key)
+                self.assertEqual(list(map(id, expected)),
+                                 list(map(id, lots)))
+
+        # A lot can be in more than one Lots object.
+        other_lots = lots_lib.Lots(list(lots.lots()))
+        other_lots.sort(key=lots_lib.Lot.buy_date_key)
+        lots.lots()[0].sell_date = datetime.date(2013, 12, 1)
+        other_lots.lots()[0].adjusted_buy_date = datetime.date(2015, 1, 1)
+        for lots_object, key in [
+                (lots, lots_lib.Lot.original_buy_date_key),
+                (other_lots, lots_lib.Lot.buy_date_key)]:
+            expected = sorted(lots_object.lots(), key=key)
+            lots_object.sort(key=key)
+            self.assertEqual(list(map(id, expected)),
+                             list(map(id, lots_object)))
+
     def test_contents_equal(self):
         lots = lots_lib.Lots([])
         lots.add(lots_lib.Lot(1, '', '', datetime.date(2014, 9, 2),
@@ -317,6 +472,194 @@ class TestLots(unittest.TestCase):
         other_lots.lots()[0].num_shares = 2
         self.assertFalse(lots.contents_equal(other_lots))
 
+    def test_key(self):
+        lot = lots_lib.Lot(1, 'A', '', datetime.date(2014, 9, 1),
+            datetime.date(2014, 9, 1), 0, 0, None, 0, '', 0, 'form1', 'lot1',
+            ['lot0'], False, False)
+        other_lot = lot.clone()
+        self.assertEqual(lot.key(), other_lot.key())
+        self.assertEqual(hash(lot.key()), hash(other_lot.key()))
+        other_lot.adjustment = 5
+        self.assertNotEqual(lot.key(), other_lot.key())
+        self.assertEqual(lot.identity_key(), other_lot.identity_key())
+
+    def test_equal_in_any_order(self):
+        def create_lot(num_shares):
+            return lots_lib.Lot(num_shares, '', '', datetime.date(2014, 9, 1),
+                datetime.date(2014, 9, 1), 0, 0, None, 0, '', 0, 'form1',
+                'lot1', [], False, False)
+        lots = lots_lib.Lots([create_lot(1), create_lot(1), create_lot(2)])
+        self.assertTrue(
+            lots == lots_lib.Lots([create_lot(2), create_lot(1),
+                                   create_lot(1)]))
+        # The same lots, but not as many times each.
+        self.assertFalse(
+            lots == lots_lib.Lots([create_lot(1), create_lot(2),
+                                   create_lot(2)]))
+        self.assertTrue(
+            lots != lots_lib.Lots([create_lot(1), create_lot(2)]))
+
+    def test_diff(self):
+        def create_lot(buy_lot, num_shares, sell_day=None):
+            sell_date = None
+            if sell_day:
+                sell_date = datetime.date(2014, 10, sell_day)
+            return lots_lib.Lot(num_shares, 'A', '', datetime.date(2014, 9, 1),
+                datetime.date(2014, 9, 1), 0, 0, sell_date, 0, '', 0,
+                'form1', buy_lot, [], False, False)
+        lots = lots_lib.Lots([create_lot('lot1', 1), create_lot('lot2', 2, 5),
+                              create_lot('lot3', 3), create_lot('lot1', 4)])
+        other_lots = lots_lib.Lots([
+            create_lot('lot1', 4), create_lot('lot3', 3),
+            create_lot('lot2', 5, 5), create_lot('lot4', 6)])
+
+        diff = lots.diff(other_lots)
+        self.assertEqual([other_lots.lots()[3]], diff.added)
+        self.assertEqual([lots.lots()[0]], diff.removed)
+        self.assertEqual([(lots.lots()[1], other_lots.lots()[2])],
+                         diff.changed)
+        self.assertEqual(([], [], []), lots.diff(copy.deepcopy(lots)))
+
+    def test_lots_bought_between(self):
+        def create_lot(buy_day, form_position):
+            return lots_lib.Lot(1, '', '', datetime.date(2014, 9, buy_day),
+                datetime.date(2014, 9, buy_day), 0, 0, None, 0, '', 0,
+                form_position, '', [], False, False)
+        lot1 = create_lot(1, 'form1')
+        lot2 = create_lot(2, 'form2')
+        lot3 = create_lot(2, 'form1')
+        lot4 = create_lot(9, 'form1')
+        lots = lots_lib.Lots([lot4, lot2, lot1])
+        lots.add(lot3)
+
+        in_window = lots.lots_bought_between(datetime.date(2014, 9, 2),
+                                             datetime.date(2014, 9, 9))
+        self.assertEqual(list(map(id, [lot3, lot2, lot4])),
+                         list(map(id, in_window)))
+        in_window = lots.lots_bought_between(datetime.date(2014, 9, 3),
+                                             datetime.date(2014, 9, 8))
+        self.assertEqual([], in_window)
+
+    def test_replacement_candidates(self):
+        lots_lib._import_numpy()
+        if not lots_lib._HAS_NUMPY:
+            self.skipTest('numpy is not installed')
+
+        def create_lot(buy_day, sell_day, buy_lot):
+            return lots_lib.Lot(1, '', '', datetime.date(2014, 9, buy_day),
+                datetime.date(2014, 9, buy_day), 0, 0,
+                datetime.date(2014, 9, sell_day) if sell_day else None, 0,
+                '', 0, 'form{}'.format(buy_day), buy_lot, [], False, False)
+        loss = create_lot(1, 10, 'loss')
+        sold_before = create_lot(2, 5, '')
+        same_buy_lot = create_lot(3, 20, 'loss')
+        replacement = create_lot(4, 0, '')
+        processed = create_lot(5, 0, '')
+        processed.loss_processed = True
+        unsold = [create_lot(day, 0, '') for day in range(6, 12)]
+        lots = lots_lib.Lots([loss, sold_before, same_buy_lot, replacement,
+                              processed] + unsold)
+        start = datetime.date(2014, 9, 1)
+        end = datetime.date(2014, 9, 30)
+
+        def candidates():
+            return list(map(id, lots.replacement_candidates(loss, start,
+                                                            end)))
+
+        with mock.patch.object(lots_lib, '_MIN_MASKED_WINDOW', 2), \
+                mock.patch.object(lots_lib, '_NUM_SCANNED_FIRST', 1):
+            # The first lot is not filtered.
+            self.assertEqual(list(map(id, [loss, replacement] + unsold)),
+                             candidates())
+            replacement.is_replacement = True
+            added = create_lot(7, 0, '')
+            lots.add(added)
+            lots.remove([unsold[0]])
+            self.assertEqual(
+                list(map(id, [loss, unsold[1], added] + unsold[2:])),
+                candidates())
+            replacement.is_replacement = False
+            lots.replacement_flags_cleared()
+            self.assertEqual(
+                list(map(id, [loss, replacement, unsold[1], added] +
+                         unsold[2:])),
+                candidates())
+            with mock.patch.object(lots_lib, '_HAS_NUMPY', False):
+                self.assertEqual(lots.lots_bought_between(start, end),
+                                 list(lots.replacement_candidates(
+                                     loss, start, end)))
+
+    def test_simple_str(self):
+        def create_lot(num_shares, buy_day):
+            return lots_lib.Lot(num_shares, '', '',
+                datetime.date(2014, 9, buy_day),
+                datetime.date(2014, 9, buy_day), 0, 0, None, 0, '', 0,
+                'form1', 'lot{}'.format(num_shares), [], False, False)
+        lot1 = create_lot(1, 3)
+        lot2 = create_lot(2, 1)
+        lot3 = create_lot(3, 2)
+        lot4 = create_lot(4, 4)
+        lots = lots_lib.Lots([lot1, lot2])
+        lots.add(lot3)
+        lots.add(lot4)
+
+        # lot3 is in two lists, and is classified by the first one.
+        lines = lots._simple_str(loss_lots=[lot3],
+                                 replacement_lots=[lot1, lot3]).split('\n')
+        self.assertEqual(5, len(lines))
+        self.assertEqual(str(lot2), lines[1])
+        self.assertEqual('* ' + str(lot3), lines[2])
+        self.assertEqual('o ' + str(lot1), lines[3])
+        self.assertEqual(str(lot4), lines[4])
+
+        lots.remove([lot3])
+        self.assertEqual([str(lot2), str(lot1), str(lot4)],
+                         lots._simple_str().split('\n')[1:])
+
+
+class TestReplacementChain(unittest.TestCase):
+
+    def test_list_behavior(self):
+        chain = lots_lib.ReplacementChain(['lot1', 'lot2'])
+        self.assertEqual(['lot1', 'lot2'], chain)
+        self.assertEqual(chain, ['lot1', 'lot2'])
+        self.assertNotEqual(['lot1'], chain)
+        self.assertEqual(2, len(chain))
+        self.assertEqual(['lot1', 'lot2'], list(chain))
+        self.assertIn('lot1', chain)
+        self.assertNotIn('lot3', chain)
+        self.assertEqual([], lots_lib.ReplacementChain())
+
+    def test_appended(self):
+        chain = lots_lib.ReplacementChain(['lot1'])
+        longer = chain.appended('lot2')
+        self.assertEqual(['lot1'], chain)
+        self.assertEqual(['lot1', 'lot2'], longer)
+        self.assertIs(longer, lots_lib.ReplacementChain().extended(longer))
+        self.assertEqual(['lot1', 'lot2', 'lot1'],
+                         longer.extended(chain))
+
+    def test_branches(self):
+        # Chains that are appended to more than once still only contain their
+        # own buy lots.
+        rand = random.Random(0)
+        chains = [(lots_lib.ReplacementChain(), [])]
+        for _ in range(500):
+            chain, buy_lots = rand.choice(chains)
+            buy_lot = str(rand.randint(0, 50))
+            chains.append((chain.appended(buy_lot), buy_lots + [buy_lot]))
+        for chain, buy_lots in chains:
+            self.assertEqual(buy_lots, chain)
+            for i in range(52):
+                self.assertEqual(str(i) in buy_lots, str(i) in chain)
+
+    def test_copy_and_pickle(self):
+        chain = lots_lib.ReplacementChain(str(i) for i in range(5000))
+        self.assertIs(chain, copy.deepcopy(chain))
+        unpickled = pickle.loads(pickle.dumps(chain))
+        self.assertEqual(chain, unpickled)
+        self.assertIn('4999', unpickled)
+
 
 if __name__ == '__main__':
     unittest.main()
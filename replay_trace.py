@@ -0,0 +1,100 @@
+import argparse
+import io
+import json
+
+import lots as lots_lib
+
+
+def read_trace(trace_file):
+    """Reads the steps recorded by a logger_lib.TraceLogger.
+
+    Args:
+        trace_file: An iterable of strings, the lines of the trace.
+    Yields:
+        A dict for each step, in order.
+    """
+    for line in trace_file:
+        if line.strip():
+            yield json.loads(line)
+
+
+def _create_lots(rows):
+    """Creates lots from the csv rows recorded in a trace.
+
+    Args:
+        rows: A dict of lot id to a dict of Lot field name to string.
+    Returns:
+        A dict of lot id to Lot.
+    """
+    lot_ids = sorted(rows)
+    data = io.StringIO(newline='')
+    writer = lots_lib.Lots.csv_writer(data)
+    for lot_id in lot_ids:
+        writer.writerow(rows[lot_id])
+    data.seek(0)
+    return dict(zip(lot_ids, lots_lib.Lots.iter_csv_data(data)))
+
+
+def replay(steps, step):
+    """Rebuilds the lots as they were at a step.
+
+    Args:
+        steps: An iterable of step dicts, as from read_trace.
+        step: An integer, the number of the step.
+    Returns:
+        A tuple of the step dict and a dict of lot id to Lot, or None if the
+        trace has no such step.
+    """
+    rows = {}
+    for record in steps:
+        for lot_id in record.get('removed', []):
+            del rows[lot_id]
+        for lot_id, changed in record.get('lots', []):
+            rows.setdefault(lot_id, {}).update(changed)
+        if record['step'] == step:
+            return record, _create_lots(rows)
+    return None
+
+
+def print_step(record, lots_by_id):
+    """Prints the lots at a step, with the step's lots highlighted.
+
+    Args:
+        record: A step dict.
+        lots_by_id: A dict of lot id to Lot, as returned by replay.
+    """
+
+    def highlighted(key):
+        return [lots_by_id[lot_id] for lot_id in record.get(key, [])]
+
+    # Lots.do_print prints the lots by buy date, the same way that wash.py
+    # prints its steps.
+    lots = lots_lib.Lots([lots_by_id[lot_id] for lot_id in sorted(lots_by_id)])
+    print('Step {}: {}'.format(record['step'], record['message']))
+    lots.do_print(highlighted('loss'), highlighted('split_off_loss'),
+                  highlighted('replacement'),
+                  highlighted('split_off_replacement'))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('trace_file')
+    parser.add_argument('-s', '--step', type=int,
+                        help='Print the lots at this step. If not given, '
+                        'lists the steps.')
+    parsed = parser.parse_args()
+
+    with open(parsed.trace_file) as f:
+        if parsed.step is None:
+            for record in read_trace(f):
+                print('{}: {}'.format(record['step'], record['message']))
+            return
+        replayed = replay(read_trace(f), parsed.step)
+    if not replayed:
+        parser.error('No step {} in {}'.format(parsed.step,
+                                              parsed.trace_file))
+    print_step(*replayed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+import copy
+import datetime
+import io
+import os
+import random
+import unittest
+
+import logger as logger_lib
+import lots as lots_lib
+import replay_trace
+import wash
+
+
+def create_lot(num_shares, buy_date, basis, sell_date=None, proceeds=0):
+    return lots_lib.Lot(num_shares, 'ABC', '', buy_date, buy_date, basis,
+                        basis, sell_date, proceeds, '', 0, '', '', [], False,
+                        False)
+
+
+class TestReplayTrace(unittest.TestCase):
+
+    def trace(self, print_steps):
+        trace_file = io.StringIO()
+        print_steps(logger_lib.TraceLogger(trace_file))
+        return list(replay_trace.read_trace(
+            trace_file.getvalue().splitlines()))
+
+    def test_replay_wash(self):
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            'tests', 'long_chain_with_different_num_shares.csv')
+        with open(path) as f:
+            lots = lots_lib.Lots.create_from_csv_data(f)
+        expected = copy.deepcopy(lots)
+        wash.wash_all_lots(expected)
+
+        def print_steps(logger):
+            wash.event_wash_all_lots(lots, logger)
+            logger.print_lots('Final lots', lots)
+
+        steps = self.trace(print_steps)
+        record, lots_by_id = replay_trace.replay(steps, len(steps))
+        self.assertEqual(expected, lots_lib.Lots(list(lots_by_id.values())))
+
+    def test_replay_stream_wash(self):
+        # The stream engine removes the lots that are done and adds the next
+        # lot between two steps, so the number of lots stays the same.
+        rand = random.Random(4)
+        lots = []
+        for i in range(120):
+            buy_date = datetime.date(2014, 1, 1) + datetime.timedelta(
+                days=i * 2)
+            num_shares = rand.randint(1, 20)
+            lot = create_lot(num_shares, buy_date, num_shares * 100)
+            if rand.random() < 0.8:
+                lot.sell_date = buy_date + datetime.timedelta(
+                    days=rand.randint(1, 60))
+                lot.proceeds = num_shares * rand.randint(80, 120)
+            lot.form_position = str(i)
+            lots.append(lot)
+        expected_steps = []
+
+        class RecordingLogger(logger_lib.TraceLogger):
+            def print_lots(self, message, lots, *args, **kwargs):
+                super().print_lots(message, lots, *args, **kwargs)
+                expected_steps.append(sorted(
+                    tuple(sorted(lots_lib.Lots.csv_row(lot).items()))
+                    for lot in lots))
+
+        trace_file = io.StringIO()
+        list(wash.stream_wash_lots(lots_lib.Lots(lots),
+                                   RecordingLogger(trace_file)))
+        steps = list(replay_trace.read_trace(
+            trace_file.getvalue().splitlines()))
+        self.assertEqual(len(expected_steps), len(steps))
+        for step, expected in enumerate(expected_steps, 1):
+            _, lots_by_id = replay_trace.replay(steps, step)
+            self.assertEqual(expected, sorted(
+                tuple(sorted(lots_lib.Lots.csv_row(lot).items()))
+                for lot in lots_by_id.values()), step)
+
+    def test_highlighted_lots(self):
+        loss = create_lot(10, datetime.date(2014, 1, 1), 200,
+                          datetime.date(2014, 2, 1), 100)
+        replacement = create_lot(20, datetime.date(2014, 2, 5), 400)
+        lots = lots_lib.Lots([loss, replacement])
+        steps = self.trace(lambda logger: wash.wash_one_lot(loss, lots,
+                                                            logger))
+        messages = [record['message'] for record in steps]
+        step = messages.index('Split replacement in two') + 1
+        record, lots_by_id = replay_trace.replay(steps, step)
+        # The loss is washed after the replacement is split.
+        replayed_loss = lots_by_id[record['loss'][0]]
+        self.assertEqual(loss.buy_lot, replayed_loss.buy_lot)
+        self.assertFalse(replayed_loss.loss_processed)
+        self.assertEqual(10, lots_by_id[record['replacement'][0]].num_shares)
+        self.assertEqual(
+            10, lots_by_id[record['split_off_replacement'][0]].num_shares)
+        self.assertEqual(3, len(lots_by_id))
+
+    def test_removed_lots(self):
+        lot1 = create_lot(10, datetime.date(2014, 1, 1), 200)
+        lot2 = create_lot(20, datetime.date(2014, 2, 5), 400)
+
+        def print_steps(logger):
+            logger.print_lots('Both', lots_lib.Lots([lot1, lot2]))
+            logger.print_lots('One', lots_lib.Lots([lot2]))
+
+        steps = self.trace(print_steps)
+        self.assertEqual([lot2], list(replay_trace.replay(steps, 2)[1].values()))
+
+    def test_no_such_step(self):
+        steps = self.trace(lambda logger: logger.print_lots(
+            'Start', lots_lib.Lots([])))
+        self.assertIsNone(replay_trace.replay(steps, 2))
+
+
+if __name__ == '__main__':
+    unittest.main()
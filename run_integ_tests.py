@@ -1,40 +1,180 @@
 import lots as lots_lib
+import snapshot as snapshot_lib
 import wash as wash_lib
 
+import argparse
+import hashlib
+import multiprocessing
 import os
+import sys
+import time
 
+# The engines that every test is run with. 'stream' is
+# wash_lib.stream_wash_lots.
+ENGINES = sorted(wash_lib.ENGINES) + ['stream']
 
-def run_test(infile, outfile):
+
+_code_digest = None
+
+
+def _parser_digest():
+    """Returns a hash of the code that parses and snapshots lots.
+
+    A change to the parser or the snapshot format could change the lots that
+    are cached, so it is part of the name of each cached snapshot.
+    """
+    global _code_digest
+    if _code_digest is None:
+        digest = hashlib.sha1(str(snapshot_lib.VERSION).encode())
+        for module in [lots_lib, snapshot_lib]:
+            with open(module.__file__, 'rb') as f:
+                digest.update(f.read())
+        _code_digest = digest.hexdigest()
+    return _code_digest
+
+
+def read_expected(outfile, cache_dir=None):
+    """Reads an expected output file.
+
+    Args:
+        outfile: Expected output filename.
+        cache_dir: A directory to cache the parsed lots in, or None. The lots
+            are cached as a snapshot named after the SHA-1 hash of the file,
+            the snapshot version and lots.py and snapshot.py, so a file is
+            only parsed again once it or the code that reads it changes.
+    Returns:
+        A Lots object.
+    """
+    with open(outfile, 'rb') as f:
+        data = f.read()
+    if not cache_dir:
+        return lots_lib.Lots.create_from_csv_data(
+            data.decode().splitlines(True))
+
+    path = os.path.join(cache_dir, '{}_{}.snap'.format(
+        hashlib.sha1(data).hexdigest(), _parser_digest()))
+    if os.path.exists(path):
+        try:
+            with snapshot_lib.Snapshot(path) as snapshot:
+                return lots_lib.Lots(snapshot.lots())
+        except snapshot_lib.BadSnapshotError:
+            # Written by an older version, so it is replaced below.
+            pass
+    lots = lots_lib.Lots.create_from_csv_data(data.decode().splitlines(True))
+    if not os.path.isdir(cache_dir):
+        try:
+            os.makedirs(cache_dir)
+        except OSError:
+            # Made by another worker at the same time.
+            pass
+    # Other workers may read the snapshot as soon as it exists, so it is
+    # written to a temporary file first.
+    temp_path = '{}.{}'.format(path, os.getpid())
+    with open(temp_path, 'wb') as f:
+        snapshot_lib.write_snapshot(lots.lots(), f)
+    os.rename(temp_path, path)
+    return lots
+
+
+def run_test(infile, expected, engine='iterative'):
     """Runs a single test.
 
     Args:
         infile: Input filename.
-        outfile: Expected output filename.
+        expected: A Lots object, the expected output. It is not modified.
+        engine: The name of the wash engine to test, a key of
+            wash_lib.ENGINES, or 'stream' to test wash_lib.stream_wash_lots.
+    Returns:
+        A tuple of True if the test passed, and a string describing the
+        result.
     """
-    lots = lots_lib.Lots.create_from_csv_data(open(infile))
-    wash_lib.wash_all_lots(lots)
-    expected = lots_lib.Lots.create_from_csv_data(open(outfile))
-    lots.sort(cmp=lots_lib.Lot.cmp_by_buy_date)
-    expected.sort(cmp=lots_lib.Lot.cmp_by_buy_date)
-    if not lots.contents_equal(expected):
-        print 'Test failed: {}'.format(infile)
-        print 'Got result:'
-        lots.do_print()
-        print 'Expected:'
-        expected.do_print()
-        print '\n\n'
+    with open(infile, newline='') as f:
+        lots = lots_lib.Lots.create_from_csv_data(f)
+    if engine == 'stream':
+        lots = lots_lib.Lots(list(wash_lib.stream_wash_lots(
+            sorted(lots, key=lots_lib.Lot.original_buy_date_key))))
     else:
-        print "Test passed: {}".format(infile)
+        wash_lib.ENGINES[engine](lots)
+    diff = expected.diff(lots)
+    if not (diff.added or diff.removed or diff.changed):
+        return True, 'Test passed ({}): {}'.format(engine, infile)
+    # The lots that differ are highlighted.
+    return False, '\n'.join([
+        'Test failed ({}): {}'.format(engine, infile),
+        '{} unexpected, {} missing and {} changed lots'.format(
+            len(diff.added), len(diff.removed), len(diff.changed)),
+        'Got result:',
+        lots.format_table(diff.added + [new for _, new in diff.changed]),
+        'Expected:',
+        expected.format_table(diff.removed + [old for old, _ in diff.changed]),
+        '\n\n'])
+
+
+def run_fixture(task):
+    """Runs the tests of one fixture with every engine.
+
+    Args:
+        task: A tuple of the input filename, the expected output filename and
+            the cache directory, as for read_expected.
+    Returns:
+        A list with a tuple for each engine, of True if the test passed, a
+        string describing the result, and the wall time of the test in
+        seconds.
+    """
+    infile, outfile, cache_dir = task
+    expected = read_expected(outfile, cache_dir)
+    results = []
+    for engine in ENGINES:
+        start = time.time()
+        passed, report = run_test(infile, expected, engine)
+        results.append((passed, report, time.time() - start))
+    return results
 
 
 def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-j', '--jobs', type=int,
+                        help='The number of worker processes to use. Defaults '
+                        'to one per CPU.')
+    parser.add_argument('--cache_dir', default=os.path.join('tests', '.cache'),
+                        help='Where to cache the parsed expected outputs.')
+    parser.add_argument('--no_cache', action='store_true',
+                        help='Parse every expected output.')
+    parsed = parser.parse_args()
+    cache_dir = None if parsed.no_cache else parsed.cache_dir
+
     tests_dir = os.path.join(os.getcwd(), 'tests')
-    tests = [name
-             for name in os.listdir(tests_dir)
-             if name.endswith('.csv') and not name.endswith('_out.csv')]
-    for test in tests:
-        run_test(os.path.join(tests_dir, test),
-             os.path.join(tests_dir, test.rsplit('.', 1)[0] + "_out.csv"))
+    tests = sorted(name
+                   for name in os.listdir(tests_dir)
+                   if name.endswith('.csv') and not name.endswith('_out.csv'))
+    tasks = [(os.path.join(tests_dir, test),
+              os.path.join(tests_dir, test.rsplit('.', 1)[0] + "_out.csv"),
+              cache_dir)
+             for test in tests]
+
+    start = time.time()
+    pool = multiprocessing.Pool(parsed.jobs)
+    num_passed = 0
+    num_failed = 0
+    try:
+        # imap returns the results in order, as each fixture finishes.
+        for results in pool.imap(run_fixture, tasks):
+            for passed, report, seconds in results:
+                # The time goes on the first line, before any tables.
+                first_line, newline, rest = report.partition('\n')
+                print('{} [{:.1f}ms]{}{}'.format(first_line, seconds * 1000,
+                                                 newline, rest))
+                if passed:
+                    num_passed += 1
+                else:
+                    num_failed += 1
+    finally:
+        pool.close()
+        pool.join()
+    print('{} passed, {} failed in {:.2f}s'.format(num_passed, num_failed,
+                                                   time.time() - start))
+    return 1 if num_failed else 0
+
 
 if __name__ == "__main__":
-  main()
+    sys.exit(main())
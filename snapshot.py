@@ -0,0 +1,274 @@
+import datetime
+import mmap
+import os
+import struct
+
+import lots as lots_lib
+
+# A snapshot file starts with a header, followed by sections that are each
+# padded to a multiple of 8 bytes. All numbers are little endian.
+#
+#   header: magic, version, number of lots, number of strings
+#   string offsets: num_strings + 1 uint32, into the string data
+#   string data: the bytes of every distinct string, one after another
+#   one column per field in _COLUMNS, with one value per lot
+#   replacement_for offsets: num_lots + 1 uint32, into the values below
+#   replacement_for values: uint32 string indexes
+#
+# Every string field, and every element of replacement_for, is stored as an
+# index into the strings, so repeated values are stored once. Strings are
+# encoded as UTF-8. Dates are stored
+# as day ordinals, with 0 for None.
+
+MAGIC = b'WSNP'
+VERSION = 1
+
+_HEADER = struct.Struct('<4sIII')
+_ALIGNMENT = 8
+
+# Field name to the struct format of its column.
+_COLUMNS = [
+    ('num_shares', 'q'),
+    ('symbol', 'I'),
+    ('description', 'I'),
+    ('buy_date', 'i'),
+    ('adjusted_buy_date', 'i'),
+    ('basis', 'q'),
+    ('adjusted_basis', 'q'),
+    ('sell_date', 'i'),
+    ('proceeds', 'q'),
+    ('adjustment_code', 'I'),
+    ('adjustment', 'q'),
+    ('form_position', 'I'),
+    ('buy_lot', 'I'),
+    ('is_replacement', 'B'),
+    ('loss_processed', 'B'),
+]
+_DATE_FIELDS = frozenset(['buy_date', 'adjusted_buy_date', 'sell_date'])
+_BOOL_FIELDS = frozenset(['is_replacement', 'loss_processed'])
+_STRING_FIELDS = frozenset(
+    field for field, code in _COLUMNS if code == 'I')
+
+
+class BadSnapshotError(Exception):
+    """Raised if a file is not a snapshot that can be read."""
+
+
+def _padding(size):
+    return -size % _ALIGNMENT
+
+
+def is_snapshot(path):
+    """Returns True if the file at path is a snapshot, based on its magic."""
+    with open(path, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def write_snapshot(lots, out_file):
+    """Writes lots to a file in the snapshot format.
+
+    Args:
+        lots: A list of lots_lib.BaseLot objects.
+        out_file: A file object opened for writing in binary mode.
+    """
+    strings = []
+    string_indexes = {}
+
+    def string_index(value):
+        index = string_indexes.get(value)
+        if index is None:
+            index = string_indexes[value] = len(strings)
+            strings.append(value)
+        return index
+
+    columns = []
+    for field, code in _COLUMNS:
+        values = [getattr(lot, field) for lot in lots]
+        if field in _DATE_FIELDS:
+            values = [value.toordinal() if value else 0 for value in values]
+        elif field in _BOOL_FIELDS:
+            values = [1 if value else 0 for value in values]
+        elif field in _STRING_FIELDS:
+            values = [string_index(value) for value in values]
+        columns.append(struct.pack('<{}{}'.format(len(values), code),
+                                   *values))
+    replacement_for_offsets = [0]
+    replacement_for_values = []
+    for lot in lots:
+        replacement_for_values.extend(
+            string_index(value) for value in lot.replacement_for)
+        replacement_for_offsets.append(len(replacement_for_values))
+
+    encoded_strings = [value.encode('utf-8') for value in strings]
+    string_offsets = [0]
+    for value in encoded_strings:
+        string_offsets.append(string_offsets[-1] + len(value))
+
+    sections = [
+        _HEADER.pack(MAGIC, VERSION, len(lots), len(strings)),
+        struct.pack('<{}I'.format(len(string_offsets)), *string_offsets),
+        b''.join(encoded_strings),
+    ] + columns + [
+        struct.pack('<{}I'.format(len(replacement_for_offsets)),
+                    *replacement_for_offsets),
+        struct.pack('<{}I'.format(len(replacement_for_values)),
+                    *replacement_for_values),
+    ]
+    for section in sections:
+        out_file.write(section)
+        out_file.write(b'\0' * _padding(len(section)))
+
+
+class Snapshot(object):
+    """A snapshot file, memory mapped so that only what is used is read.
+
+    Columns are decoded straight from the mapped file with struct.unpack_from,
+    without reading the rest of the file, so opening a snapshot is cheap no
+    matter how many lots it has.
+    """
+
+    def __init__(self, path):
+        """Opens a snapshot.
+
+        Args:
+            path: The path of the snapshot file.
+        Raises:
+            BadSnapshotError: If the file is not a snapshot, is of a newer
+                version, or is not the size that its header says.
+        """
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size < _HEADER.size:
+                raise BadSnapshotError(path)
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self._read_layout(path)
+        except BadSnapshotError:
+            self._map.close()
+            raise
+
+    def _check_size(self, path, end):
+        """Raises BadSnapshotError if the file ends before end."""
+        if end > len(self._map):
+            raise BadSnapshotError('{}: truncated, {} of at least {} '
+                                   'bytes'.format(path, len(self._map), end))
+
+    def _read_layout(self, path):
+        """Reads the header, and finds where each section starts."""
+        magic, version, self._num_lots, num_strings = _HEADER.unpack_from(
+            self._map)
+        if magic != MAGIC or version != VERSION:
+            raise BadSnapshotError('{}: {!r} version {}'.format(path, magic,
+                                                               version))
+
+        offset = _HEADER.size + _padding(_HEADER.size)
+        self._check_size(path, offset + 4 * (num_strings + 1))
+        string_offsets = struct.unpack_from(
+            '<{}I'.format(num_strings + 1), self._map, offset)
+        offset += 4 * (num_strings + 1)
+        offset += _padding(offset)
+        self._check_size(path, offset + string_offsets[-1])
+        self._strings = [
+            self._map[offset + start:offset + end].decode('utf-8')
+            for start, end in zip(string_offsets, string_offsets[1:])]
+        offset += string_offsets[-1]
+        offset += _padding(offset)
+
+        # Field name to the struct format and offset of its column.
+        self._columns = {}
+        for field, code in _COLUMNS:
+            self._columns[field] = (code, offset)
+            offset += struct.calcsize('<' + code) * self._num_lots
+            offset += _padding(offset)
+        self._replacement_for_offset = offset
+        offset += 4 * (self._num_lots + 1)
+        self._check_size(path, offset)
+        self._replacement_for_values_offset = offset + _padding(offset)
+        # The last replacement_for offset is the number of values.
+        num_values, = struct.unpack_from('<I', self._map, offset - 4)
+        size = 4 * num_values
+        size += self._replacement_for_values_offset + _padding(size)
+        if size != len(self._map):
+            raise BadSnapshotError('{}: {} bytes, but its header is for '
+                                   '{}'.format(path, len(self._map), size))
+
+    def __len__(self):
+        return self._num_lots
+
+    def close(self):
+        self._map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def _convert(self, field, values):
+        if field in _DATE_FIELDS:
+            # Most lots share their dates with many others.
+            dates = {0: None}
+            for value in set(values):
+                if value:
+                    dates[value] = datetime.date.fromordinal(value)
+            return [dates[value] for value in values]
+        if field in _BOOL_FIELDS:
+            return [bool(value) for value in values]
+        if field in _STRING_FIELDS:
+            return [self._strings[value] for value in values]
+        return list(values)
+
+    def _replacement_for(self, start, end):
+        """Returns the replacement_for lists of the lots in [start, end)."""
+        offsets = struct.unpack_from('<{}I'.format(end - start + 1), self._map,
+                                     self._replacement_for_offset + 4 * start)
+        values = struct.unpack_from(
+            '<{}I'.format(offsets[-1] - offsets[0]), self._map,
+            self._replacement_for_values_offset + 4 * offsets[0])
+        return [[self._strings[value]
+                 for value in values[begin - offsets[0]:stop - offsets[0]]]
+                for begin, stop in zip(offsets, offsets[1:])]
+
+    def column(self, field):
+        """Returns the values of one field, for every lot.
+
+        Args:
+            field: A name from lots_lib.Lot.FIELD_NAMES.
+        Returns:
+            A list with one value per lot.
+        """
+        if field == 'replacement_for':
+            return self._replacement_for(0, self._num_lots)
+        code, offset = self._columns[field]
+        return self._convert(field, struct.unpack_from(
+            '<{}{}'.format(self._num_lots, code), self._map, offset))
+
+    def lot(self, row):
+        """Reads a single lot.
+
+        Args:
+            row: An integer, the index of the lot.
+        Returns:
+            A lots_lib.Lot.
+        """
+        if not 0 <= row < self._num_lots:
+            raise IndexError(row)
+        values = []
+        for field in lots_lib.Lot.FIELD_NAMES:
+            if field == 'replacement_for':
+                values.append(self._replacement_for(row, row + 1)[0])
+                continue
+            code, offset = self._columns[field]
+            values.extend(self._convert(field, struct.unpack_from(
+                '<' + code, self._map,
+                offset + struct.calcsize('<' + code) * row)))
+        return lots_lib.Lot(*values)
+
+    def lots(self):
+        """Reads every lot, one column at a time.
+
+        Returns:
+            A list of lots_lib.Lot objects, in the order they were written.
+        """
+        columns = [self.column(field) for field in lots_lib.Lot.FIELD_NAMES]
+        return [lots_lib.Lot(*values) for values in zip(*columns)]
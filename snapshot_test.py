@@ -0,0 +1,100 @@
+import datetime
+import os
+import tempfile
+import unittest
+
+import lots as lots_lib
+import snapshot
+import wash
+
+
+class TestSnapshot(unittest.TestCase):
+
+    def setUp(self):
+        self.lots = [
+            lots_lib.Lot(10, 'ABC', 'A', datetime.date(2014, 9, 15),
+                         datetime.date(2014, 9, 14), 2000, 2100,
+                         datetime.date(2014, 10, 5), 1800, 'W', 200, 'form1',
+                         'lot1', ['lot3', 'lot4'], True, True),
+            lots_lib.Lot(20, 'XYZ', '', datetime.date(2014, 9, 25),
+                         datetime.date(2014, 9, 25), 3000000000, 3000000000,
+                         None, 0, '', 0, '', 'lot3', [], False, False),
+            lots_lib.Lot(5, 'ABC', 'A', datetime.date(2014, 9, 15),
+                         datetime.date(2014, 9, 15), 1000, 1000,
+                         datetime.date(2014, 10, 5), 900, '', 0, 'form1',
+                         'lot4', ['lot1'], False, False),
+        ]
+        fd, self.path = tempfile.mkstemp(suffix='.snap')
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def write(self, lots):
+        with open(self.path, 'wb') as f:
+            snapshot.write_snapshot(lots, f)
+
+    def test_lots(self):
+        self.write(self.lots)
+        self.assertTrue(snapshot.is_snapshot(self.path))
+        with snapshot.Snapshot(self.path) as snap:
+            self.assertEqual(3, len(snap))
+            self.assertEqual(self.lots, snap.lots())
+
+    def test_lot(self):
+        self.write(self.lots)
+        with snapshot.Snapshot(self.path) as snap:
+            for row, lot in enumerate(self.lots):
+                self.assertEqual(lot, snap.lot(row))
+            with self.assertRaises(IndexError):
+                snap.lot(3)
+
+    def test_column(self):
+        self.write(self.lots)
+        with snapshot.Snapshot(self.path) as snap:
+            self.assertEqual([datetime.date(2014, 10, 5), None,
+                              datetime.date(2014, 10, 5)],
+                             snap.column('sell_date'))
+            self.assertEqual([['lot3', 'lot4'], [], ['lot1']],
+                             snap.column('replacement_for'))
+
+    def test_empty(self):
+        self.write([])
+        with snapshot.Snapshot(self.path) as snap:
+            self.assertEqual([], snap.lots())
+
+    def test_washed_lots(self):
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            'tests', 'long_chain_with_different_num_shares.csv')
+        with open(path) as f:
+            lots = lots_lib.Lots.create_from_csv_data(f)
+        wash.wash_all_lots(lots)
+        self.write(list(lots))
+        with snapshot.Snapshot(self.path) as snap:
+            self.assertEqual(lots, lots_lib.Lots(snap.lots()))
+
+    def test_not_a_snapshot(self):
+        with open(self.path, 'w') as f:
+            f.write('Num Shares,Symbol,Description\n')
+        self.assertFalse(snapshot.is_snapshot(self.path))
+        with self.assertRaises(snapshot.BadSnapshotError):
+            snapshot.Snapshot(self.path)
+        open(self.path, 'w').close()
+        with self.assertRaises(snapshot.BadSnapshotError):
+            snapshot.Snapshot(self.path)
+
+
+    def test_wrong_size(self):
+        self.write(self.lots)
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        for bad_data in [data[:20], data[:len(data) // 2], data[:-5],
+                         data + b'\0' * 8]:
+            with open(self.path, 'wb') as f:
+                f.write(bad_data)
+            with self.assertRaises(snapshot.BadSnapshotError):
+                snapshot.Snapshot(self.path)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,8 +1,13 @@
 import argparse
-import copy
+import bisect
+import collections
+import csv
 import datetime
+import heapq
+import lot_table
 import lots as lots_lib
 import logger as logger_lib
+import snapshot as snapshot_lib
 
 def _split_lot(num_shares, lot, lots, logger, type_of_lot,
                existing_loss_lot=None, existing_replacement_lot=None):
@@ -19,24 +24,12 @@ def _split_lot(num_shares, lot, lots, logger, type_of_lot,
             loss if replacement shares are being split
         existing_replacement_lot: A Lot or None, used to indicate the Lot that
             is a replacement if loss shares are being split
+    Returns:
+        The new Lot that was split off of lot.
     """
-    existing_lot_portion = float(num_shares) / float(lot.num_shares)
-    new_lot_portion = float(lot.num_shares - num_shares) / float(lot.num_shares)
-
-    new_lot = copy.deepcopy(lot)
-    new_lot.num_shares -= num_shares
-    new_lot.basis = int(round(new_lot.basis * new_lot_portion))
-    new_lot.adjusted_basis = int(round(new_lot.adjusted_basis *
-                                       new_lot_portion))
-    new_lot.proceeds = int(round(new_lot.proceeds * new_lot_portion))
-    new_lot.adjustment = int(round(new_lot.adjustment * new_lot_portion))
+    new_lot = lot.split(num_shares)
     lots.add(new_lot)
-
-    lot.num_shares = num_shares
-    lot.basis = int(round(lot.basis * existing_lot_portion))
-    lot.adjusted_basis = int(round(lot.adjusted_basis * existing_lot_portion))
-    lot.proceeds = int(round(lot.proceeds * existing_lot_portion))
-    lot.adjustment = int(round(lot.adjustment * existing_lot_portion))
+    logger.count('splits')
 
     loss_lots = [lot] if type_of_lot == 'loss' else [existing_loss_lot]
     split_off_loss_lots = [new_lot] if type_of_lot == 'loss' else []
@@ -51,8 +44,51 @@ def _split_lot(num_shares, lot, lots, logger, type_of_lot,
                       split_off_loss_lots=split_off_loss_lots,
                       replacement_lots=replacement_lots,
                       split_off_replacement_lots=split_off_replacement_lots)
+    return new_lot
+
+def is_possible_replacement(loss_lot, lot):
+    """Determines whether lot may be used as a replacement for loss_lot.
+
+    See best_replacement_lot for the rules that a replacement lot must follow.
+
+    Args:
+        loss_lot: A Lot object, which is a loss that should be washed.
+        lot: A Lot object, the potential replacement lot.
+    Returns:
+        True if lot may replace loss_lot.
+    """
+    if abs(loss_lot.sell_ordinal - lot.buy_ordinal) > 30:
+        # A replacement lot must be within 61 days (30 before, day of, and 30
+        # after) of the sale.
+        return False
+    if loss_lot is lot or (loss_lot.buy_lot != '' and
+                           loss_lot.buy_lot == lot.buy_lot):
+        # A lot cannot wash against itself.
+        return False
+    if lot.is_replacement:
+        # This lot was already used as a replacement lot, and a lot can only be
+        # used as a replacement once, per 26 CFR 1.1091-1(e) (the "one bite of
+        # the apple" rule).
+        return False
+    if lot.buy_lot in loss_lot.replacement_for:
+        # If the loss_lot was already a replacement for the lot, then don't
+        # also replace in the other direction.  This prevents a loop so that
+        # if you have two losses A and B, then B is a replacement for A, or A
+        # is a replacement for B, but they are not both replacements.
+        return False
+    if lot.sell_ordinal < loss_lot.sell_ordinal:
+        # Don't select lots that were sold before the loss. See the docstring
+        # of best_replacement_lot for the reasoning behind this. Lots that are
+        # not sold have a sell ordinal after every date.
+        return False
+    if lot.loss_processed:
+        # Don't select lots that were already processed as a loss, since that
+        # would cause the basis to increase, leading to a loop where it would
+        # make another lot be adjusted more.
+        return False
+    return True
 
-def best_replacement_lot(loss_lot, lots):
+def best_replacement_lot(loss_lot, lots, logger=logger_lib.NullLogger()):
     """Finds the best replacement lot for a loss lot.
 
     The search starts from the earliest buy, and continues forward in time. A
@@ -76,65 +112,50 @@ def best_replacement_lot(loss_lot, lots):
     Args:
         loss_lot: A Lot object, which is a loss that should be washed.
         lots: A Lots object, the full set of lots.
+        logger: A logger_lib.Logger, which counts the lots that are looked at.
     Returns:
         A Lot object, the best replacement lot, or None if there is none. May
         have more or fewer shares than the loss_lot.
     """
-    # Replacement lots must be chosen oldest first.
-    lots.sort(cmp=lots_lib.Lot.cmp_by_original_buy_date)
-    possible_replacement_lots = []
-    for lot in lots:
-        if abs(loss_lot.sell_date - lot.buy_date) > datetime.timedelta(days=30):
-            # A replacement lot must be within 61 days (30 before, day of, and
-            # 30 after) of the sale.
-            continue
-        if loss_lot is lot or (loss_lot.buy_lot != '' and
-                               loss_lot.buy_lot == lot.buy_lot):
-            # A lot cannot wash against itself.
-            continue
-        if lot.is_replacement:
-            # This lot was already used as a replacement lot, and a lot can
-            # only be used as a replacement once, per 26 CFR 1.1091-1(e) (the
-            # "one bite of the apple" rule).
-            continue
-        if lot.buy_lot in loss_lot.replacement_for:
-            # If the loss_lot was already a replacement for the lot, then don't
-            # also replace in the other direction.  This prevents a loop so
-            # that if you have two losses A and B, then B is a replacement for
-            # A, or A is a replacement for B, but they are not both
-            # replacements.
-            continue
-        if lot.sell_date and lot.sell_date < loss_lot.sell_date:
-            # Don't select lots that were sold before the loss. See the
-            # docstring for the reasoning behind this.
-            continue
-        if lot.loss_processed:
-            # Don't select lots that were already processed as a loss, since
-            # that would cause the basis to increase, leading to a loop where
-            # it would make another lot be adjusted more.
-            continue
-        possible_replacement_lots.append(lot)
-
-    if not possible_replacement_lots:
-        return None
-    return possible_replacement_lots[0]
+    # Replacement lots must be chosen oldest first, and only lots bought
+    # within the window can be replacements, so there is no need to look at
+    # any of the others. Lots also leaves out many of the lots in the window
+    # that can't be replacements, when it is faster to do so with numpy.
+    window = datetime.timedelta(days=30)
+    replacement_lot = None
+    num_scanned = 0
+    with logger.timer('find_replacement'):
+        for lot in lots.replacement_candidates(loss_lot,
+                                               loss_lot.sell_date - window,
+                                               loss_lot.sell_date + window):
+            num_scanned += 1
+            if is_possible_replacement(loss_lot, lot):
+                replacement_lot = lot
+                break
+    logger.count('replacement_lookups')
+    logger.count('candidates_scanned', num_scanned)
+    return replacement_lot
 
-def earliest_loss_lot(lots):
+def earliest_loss_lot(lots, logger=logger_lib.NullLogger()):
     """Finds the first loss sale that has not already been processed.
 
     Args:
         lots: A Lots object, the full set of lots to search through.
+        logger: A logger_lib.Logger.
     Returns:
         A Lot, or None.
     """
-    lots.sort(cmp=lots_lib.Lot.cmp_by_sell_date)
-    for lot in lots:
-        if not lot.is_loss():
-            continue
-        if lot.loss_processed:
-            continue
-        return lot
-    return None
+    with logger.timer('find_loss'):
+        with logger.timer('sort'):
+            lots.sort(key=lots_lib.Lot.sell_date_key)
+        logger.count('sorts')
+        for lot in lots:
+            if not lot.is_loss():
+                continue
+            if lot.loss_processed:
+                continue
+            return lot
+        return None
 
 def wash_one_lot(loss_lot, lots, logger=logger_lib.NullLogger()):
     """Performs a single wash.
@@ -161,11 +182,33 @@ def wash_one_lot(loss_lot, lots, logger=logger_lib.NullLogger()):
         lots: A Lots object, the full set of lots.
         logger: A logger_lib.Logger.
     """
-    replacement_lot = best_replacement_lot(loss_lot, lots)
+    replacement_lot = best_replacement_lot(loss_lot, lots, logger)
+    with logger.timer('apply_wash'):
+        wash_with_replacement(loss_lot, replacement_lot, lots, logger)
+
+def wash_with_replacement(loss_lot, replacement_lot, lots,
+                          logger=logger_lib.NullLogger()):
+    """Washes a loss lot against an already chosen replacement lot.
+
+    This is the second half of wash_one_lot, for callers that find replacement
+    lots on their own.
+
+    Args:
+        loss_lot: A Lot object, which is a loss that should be washed.
+        replacement_lot: A Lot object or None, the replacement lot for
+            loss_lot, as chosen by best_replacement_lot.
+        lots: A Lots object, the full set of lots.
+        logger: A logger_lib.Logger.
+    Returns:
+        The Lot that was split off of loss_lot or replacement_lot and added to
+        lots, or None if neither was split.
+    """
+    logger.count('losses_processed')
     if not replacement_lot:
         logger.print_lots('No replacement lot', lots, loss_lots=[loss_lot])
         loss_lot.loss_processed = True
-        return
+        return None
+    logger.count('losses_washed')
 
     logger.print_lots('Found replacement lot',
                       lots,
@@ -174,28 +217,94 @@ def wash_one_lot(loss_lot, lots, logger=logger_lib.NullLogger()):
 
     # There is a replacement lot. If it is not for the same number of shares as
     # the loss lot, split the larger one.
+    split_off_lot = None
     if loss_lot.num_shares > replacement_lot.num_shares:
-        _split_lot(replacement_lot.num_shares, loss_lot, lots, logger, 'loss',
-                   existing_replacement_lot=replacement_lot)
+        split_off_lot = _split_lot(replacement_lot.num_shares, loss_lot, lots,
+                                   logger, 'loss',
+                                   existing_replacement_lot=replacement_lot)
     elif replacement_lot.num_shares > loss_lot.num_shares:
-        _split_lot(loss_lot.num_shares, replacement_lot, lots, logger,
-                   'replacement', existing_loss_lot=loss_lot)
+        split_off_lot = _split_lot(loss_lot.num_shares, replacement_lot, lots,
+                                   logger, 'replacement',
+                                   existing_loss_lot=loss_lot)
 
     # Now the loss_lot and replacement_lot have the same number of shares.
+    _adjust(loss_lot, replacement_lot)
+
+    logger.print_lots('Adjusted basis and buy date',
+                      lots,
+                      loss_lots=[loss_lot],
+                      replacement_lots=[replacement_lot])
+    return split_off_lot
+
+def _adjust(loss_lot, replacement_lot):
+    """Moves the loss of a lot to a replacement lot with the same shares."""
     loss_lot.loss_processed = True
     loss_lot.adjustment_code = 'W'
     loss_lot.adjustment = loss_lot.adjusted_basis - loss_lot.proceeds
     replacement_lot.is_replacement = True
-    replacement_lot.replacement_for.extend(loss_lot.replacement_for)
-    replacement_lot.replacement_for.append(loss_lot.buy_lot)
+    # The chains are shared rather than copied, so this doesn't take longer
+    # as the chain grows.
+    replacement_lot.replacement_for = lots_lib.ReplacementChain.of(
+        replacement_lot.replacement_for).extended(
+            loss_lot.replacement_for).appended(loss_lot.buy_lot)
     replacement_lot.adjusted_basis += loss_lot.adjustment
     replacement_lot.adjusted_buy_date -= (
         loss_lot.sell_date - loss_lot.adjusted_buy_date)
 
-    logger.print_lots('Adjusted basis and buy date',
-                      lots,
-                      loss_lots=[loss_lot],
-                      replacement_lots=[replacement_lot])
+def wash_with_replacements(loss_lot, replacement_lots, lots,
+                           logger=logger_lib.NullLogger()):
+    """Washes a loss lot against several replacement lots in one step.
+
+    The result is the same as washing loss_lot against the first replacement
+    lot with wash_with_replacement, then the lot split off of it against the
+    second one, and so on. But the loss is split into all of its pieces at
+    once, with lots_lib.BaseLot.split_many, and the step is printed once.
+
+    Args:
+        loss_lot: A Lot object, which is a loss that should be washed.
+        replacement_lots: A list of Lot objects, the replacement lots of each
+            piece of the loss in turn. Each one but the last must have fewer
+            shares than the part of the loss that is left for it.
+        lots: A Lots object, the full set of lots.
+        logger: A logger_lib.Logger.
+    Returns:
+        The Lot that was split off of loss_lot and was not washed, or that
+        was split off of the last replacement lot, or None.
+    """
+    logger.count('losses_processed', len(replacement_lots))
+    logger.count('losses_washed', len(replacement_lots))
+    num_shares = [lot.num_shares for lot in replacement_lots]
+    num_left = loss_lot.num_shares - sum(num_shares[:-1])
+    if num_shares[-1] >= num_left:
+        del num_shares[-1]
+    new_lots = loss_lot.split_many(num_shares) if num_shares else []
+    for lot in new_lots:
+        lots.add(lot)
+    logger.count('splits', len(new_lots))
+
+    loss_lots = [loss_lot] + new_lots
+    split_off_loss_lots = []
+    split_off_replacement_lots = []
+    if len(loss_lots) > len(replacement_lots):
+        split_off_loss_lots.append(loss_lots.pop())
+    elif replacement_lots[-1].num_shares > num_left:
+        split_off_replacement_lots.append(
+            replacement_lots[-1].split(num_left))
+        lots.add(split_off_replacement_lots[0])
+        logger.count('splits')
+    for piece, replacement_lot in zip(loss_lots, replacement_lots):
+        _adjust(piece, replacement_lot)
+
+    logger.print_lots(
+        'Split loss for {} replacement lots, and adjusted basis and buy '
+        'date'.format(len(replacement_lots)),
+        lots,
+        loss_lots=loss_lots,
+        split_off_loss_lots=split_off_loss_lots,
+        replacement_lots=replacement_lots,
+        split_off_replacement_lots=split_off_replacement_lots)
+    split_off_lots = split_off_loss_lots + split_off_replacement_lots
+    return split_off_lots[0] if split_off_lots else None
 
 def wash_all_lots(lots, logger=logger_lib.NullLogger()):
     """Performs wash sales of all the lots.
@@ -205,35 +314,596 @@ def wash_all_lots(lots, logger=logger_lib.NullLogger()):
         logger: A logger_lib.Logger.
     """
     while True:
-        loss_lot = earliest_loss_lot(lots)
+        loss_lot = earliest_loss_lot(lots, logger)
         if not loss_lot:
             break
         logger.print_lots('Found loss', lots, loss_lots=[loss_lot])
         wash_one_lot(loss_lot, lots, logger)
 
+
+def _is_pending_loss(lot):
+    """Returns True if lot is a loss that has not been processed yet."""
+    return lot.is_loss() and not lot.loss_processed
+
+
+class EventWasher(object):
+    """Performs wash sales by processing each loss as an event.
+
+    wash_all_lots re-sorts all of the lots every time that it looks for the
+    next loss. Instead, this keeps the unprocessed losses in a priority queue
+    ordered by sell date, and pushes lots onto it as they are split off or
+    become losses, so the losses are processed in the same order, and washed
+    against the same replacement lots, as wash_all_lots would.
+
+    When a loss is larger than its replacement lot, the lot split off of it
+    is usually the next loss, and is washed against the next replacement lot
+    in the same window. So the replacement lots of all of the pieces are
+    found in one pass over the window, and the loss is washed against them
+    in one step with wash_with_replacements, as long as that gives the same
+    result as washing one piece at a time.
+    """
+
+    def __init__(self, lots, logger=logger_lib.NullLogger(), batch=True):
+        """Creates a washer for a set of lots.
+
+        Args:
+            lots: A Lots object.
+            logger: A logger_lib.Logger.
+            batch: Whether to wash the pieces of a loss in one step. If
+                False, each piece is washed with wash_with_replacement.
+        """
+        self._lots = lots
+        self._logger = logger
+        self._batch = batch
+        # (key, Lot) tuples. The keys are unique, so the Lots are never
+        # compared.
+        self._losses = [(lots_lib.Lot.sell_date_key(lot), lot)
+                        for lot in lots if _is_pending_loss(lot)]
+        heapq.heapify(self._losses)
+
+    def _push_if_pending_loss(self, lot):
+        if _is_pending_loss(lot):
+            heapq.heappush(self._losses,
+                           (lots_lib.Lot.sell_date_key(lot), lot))
+
+    def add(self, lot):
+        """Adds a lot to the lots being washed.
+
+        Args:
+            lot: A Lot.
+        """
+        self._lots.add(lot)
+        self._push_if_pending_loss(lot)
+
+    def wash_until(self, sell_date=None):
+        """Washes the unprocessed losses that were sold by a date.
+
+        Args:
+            sell_date: A datetime.date, or None to wash all of the losses.
+        """
+        while self._losses:
+            _, loss_lot = self._losses[0]
+            if sell_date and loss_lot.sell_date > sell_date:
+                break
+            heapq.heappop(self._losses)
+            # A lot may be queued more than once, and a split may have turned a
+            # tiny loss into a gain, so check again before processing it.
+            if not _is_pending_loss(loss_lot):
+                continue
+            self._logger.print_lots('Found loss', self._lots,
+                                    loss_lots=[loss_lot])
+            if self._batch:
+                replacement_lots = self._replacement_lots(loss_lot)
+            else:
+                replacement_lot = best_replacement_lot(loss_lot, self._lots,
+                                                       self._logger)
+                replacement_lots = [replacement_lot] if replacement_lot else []
+            with self._logger.timer('apply_wash'):
+                if len(replacement_lots) > 1:
+                    split_off_lot = wash_with_replacements(
+                        loss_lot, replacement_lots, self._lots, self._logger)
+                else:
+                    split_off_lot = wash_with_replacement(
+                        loss_lot, replacement_lots[0] if replacement_lots
+                        else None, self._lots, self._logger)
+            if split_off_lot:
+                self._push_if_pending_loss(split_off_lot)
+            for replacement_lot in replacement_lots:
+                # The adjusted basis may have turned the replacement lot into
+                # a loss.
+                self._push_if_pending_loss(replacement_lot)
+
+    def _replacement_lots(self, loss_lot):
+        """Finds the replacement lots for the pieces of a loss.
+
+        The first one is the lot that best_replacement_lot finds. A lot split
+        off of the loss keeps its sell date, buy lot and replacement_for, so
+        the lots that could not replace the loss can't replace it either, and
+        its replacement is the next lot in the window that could. The search
+        stops once the loss has enough replacement shares, or when the lot
+        split off of the loss would not be the next loss that is washed: if
+        it would not be a loss, or a pending loss would come before it.
+
+        Args:
+            loss_lot: A Lot, the loss to wash.
+        Returns:
+            A list of Lot objects, for wash_with_replacements, or
+            wash_with_replacement if there are fewer than two.
+        """
+        window = datetime.timedelta(days=30)
+        # Lots split off of the loss are sorted after every lot with the
+        # same sell date, buy date and form position.
+        position = lots_lib.Lot.sell_date_key(loss_lot)[:3]
+        # Lots in the queue may have been processed since they were queued,
+        # but stopping early for them is still correct.
+        is_next = not self._losses or self._losses[0][0][:3] > position
+        num_shares = loss_lot.num_shares
+        adjusted_basis = loss_lot.adjusted_basis
+        proceeds = loss_lot.proceeds
+        replacement_lots = []
+        num_scanned = 0
+        with self._logger.timer('find_replacement'):
+            for lot in self._lots.replacement_candidates(
+                    loss_lot, loss_lot.sell_date - window,
+                    loss_lot.sell_date + window):
+                num_scanned += 1
+                if not is_possible_replacement(loss_lot, lot):
+                    continue
+                replacement_lots.append(lot)
+                if lot.num_shares >= num_shares or not is_next:
+                    break
+                # The amounts of the piece that lot replaces, as split_many
+                # divides them.
+                piece_basis = lots_lib.split_amount(
+                    adjusted_basis, lot.num_shares, num_shares)
+                piece_proceeds = lots_lib.split_amount(
+                    proceeds, lot.num_shares, num_shares)
+                num_shares -= lot.num_shares
+                adjusted_basis -= piece_basis
+                proceeds -= piece_proceeds
+                if proceeds >= adjusted_basis:
+                    # What is left is not a loss.
+                    break
+                if (lot.sell_date and lot.proceeds <
+                        lot.adjusted_basis + piece_basis - piece_proceeds and
+                        lots_lib.Lot.sell_date_key(lot)[:3] <= position):
+                    # The replacement lot becomes a loss that is washed first.
+                    break
+        self._logger.count('replacement_lookups')
+        self._logger.count('candidates_scanned', num_scanned)
+        return replacement_lots
+
+    def wash_all(self):
+        """Washes losses until there are no unprocessed losses left."""
+        self.wash_until()
+        # wash_all_lots leaves the lots sorted by sell date, so do the same.
+        with self._logger.timer('sort'):
+            self._lots.sort(key=lots_lib.Lot.sell_date_key)
+        self._logger.count('sorts')
+
+def event_wash_all_lots(lots, logger=logger_lib.NullLogger()):
+    """Performs wash sales of all the lots, using an EventWasher.
+
+    The result is the same as wash_all_lots, but this does not sort the lots
+    once per loss.
+
+    Args:
+        lots: A Lots object.
+        logger: A logger_lib.Logger.
+    """
+    EventWasher(lots, logger).wash_all()
+
+class UnorderedLotsError(Exception):
+    """Raised if lots that must be in buy date order are not."""
+
+
+def stream_wash_lots(lots, logger=logger_lib.NullLogger()):
+    """Performs wash sales of lots as they are read.
+
+    Losses are washed in sell date order, as soon as every lot that was bought
+    within 30 days of the sale has been read. A lot is yielded once no loss
+    that is left to wash could change it: it was bought more than 30 days
+    before the earliest sale that is left to wash, and it is not itself a loss
+    that is left to wash. So only the lots within the window, and the losses
+    that have not been sold yet, are kept in memory.
+
+    The result is the same as wash_all_lots, except for the order of the lots.
+
+    Args:
+        lots: An iterable of Lot objects, in original buy date order, such as
+            from lots_lib.Lots.iter_csv_data.
+        logger: A logger_lib.Logger. Only the lots that are still in memory
+            are printed.
+    Yields:
+        Lot objects, once they are fully washed.
+    Raises:
+        UnorderedLotsError: If the lots are not in original buy date order.
+    """
+    window = datetime.timedelta(days=30)
+    pending = lots_lib.Lots([])
+    washer = EventWasher(pending, logger)
+    frontier = None
+    for lot in lots:
+        if frontier and lot.buy_date < frontier:
+            raise UnorderedLotsError(str(lot))
+        if lot.buy_date != frontier:
+            # Every lot bought before the new frontier has been read, so all
+            # losses sold more than 30 days before it can be washed.
+            frontier = lot.buy_date
+            washer.wash_until(frontier - window - datetime.timedelta(days=1))
+            done = []
+            for done_lot in pending.lots_bought_between(
+                    datetime.date.min, frontier - 2 * window -
+                    datetime.timedelta(days=1)):
+                if not _is_pending_loss(done_lot):
+                    done.append(done_lot)
+            if done:
+                pending.remove(done)
+                for done_lot in done:
+                    yield done_lot
+        washer.add(lot)
+    washer.wash_until()
+    for lot in sorted(pending, key=lots_lib.Lot.original_buy_date_key):
+        yield lot
+
+def incremental_wash_lots(lots, new_lots, logger=logger_lib.NullLogger()):
+    """Washes new lots along with lots that were already washed.
+
+    Every new lot must have been bought after every lot in lots was bought or
+    sold, as when the trades since the last wash are appended. Then every loss
+    in lots is still washed before any new loss, and with the same
+    replacement, since the new lots were bought after every other possible
+    replacement. The only losses that the new lots can affect are those that
+    found no replacement for some of their shares, and were sold within 30
+    days of a new lot being bought. Those are washed again along with the new
+    lots, which gives the same result as washing all of the lots from scratch,
+    without redoing any of the other washes.
+
+    A new trade can't sell a lot that is in lots, since that is a change to
+    the lot's row and not a new row, and a new lot can't be bought on or
+    before the last sale in lots. Those histories must be washed from
+    scratch instead.
+
+    Args:
+        lots: A Lots object, which was already washed by one of the ENGINES,
+            for example as read back from its csv output. The new lots are
+            added to it.
+        new_lots: A list of Lot objects, which have not been washed.
+        logger: A logger_lib.Logger.
+    Raises:
+        UnorderedLotsError: If a new lot was not bought after every lot in
+            lots was bought or sold.
+    """
+    if not new_lots:
+        return
+    first_new_buy_date = min(lot.buy_date for lot in new_lots)
+    for lot in lots:
+        if (lot.buy_date >= first_new_buy_date or
+                (lot.sell_date and lot.sell_date >= first_new_buy_date)):
+            raise UnorderedLotsError(str(lot))
+
+    window_start = first_new_buy_date - datetime.timedelta(days=30)
+    for lot in lots:
+        # Losses that were washed have the W adjustment code. Losses that
+        # weren't only have loss_processed set, so clearing it undoes that.
+        if (lot.loss_processed and lot.adjustment_code != 'W' and
+                lot.is_loss() and lot.sell_date >= window_start):
+            lot.loss_processed = False
+    lots.replacement_flags_cleared()
+
+    washer = EventWasher(lots, logger)
+    for lot in new_lots:
+        washer.add(lot)
+    washer.wash_all()
+
+def _next_buy_lot_number(lots):
+    """Returns the number to use for the next buy_lot that Lots populates."""
+    numbers = [int(lot.buy_lot[1:]) for lot in lots
+               if lot.buy_lot.startswith('_') and lot.buy_lot[1:].isdigit()]
+    return max(numbers) + 1 if numbers else 1
+
+# The wash engines that can be chosen from the command line. They all have
+# the same signature as wash_all_lots.
+ENGINES = {
+    'event': event_wash_all_lots,
+    'iterative': wash_all_lots,
+}
+
+def read_symbol_groups(data):
+    """Reads a mapping of symbols to groups of substantially identical stock.
+
+    The first line of the csv data must be the headers Symbol,Group. Each
+    other line maps a symbol to the name of its group. Blank lines are
+    skipped.
+
+    Args:
+        data: A list of strings, where each line is a CSV row.
+    Returns:
+        A dict of symbol to group name.
+    Raises:
+        BadHeadersError: The data is empty or has the wrong headers.
+        ValueError: A line doesn't have exactly a symbol and a group.
+    """
+    reader = csv.reader(data)
+    header_row = next(reader, None)
+    if header_row is None:
+        raise lots_lib.BadHeadersError('No headers, the file is empty')
+    if header_row != ['Symbol', 'Group']:
+        raise lots_lib.BadHeadersError(str(header_row))
+    groups = {}
+    for row in reader:
+        if not any(value.strip() for value in row):
+            continue
+        if len(row) != 2 or not row[0] or not row[1]:
+            raise ValueError('Bad symbol group on line {}: {}'.format(
+                reader.line_num, ','.join(row)))
+        symbol, group = row
+        groups[symbol] = group
+    return groups
+
+def partition_lots(lots, groups=None):
+    """Splits lots into sets of substantially identical lots.
+
+    Args:
+        lots: A Lots object.
+        groups: A dict of symbol to group name, or None. Lots with a symbol
+            that is not in groups are grouped by their symbol.
+    Returns:
+        A list of (group name, Lots) tuples, sorted by group name.
+    """
+    groups = groups or {}
+    partitions = collections.defaultdict(list)
+    for lot in lots:
+        partitions[groups.get(lot.symbol, lot.symbol)].append(lot)
+    return [(group, lots_lib.Lots(partitions[group]))
+            for group in sorted(partitions)]
+
+def window_partitions(lots):
+    """Splits lots into sets that can be washed independently.
+
+    A sold lot can only wash against lots bought within 30 days of its sale,
+    and a wash only changes the two lots involved and the lots split off of
+    them. So two lots can only affect each other's wash through a chain of
+    sales with overlapping windows, and washing each set on its own gives the
+    same lots as washing all of them together. This holds for gains as well
+    as losses, since a replacement may be turned into a loss by its adjusted
+    basis.
+
+    Args:
+        lots: An iterable of Lot objects.
+    Returns:
+        A list of lists of Lot objects. Each list is in order of buy date, and
+        the lists are in order of their first lot.
+    """
+    lots = sorted(lots, key=lots_lib.Lot.original_buy_date_key)
+    buy_ordinals = [lot.buy_ordinal for lot in lots]
+    parents = list(range(len(lots)))
+
+    def find(i):
+        while parents[i] != i:
+            parents[i] = parents[parents[i]]
+            i = parents[i]
+        return i
+
+    # Each sale joins itself to the run of lots bought in its window. The runs
+    # are merged first, so that the lots in them are joined in linear time.
+    windows = []
+    for i, lot in enumerate(lots):
+        if lot.sell_date:
+            start = bisect.bisect_left(buy_ordinals, lot.sell_ordinal - 30)
+            end = bisect.bisect_right(buy_ordinals, lot.sell_ordinal + 30)
+            if start < end:
+                windows.append((start, end, i))
+    windows.sort()
+    joined_end = 0
+    for start, end, i in windows:
+        for j in range(max(start, joined_end - 1), end - 1):
+            parents[find(j + 1)] = find(j)
+        joined_end = max(joined_end, end)
+        parents[find(i)] = find(start)
+
+    partitions = collections.OrderedDict()
+    for i, lot in enumerate(lots):
+        partitions.setdefault(find(i), []).append(lot)
+    return list(partitions.values())
+
+def _wash_partition(engine_and_lots):
+    """Washes one partition of lots. Runs in a worker process.
+
+    Args:
+        engine_and_lots: A tuple of the engine name and a Lots object.
+    Returns:
+        The washed Lots object.
+    """
+    engine, lots = engine_and_lots
+    lots_lib.reserve_lot_numbers(lots)
+    ENGINES[engine](lots)
+    return lots
+
+def wash_partitions(partitions, engine='event', jobs=None):
+    """Washes each partition of lots independently.
+
+    Args:
+        partitions: A list of (group name, Lots) tuples, as returned by
+            partition_lots.
+        engine: The name of the wash engine to use, a key of ENGINES.
+        jobs: The number of worker processes to use, or None to use one per
+            CPU. If 1, the lots are washed in this process.
+    Returns:
+        A Lots object, with the washed lots of each partition in the same
+        order as partitions.
+    """
+    tasks = [(engine, lots) for _, lots in partitions]
+    if jobs == 1:
+        washed = [_wash_partition(task) for task in tasks]
+    else:
+        # Importing multiprocessing slows down starting up, and most runs
+        # don't use it, so it is only imported when it is needed.
+        import multiprocessing
+        pool = multiprocessing.Pool(jobs)
+        try:
+            washed = pool.map(_wash_partition, tasks)
+        finally:
+            pool.close()
+            pool.join()
+    merged = []
+    for lots in washed:
+        merged.extend(lots.lots())
+    return lots_lib.Lots(merged)
+
+def read_lots(path, backend='lot'):
+    """Reads lots from a csv file or a snapshot.
+
+    Args:
+        path: The path of the file. It is read as a snapshot if it is one, and
+            as csv data otherwise.
+        backend: 'lot' to store the lots as Lot objects, or 'table' to store
+            them in a lot_table.LotTable.
+    Returns:
+        A Lots object.
+    """
+    if snapshot_lib.is_snapshot(path):
+        with snapshot_lib.Snapshot(path) as snapshot:
+            lots = snapshot.lots()
+        if backend == 'table':
+            table = lot_table.LotTable()
+            lots = [table.append(lot) for lot in lots]
+        return lots_lib.Lots(lots)
+    with open(path, newline='') as f:
+        if backend == 'table':
+            return lots_lib.Lots(
+                lot_table.LotTable.create_from_csv_data(f).lots())
+        return lots_lib.Lots.create_from_csv_data(f)
+
+def write_lots(lots, path):
+    """Writes lots to a snapshot if path ends with .snap, else as csv data.
+
+    Args:
+        lots: A Lots object.
+        path: The path of the file to write.
+    """
+    if path.endswith('.snap'):
+        with open(path, 'wb') as f:
+            snapshot_lib.write_snapshot(list(lots), f)
+    else:
+        with open(path, 'w', newline='') as f:
+            lots.write_csv_data(f)
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('-o', '--out_file')
     parser.add_argument('-w', '--do_wash', metavar='in_file')
     parser.add_argument('-q', '--quiet', action="store_true")
+    parser.add_argument('-e', '--engine', choices=sorted(ENGINES),
+                        default='event')
+    parser.add_argument('-s', '--by_symbol', action='store_true')
+    parser.add_argument('-g', '--groups', metavar='groups_file')
+    parser.add_argument('-j', '--jobs', type=int)
+    parser.add_argument('--stream', action='store_true')
+    parser.add_argument('-b', '--backend', choices=['lot', 'table'],
+                        default='lot')
+    parser.add_argument('-p', '--previous', metavar='previous_out_file',
+                        help='Wash the lots in --do_wash along with this '
+                        'earlier output. Every new lot must have been bought '
+                        'after every earlier lot was bought or sold, so a '
+                        'sale of a lot that was open before, or a buy on or '
+                        'before the last earlier sale, needs a full wash '
+                        'without --previous.')
+    parser.add_argument('--stats', nargs='?', const='text',
+                        choices=['text', 'json'])
+    parser.add_argument('-t', '--trace', metavar='trace_file')
     parsed = parser.parse_args()
 
-    if parsed.quiet:
+    trace_file = None
+    if parsed.trace:
+        # Steps are recorded instead of printed, so that they can be replayed
+        # with replay_trace.py.
+        trace_file = open(parsed.trace, 'w', 1 << 20)
+        logger = logger_lib.TraceLogger(trace_file)
+    elif parsed.quiet:
         logger = logger_lib.NullLogger()
     else:
         logger = logger_lib.TermLogger()
-    if parsed.do_wash:
-        lots = lots_lib.Lots([])
-        with open(parsed.do_wash) as f:
-            lots = lots_lib.Lots.create_from_csv_data(f)
+    if parsed.stats:
+        logger = logger_lib.StatsLogger(logger)
+    if parsed.stream:
+        # The lots are written out as they are washed, instead of being kept
+        # in memory until the end.
+        if not parsed.do_wash or not parsed.out_file:
+            parser.error('--stream requires --do_wash and --out_file')
+        if parsed.by_symbol or parsed.groups:
+            parser.error('--stream does not support --by_symbol or --groups')
+        with open(parsed.do_wash, newline='') as in_file:
+            with open(parsed.out_file, 'w', newline='') as out_file:
+                with logger.timer('stream'):
+                    writer = lots_lib.Lots.csv_writer(out_file)
+                    try:
+                        for lot in stream_wash_lots(
+                                lots_lib.Lots.iter_csv_data(in_file),
+                                logger):
+                            writer.writerow(lots_lib.Lots.csv_row(lot))
+                    except UnorderedLotsError as e:
+                        parser.error('--stream requires the rows to be '
+                                     'sorted by buy date: {}'.format(e))
+    elif parsed.previous:
+        # Only the new lots are in the in_file, and the previous output has
+        # the lots that were already washed.
+        if not parsed.do_wash:
+            parser.error('--previous requires --do_wash')
+        # The earlier output was washed as a whole, so the new lots can't be
+        # washed by partition or stored in a table.
+        if parsed.by_symbol or parsed.groups or parsed.backend != 'lot':
+            parser.error(
+                '--previous does not support --by_symbol, --groups or '
+                '--backend')
+        with logger.timer('parse'):
+            lots = read_lots(parsed.previous)
+            with open(parsed.do_wash, newline='') as f:
+                new_lots = list(lots_lib.Lots.iter_csv_data(
+                    f, _next_buy_lot_number(lots)))
+        with logger.timer('wash'):
+            try:
+                incremental_wash_lots(lots, new_lots, logger)
+            except UnorderedLotsError as e:
+                parser.error('every new lot must be bought after every lot '
+                             'in {} was bought or sold, so wash all of the '
+                             'lots without --previous: {}'.format(
+                                 parsed.previous, e))
+        if parsed.out_file:
+            with logger.timer('write'):
+                write_lots(lots, parsed.out_file)
+        if not parsed.out_file or trace_file:
+            logger.print_lots('Final lots', lots)
+    elif parsed.do_wash:
+        with logger.timer('parse'):
+            lots = read_lots(parsed.do_wash, parsed.backend)
         logger.print_lots('Start lots', lots)
-        wash_all_lots(lots, logger)
+        with logger.timer('wash'):
+            if parsed.by_symbol or parsed.groups:
+                groups = None
+                if parsed.groups:
+                    try:
+                        with open(parsed.groups, newline='') as f:
+                            groups = read_symbol_groups(f)
+                    except (lots_lib.BadHeadersError, ValueError) as e:
+                        parser.error('bad --groups file: {}'.format(e))
+                # The partitions are washed in worker processes, so the steps
+                # can't be logged, and only the total time is kept.
+                lots = wash_partitions(partition_lots(lots, groups),
+                                       parsed.engine, parsed.jobs)
+            else:
+                ENGINES[parsed.engine](lots, logger)
         if parsed.out_file:
-            with open(parsed.out_file, 'w') as f:
-                lots.write_csv_data(f)
-        else:
+            with logger.timer('write'):
+                write_lots(lots, parsed.out_file)
+        if not parsed.out_file or trace_file:
             logger.print_lots('Final lots', lots)
 
+    if parsed.stats:
+        logger.print_stats(as_json=parsed.stats == 'json')
+    if trace_file:
+        trace_file.close()
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,398 @@
+import argparse
+import asyncio
+import collections
+import concurrent.futures
+import csv
+import io
+import json
+import time
+
+import lots as lots_lib
+import wash as wash_lib
+
+
+def _rows_from_json(json_lots):
+    """Converts lots sent as json into csv data.
+
+    Args:
+        json_lots: A list of dicts of Lot field name to string, like
+            lots_lib.Lots.csv_row returns. Missing fields are blank.
+    Returns:
+        A file-like object of csv data, with the headers.
+    """
+    data = io.StringIO(newline='')
+    writer = lots_lib.Lots.csv_writer(data)
+    for json_lot in json_lots:
+        writer.writerow(dict((field, json_lot.get(field, ''))
+                             for field in lots_lib.Lot.FIELD_NAMES))
+    data.seek(0)
+    return data
+
+
+def _check_request(request):
+    """Checks that a request has the fields that WashService.handle needs.
+
+    Raises:
+        ValueError: If a field is missing or has the wrong type.
+    """
+    if not isinstance(request.get('account'), str):
+        raise ValueError('A request must have an account string')
+    if 'csv' in request:
+        if not isinstance(request['csv'], str):
+            raise ValueError('csv must be a string')
+    elif 'lots' in request:
+        json_lots = request['lots']
+        if not (isinstance(json_lots, list) and
+                all(isinstance(json_lot, dict) and
+                    all(isinstance(value, str)
+                        for value in json_lot.values())
+                    for json_lot in json_lots)):
+            raise ValueError('lots must be a list of objects of field name '
+                             'to string')
+    else:
+        raise ValueError('A request must have csv or lots')
+
+
+def _is_numbered_buy_lot(buy_lot):
+    """Returns True if buy_lot is like those that Lots gives blank rows."""
+    return buy_lot.startswith('_') and buy_lot[1:].isdigit()
+
+
+def _renumber_buy_lots(lots):
+    """Renumbers the numbered buy lots of a partition from _1, in place.
+
+    Blank buy lots are numbered by the row's position in the whole request,
+    so inserting a row renumbers every row after it. Numbering them within
+    the partition instead, in order of first use, keeps the lots of a
+    partition the same when rows are inserted before it. The names are only
+    compared to each other by the wash, so the washed lots are the same up
+    to the renumbering.
+
+    Args:
+        lots: A list of Lot objects.
+    Returns:
+        A list of the original names. The one at index i was renamed to
+        _<i + 1>.
+    """
+    numbers = {}
+
+    def renumber(buy_lot):
+        if not _is_numbered_buy_lot(buy_lot):
+            return buy_lot
+        if buy_lot not in numbers:
+            numbers[buy_lot] = '_{}'.format(len(numbers) + 1)
+        return numbers[buy_lot]
+
+    for lot in lots:
+        lot.buy_lot = renumber(lot.buy_lot)
+        if lot.replacement_for:
+            lot.replacement_for = lots_lib.ReplacementChain.of(
+                [renumber(buy_lot) for buy_lot in lot.replacement_for])
+    return list(numbers)
+
+
+class _WashedPartition(object):
+    """The washed lots of one of the partitions of a request.
+
+    The numbered buy lots are renumbered as by _renumber_buy_lots, and are
+    given back their names in each request that the rows are used for.
+    """
+
+    __slots__ = ['_rows', '_csv_data']
+
+    def __init__(self, lots):
+        """Initializes the partition.
+
+        Args:
+            lots: A Lots object, which was washed after _renumber_buy_lots.
+        """
+        self._rows = [lots_lib.Lots.csv_row(lot) for lot in lots]
+        # The names that the csv data was written with, and the data.
+        self._csv_data = (None, None)
+
+    def rows(self, names):
+        """Returns the rows, with the original names of the buy lots.
+
+        Args:
+            names: A list of strings, as returned by _renumber_buy_lots.
+        Returns:
+            A list of dicts, like lots_lib.Lots.csv_row returns.
+        """
+
+        def rename(buy_lot):
+            if _is_numbered_buy_lot(buy_lot):
+                return names[int(buy_lot[1:]) - 1]
+            return buy_lot
+
+        rows = []
+        for row in self._rows:
+            row = dict(row)
+            row['buy_lot'] = rename(row['buy_lot'])
+            if row['replacement_for']:
+                row['replacement_for'] = '|'.join(
+                    rename(buy_lot)
+                    for buy_lot in row['replacement_for'].split('|'))
+            rows.append(row)
+        return rows
+
+    def csv_data(self, names):
+        """Returns the rows as csv data, without the headers.
+
+        Args:
+            names: A list of strings, as returned by _renumber_buy_lots.
+        """
+        # Writing the rows takes longer than finding the partition in the
+        # cache, so it is only done again if the names changed.
+        if self._csv_data[0] != names:
+            data = io.StringIO(newline='')
+            writer = csv.DictWriter(data, fieldnames=lots_lib.Lot.FIELD_NAMES)
+            writer.writerows(self.rows(names))
+            self._csv_data = (names, data.getvalue())
+        return self._csv_data[1]
+
+
+class WashService(object):
+    """Washes the lots of many accounts, remembering the last wash of each.
+
+    The lots of a request are split with wash_lib.window_partitions, and each
+    partition that is the same as one in the account's previous request, up
+    to the numbers given to rows without a buy lot, is not washed again. So a
+    small edit only re-washes the lots within 30 days of a sale that it can
+    reach.
+    """
+
+    def __init__(self, engine='event', max_accounts=100):
+        """Initializes the service.
+
+        Args:
+            engine: The name of the wash engine to use, a key of
+                wash_lib.ENGINES.
+            max_accounts: The number of accounts to remember. The least
+                recently used account is forgotten first.
+        """
+        self._engine = engine
+        self._max_accounts = max_accounts
+        # Account to a dict of the partitions of its last request, from the
+        # keys of the partition's lots, as a frozenset of (key, count) pairs,
+        # to its _WashedPartition.
+        self._accounts = collections.OrderedDict()
+
+    def wash(self, account, lots):
+        """Washes the lots of an account.
+
+        Args:
+            account: A string naming the account.
+            lots: A list of Lot objects, which have not been washed. Their
+                numbered buy lots are renumbered by _renumber_buy_lots.
+        Returns:
+            A tuple of a list of (_WashedPartition, names) tuples, in order of
+            their first buy date, where names is the list to pass to its rows
+            and csv_data, and the number of them that were washed instead of
+            taken from the last request. The lots of each partition are in
+            the order that the engine left them.
+        """
+        cache = self._accounts.pop(account, {})
+        new_cache = {}
+        washed_partitions = []
+        num_washed = 0
+        for partition in wash_lib.window_partitions(lots):
+            names = _renumber_buy_lots(partition)
+            key = frozenset(collections.Counter(
+                lot.key() for lot in partition).items())
+            washed = cache.get(key)
+            if washed is None:
+                partition_lots = lots_lib.Lots(partition)
+                wash_lib.ENGINES[self._engine](partition_lots)
+                washed = _WashedPartition(partition_lots)
+                num_washed += 1
+            new_cache[key] = washed
+            washed_partitions.append((washed, names))
+        self._accounts[account] = new_cache
+        while len(self._accounts) > self._max_accounts:
+            self._accounts.popitem(last=False)
+        return washed_partitions, num_washed
+
+    def handle(self, request):
+        """Handles one request.
+
+        Args:
+            request: A dict with the 'account' to wash, and either 'csv', a
+                string of csv data like wash.py reads, or 'lots', a list of
+                dicts of Lot field name to string. An 'id' is copied to the
+                response.
+        Returns:
+            A dict with the washed lots in the same form as the request, the
+            number of 'partitions' and how many were 'washed', and the
+            'seconds' it took. If the lots could not be washed, the dict has
+            an 'error' instead.
+        """
+        start = time.time()
+        response = {'id': request.get('id'), 'account': request.get('account')}
+        try:
+            _check_request(request)
+            if 'csv' in request:
+                data = io.StringIO(request['csv'], newline='')
+            else:
+                data = _rows_from_json(request['lots'])
+            lots = list(lots_lib.Lots.iter_csv_data(data))
+        except (lots_lib.BadHeadersError, csv.Error, ValueError) as e:
+            response['error'] = '{}: {}'.format(type(e).__name__, e)
+            return response
+        partitions, num_washed = self.wash(request['account'], lots)
+        if 'csv' in request:
+            data = io.StringIO(newline='')
+            lots_lib.Lots.csv_writer(data)
+            data.writelines(partition.csv_data(names)
+                            for partition, names in partitions)
+            response['csv'] = data.getvalue()
+        else:
+            response['lots'] = [row for partition, names in partitions
+                                for row in partition.rows(names)]
+        response['partitions'] = len(partitions)
+        response['washed'] = num_washed
+        response['seconds'] = time.time() - start
+        return response
+
+
+class WashServer(object):
+    """Serves a WashService over a stream of json lines.
+
+    Each line that a client sends is a request for WashService.handle, and the
+    response is sent back as one line of json, as soon as it is ready.
+    Responses may come back in a different order than the requests, so
+    clients should set an 'id' in each request.
+
+    Requests are washed one at a time in a worker thread, so that the server
+    can keep reading. If more requests for an account arrive while one of its
+    requests is being washed, only the last of them is washed, and the others
+    get a response with 'superseded' set. An editor that sends a request
+    after every edit then only waits for the wash of its latest edit.
+    """
+
+    def __init__(self, service):
+        """Initializes the server.
+
+        Args:
+            service: A WashService.
+        """
+        self._service = service
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        # Account to a tuple of its next request and the future for the
+        # response, for the accounts that have a request being washed.
+        self._pending = {}
+        self._running = set()
+
+    async def handle(self, request):
+        """Handles a request, as WashService.handle.
+
+        Args:
+            request: A request dict, which must have an 'account'.
+        Returns:
+            A response dict.
+        """
+        account = request['account']
+        future = asyncio.get_running_loop().create_future()
+        if account in self._pending:
+            superseded_request, superseded = self._pending[account]
+            superseded.set_result({'id': superseded_request.get('id'),
+                                   'account': account, 'superseded': True})
+        self._pending[account] = (request, future)
+        if account not in self._running:
+            self._running.add(account)
+            asyncio.ensure_future(self._run(account))
+        return await future
+
+    async def _run(self, account):
+        """Washes the requests of an account until none are pending."""
+        loop = asyncio.get_running_loop()
+        try:
+            while account in self._pending:
+                request, future = self._pending.pop(account)
+                try:
+                    response = await loop.run_in_executor(
+                        self._executor, self._service.handle, request)
+                except Exception as e:
+                    # Keep serving the other requests.
+                    response = {'id': request.get('id'), 'account': account,
+                                'error': '{}: {}'.format(type(e).__name__, e)}
+                future.set_result(response)
+        finally:
+            self._running.discard(account)
+
+    async def handle_connection(self, reader, writer):
+        """Reads requests from a client and writes back the responses.
+
+        Args:
+            reader: An asyncio.StreamReader.
+            writer: An asyncio.StreamWriter.
+        """
+
+        async def respond(line):
+            try:
+                request = json.loads(line)
+                if not (isinstance(request, dict) and
+                        isinstance(request.get('account'), str)):
+                    raise ValueError('A request must be a json object with '
+                                     'an account string')
+            except ValueError as e:
+                response = {'id': None, 'error': 'ValueError: {}'.format(e)}
+            else:
+                response = await self.handle(request)
+            writer.write(json.dumps(response).encode('utf-8') + b'\n')
+            await writer.drain()
+
+        tasks = []
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if line.strip():
+                    tasks.append(asyncio.ensure_future(respond(line)))
+            await asyncio.gather(*tasks)
+        finally:
+            writer.close()
+
+
+async def serve(server, socket_path=None, port=None):
+    """Serves requests until cancelled.
+
+    Args:
+        server: A WashServer.
+        socket_path: The path of a unix socket to listen on, or None.
+        port: The localhost port to listen on, used if socket_path is None.
+    """
+    if socket_path:
+        listener = await asyncio.start_unix_server(server.handle_connection,
+                                                   path=socket_path)
+    else:
+        listener = await asyncio.start_server(server.handle_connection,
+                                              host='127.0.0.1', port=port)
+    async with listener:
+        await listener.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Washes lots sent as json lines over a local socket.')
+    parser.add_argument('-u', '--socket', metavar='socket_path',
+                        help='Listen on this unix socket.')
+    parser.add_argument('-p', '--port', type=int, default=8472,
+                        help='Listen on this localhost port, if --socket is '
+                        'not given.')
+    parser.add_argument('-e', '--engine', choices=sorted(wash_lib.ENGINES),
+                        default='event')
+    parser.add_argument('--max_accounts', type=int, default=100,
+                        help='The number of accounts to keep washed lots '
+                        'for.')
+    parsed = parser.parse_args()
+
+    server = WashServer(WashService(parsed.engine, parsed.max_accounts))
+    try:
+        asyncio.run(serve(server, parsed.socket, parsed.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+import asyncio
+import datetime
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import lots as lots_lib
+import wash
+import wash_server
+
+
+def create_lot(num_shares, buy_date, basis, sell_date=None, proceeds=0):
+    return lots_lib.Lot(num_shares, 'ABC', '', buy_date, buy_date, basis,
+                        basis, sell_date, proceeds, '', 0, '', '', [], False,
+                        False)
+
+
+def csv_data(lots):
+    data = io.StringIO(newline='')
+    lots_lib.Lots(lots).write_csv_data(data)
+    return data.getvalue()
+
+
+def parse(data):
+    return lots_lib.Lots.create_from_csv_data(data.splitlines(True))
+
+
+class TestWashService(unittest.TestCase):
+
+    def setUp(self):
+        day = datetime.date(2014, 1, 1)
+        self.lots = []
+        for year in range(3):
+            buy_date = day + datetime.timedelta(days=365 * year)
+            self.lots.append(create_lot(
+                10, buy_date, 2000, buy_date + datetime.timedelta(days=10),
+                1000))
+            self.lots.append(create_lot(
+                5, buy_date + datetime.timedelta(days=20), 2000))
+        self.service = wash_server.WashService()
+
+    def expected(self, data):
+        lots = parse(data)
+        wash.event_wash_all_lots(lots)
+        return lots
+
+    def test_wash_csv(self):
+        data = csv_data(self.lots)
+        response = self.service.handle({'id': 1, 'account': 'a', 'csv': data})
+        self.assertEqual(1, response['id'])
+        self.assertEqual(3, response['partitions'])
+        self.assertEqual(3, response['washed'])
+        self.assertEqual(self.expected(data), parse(response['csv']))
+
+        # Only the partition with the edit is washed again.
+        self.lots[-1].num_shares = 20
+        data = csv_data(self.lots)
+        response = self.service.handle({'id': 2, 'account': 'a', 'csv': data})
+        self.assertEqual(1, response['washed'])
+        self.assertEqual(self.expected(data), parse(response['csv']))
+
+        # Accounts are cached separately.
+        response = self.service.handle({'id': 3, 'account': 'b', 'csv': data})
+        self.assertEqual(3, response['washed'])
+
+    def test_insert_row_without_buy_lot(self):
+        data = csv_data(self.lots)
+        response = self.service.handle({'account': 'a', 'csv': data})
+        self.assertEqual(3, response['washed'])
+
+        # The rows after the new one are numbered differently, but only the
+        # partition with the new row is washed again.
+        self.lots.insert(1, create_lot(3, datetime.date(2014, 1, 25), 600))
+        for lot in self.lots:
+            lot.buy_lot = ''
+        data = csv_data(self.lots)
+        response = self.service.handle({'account': 'a', 'csv': data})
+        self.assertEqual(1, response['washed'])
+        self.assertEqual(self.expected(data), parse(response['csv']))
+        json_lots = [lots_lib.Lots.csv_row(lot) for lot in parse(data)]
+        response = self.service.handle({'account': 'a', 'lots': json_lots})
+        self.assertEqual(0, response['washed'])
+        self.assertEqual(
+            self.expected(data),
+            parse(wash_server._rows_from_json(response['lots']).read()))
+
+    def test_wash_json(self):
+        data = csv_data(self.lots)
+        json_lots = [lots_lib.Lots.csv_row(lot) for lot in parse(data)]
+        del json_lots[0]['description']
+        response = self.service.handle({'account': 'a', 'lots': json_lots})
+        self.assertIsNone(response['id'])
+        self.assertEqual(
+            self.expected(data),
+            parse(wash_server._rows_from_json(response['lots']).read()))
+
+    def test_max_accounts(self):
+        service = wash_server.WashService(max_accounts=1)
+        data = csv_data(self.lots)
+        for account in ['a', 'b', 'a']:
+            response = service.handle({'account': account, 'csv': data})
+            self.assertEqual(3, response['washed'])
+
+    def test_errors(self):
+        response = self.service.handle({'account': 'a',
+                                        'csv': 'Num Shares,Symbol\n'})
+        self.assertTrue(response['error'].startswith('BadHeadersError: '))
+        response = self.service.handle({'account': 'a'})
+        self.assertEqual('ValueError: A request must have csv or lots',
+                         response['error'])
+        response = self.service.handle({'account': 'a', 'lots': [1]})
+        self.assertTrue(response['error'].startswith('ValueError: '))
+        response = self.service.handle({'account': 'a', 'csv': 1})
+        self.assertTrue(response['error'].startswith('ValueError: '))
+        # A row without a buy date.
+        response = self.service.handle({'account': 'a',
+                                        'lots': [{'num_shares': '10'}]})
+        self.assertTrue(response['error'].startswith('ValueError: '))
+
+
+class TestWashServer(unittest.TestCase):
+
+    def setUp(self):
+        self.data = csv_data([create_lot(
+            10, datetime.date(2014, 1, 1), 2000, datetime.date(2014, 1, 5),
+            1000), create_lot(10, datetime.date(2014, 1, 10), 2000)])
+        self.server = wash_server.WashServer(wash_server.WashService())
+
+    def test_supersede(self):
+
+        async def handle_all():
+            return await asyncio.gather(*[
+                self.server.handle({'id': i, 'account': 'a',
+                                    'csv': self.data})
+                for i in range(3)] + [
+                self.server.handle({'id': 3, 'account': 'b',
+                                    'csv': self.data})])
+
+        responses = asyncio.run(handle_all())
+        self.assertEqual([0, 1, 2, 3], [r['id'] for r in responses])
+        self.assertTrue(responses[0]['superseded'])
+        self.assertTrue(responses[1]['superseded'])
+        for response in responses[2:]:
+            self.assertNotIn('superseded', response)
+            self.assertEqual(1, response['washed'])
+
+    def test_unix_socket(self):
+        temp_dir = tempfile.mkdtemp()
+        path = os.path.join(temp_dir, 'wash.sock')
+
+        async def request_all():
+            listener = await asyncio.start_unix_server(
+                self.server.handle_connection, path=path)
+            async with listener:
+                reader, writer = await asyncio.open_unix_connection(path)
+                writer.write(b'not json\n')
+                writer.write(json.dumps({'id': 'x', 'account': 'a',
+                                         'csv': self.data}).encode() + b'\n')
+                await writer.drain()
+                writer.write_eof()
+                responses = [json.loads(line) async for line in reader]
+                writer.close()
+                return responses
+
+        try:
+            responses = asyncio.run(request_all())
+        finally:
+            shutil.rmtree(temp_dir)
+        self.assertEqual(2, len(responses))
+        self.assertTrue(responses[0]['error'].startswith('ValueError: '))
+        self.assertEqual('x', responses[1]['id'])
+        self.assertEqual(self.expected_lots(), parse(responses[1]['csv']))
+
+    def expected_lots(self):
+        lots = parse(self.data)
+        wash.event_wash_all_lots(lots)
+        return lots
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,7 +1,12 @@
 import copy
 import datetime
+import io
+import random
+import sys
 import unittest
+from unittest import mock
 
+import logger as logger_lib
 import lots as lots_lib
 import wash
 
@@ -156,8 +161,8 @@ class TestBestReplacementLot(unittest.TestCase):
         self.assertEqual(10, wash_lot.num_shares)
         self.assertEqual(3, lots.size())
 
-        lots.sort(cmp=lots_lib.Lot.cmp_by_original_buy_date)
-        final_lots.sort(cmp=lots_lib.Lot.cmp_by_original_buy_date)
+        lots.sort(key=lots_lib.Lot.original_buy_date_key)
+        final_lots.sort(key=lots_lib.Lot.original_buy_date_key)
         self.assertSameLots(lots, final_lots)
 
     def test_loss_not_in_lots(self):
@@ -360,6 +365,364 @@ class TestWashOneLot(unittest.TestCase):
         self.assertSameLots(lots, final_lots)
 
 
+class TestEventWasher(unittest.TestCase):
+
+    def assertSameLots(self, a, b):
+        self.assertEqual(a, b, msg='Lots are not equal: \n{}\n{}'.format(a, b))
+
+    def test_same_result_as_wash_all_lots(self):
+        # Identical losses and replacements, so that the order of lots that
+        # are split off matters.
+        lots = lots_lib.Lots([
+            create_lot(10, 2012, 1, 1, 120, 2012, 2, 1, 100),
+            create_lot(10, 2012, 1, 1, 120, 2012, 2, 1, 100),
+            create_lot(4, 2012, 2, 10, 100, 2012, 2, 20, 90),
+            create_lot(7, 2012, 2, 10, 100, 2012, 2, 20, 90),
+            create_lot(3, 2012, 2, 15, 100),
+        ])
+        expected = copy.deepcopy(lots)
+        wash.wash_all_lots(expected)
+
+        wash.EventWasher(lots).wash_all()
+        self.assertSameLots(lots, expected)
+
+    def test_batch_same_result_as_wash_all_lots(self):
+        rand = random.Random(0)
+        for _ in range(300):
+            lots = []
+            for _ in range(rand.randint(2, 40)):
+                num_shares = rand.choice([1, 2, 3, 5, 10, 50])
+                lot = create_lot(num_shares, 2014, 1, rand.randint(1, 31),
+                                 num_shares * rand.randint(90, 110))
+                if rand.random() < 0.7:
+                    lot.sell_date = lot.buy_date + datetime.timedelta(
+                        days=rand.randint(0, 40))
+                    lot.proceeds = num_shares * rand.randint(85, 112)
+                lot.buy_lot = rand.choice(['', '', 'lot1'])
+                lots.append(lot)
+            lots = lots_lib.Lots(lots)
+            expected = copy.deepcopy(lots)
+            wash.wash_all_lots(expected)
+
+            wash.EventWasher(lots).wash_all()
+            self.assertSameLots(lots, expected)
+            # Lots that were split off in the same order sort the same way.
+            self.assertEqual([lot.key() for lot in expected],
+                             [lot.key() for lot in lots])
+
+    def test_numpy_candidates_same_result(self):
+        lots_lib._import_numpy()
+        if not lots_lib._HAS_NUMPY:
+            self.skipTest('numpy is not installed')
+        rand = random.Random(3)
+        for _ in range(30):
+            lots = []
+            for i in range(rand.randint(20, 120)):
+                num_shares = rand.choice([1, 2, 5, 10])
+                lot = create_lot(num_shares, 2014, 1, rand.randint(1, 31),
+                                 num_shares * rand.randint(90, 110))
+                if rand.random() < 0.7:
+                    lot.sell_date = lot.buy_date + datetime.timedelta(
+                        days=rand.randint(0, 40))
+                    lot.proceeds = num_shares * rand.randint(85, 112)
+                lot.form_position = str(i)
+                lot.buy_lot = rand.choice(['', '', 'lot1', 'lot2'])
+                lots.append(lot)
+            lots = lots_lib.Lots(lots)
+            with mock.patch.object(lots_lib, '_HAS_NUMPY', False):
+                expected = copy.deepcopy(lots)
+                wash.event_wash_all_lots(expected)
+
+            # Mask every window, so that the added and removed lots are
+            # checked too.
+            with mock.patch.object(lots_lib, '_MIN_MASKED_WINDOW', 2), \
+                    mock.patch.object(lots_lib, '_NUM_SCANNED_FIRST', 1):
+                for engine in [wash.event_wash_all_lots, wash.wash_all_lots]:
+                    washed = copy.deepcopy(lots)
+                    engine(washed)
+                    self.assertSameLots(washed, expected)
+                washed = lots_lib.Lots(list(wash.stream_wash_lots(
+                    sorted(copy.deepcopy(lots).lots(),
+                           key=lots_lib.Lot.original_buy_date_key))))
+                self.assertSameLots(washed, expected)
+
+    def test_batch_is_one_step(self):
+        lots = lots_lib.Lots([
+            create_lot(10, 2014, 1, 1, 2000, 2014, 2, 1, 1000),
+            create_lot(3, 2014, 2, 5, 300),
+            create_lot(3, 2014, 2, 6, 300),
+            create_lot(6, 2014, 2, 7, 600),
+        ])
+        expected = copy.deepcopy(lots)
+        wash.wash_all_lots(expected)
+
+        trace_file = io.StringIO()
+        wash.EventWasher(lots, logger_lib.TraceLogger(trace_file)).wash_all()
+        self.assertSameLots(lots, expected)
+        messages = [line for line in trace_file.getvalue().splitlines()
+                    if 'Split' in line]
+        self.assertEqual(1, len(messages))
+        self.assertIn('Split loss for 3 replacement lots', messages[0])
+        self.assertEqual([3, 3, 4, 2],
+                         [lot.num_shares for lot in lots
+                          if lot.is_replacement or lot.buy_date.month == 2])
+
+    def test_engines_are_registered(self):
+        self.assertIs(wash.wash_all_lots, wash.ENGINES['iterative'])
+        self.assertIs(wash.event_wash_all_lots, wash.ENGINES['event'])
+
+class TestPartitions(unittest.TestCase):
+
+    def setUp(self):
+        self.abc_loss = create_lot(10, 2012, 1, 1, 120, 2012, 2, 1, 100)
+        self.abc_gain = create_lot(10, 2012, 2, 10, 100, 2012, 2, 20, 110)
+        self.xyz_loss = create_lot(10, 2012, 1, 1, 120, 2012, 2, 1, 100)
+        self.xyz_loss.symbol = 'XYZ'
+        self.def_gain = create_lot(10, 2012, 2, 10, 100)
+        self.def_gain.symbol = 'DEF'
+        self.lots = lots_lib.Lots([self.abc_loss, self.xyz_loss, self.def_gain,
+                                   self.abc_gain])
+
+    def assertSameLots(self, a, b):
+        self.assertEqual(a, b, msg='Lots are not equal: \n{}\n{}'.format(a, b))
+
+    def test_partition_by_symbol(self):
+        partitions = wash.partition_lots(self.lots)
+        self.assertEqual(['ABC', 'DEF', 'XYZ'],
+                         [group for group, _ in partitions])
+        self.assertSameLots(lots_lib.Lots([self.abc_loss, self.abc_gain]),
+                            partitions[0][1])
+
+    def test_partition_by_group(self):
+        partitions = wash.partition_lots(self.lots, {'XYZ': 'XYZ',
+                                                     'DEF': 'XYZ'})
+        self.assertEqual(['ABC', 'XYZ'], [group for group, _ in partitions])
+        self.assertSameLots(lots_lib.Lots([self.xyz_loss, self.def_gain]),
+                            partitions[1][1])
+
+    def test_read_symbol_groups(self):
+        groups = wash.read_symbol_groups(['Symbol,Group', 'VOO,SP500',
+                                          'IVV,SP500'])
+        self.assertEqual({'VOO': 'SP500', 'IVV': 'SP500'}, groups)
+        with self.assertRaises(lots_lib.BadHeadersError):
+            wash.read_symbol_groups(['Symbol,Name', 'VOO,SP500'])
+        with self.assertRaises(lots_lib.BadHeadersError):
+            wash.read_symbol_groups([])
+
+    def test_read_symbol_groups_blank_and_bad_lines(self):
+        groups = wash.read_symbol_groups(['Symbol,Group\n', 'VOO,SP500\n',
+                                          '\n', ',\n', 'IVV,SP500\n'])
+        self.assertEqual({'VOO': 'SP500', 'IVV': 'SP500'}, groups)
+        for bad_line in ['VOO\n', 'VOO,SP500,extra\n', 'VOO,\n']:
+            with self.assertRaisesRegex(ValueError, 'line 3: ' + bad_line[:3]):
+                wash.read_symbol_groups(['Symbol,Group\n', 'IVV,SP500\n',
+                                         bad_line])
+
+    def test_wash_partitions(self):
+        # The XYZ loss can only be washed against the DEF gain if they are in
+        # the same group.
+        expected_abc = lots_lib.Lots([copy.deepcopy(self.abc_loss),
+                                      copy.deepcopy(self.abc_gain)])
+        wash.wash_all_lots(expected_abc)
+        expected_xyz = lots_lib.Lots([copy.deepcopy(self.xyz_loss),
+                                      copy.deepcopy(self.def_gain)])
+        wash.wash_all_lots(expected_xyz)
+        expected = lots_lib.Lots(expected_abc.lots() + expected_xyz.lots())
+
+        groups = {'DEF': 'XYZ'}
+        serial = wash.wash_partitions(
+            wash.partition_lots(copy.deepcopy(self.lots), groups), jobs=1)
+        self.assertSameLots(expected, serial)
+        parallel = wash.wash_partitions(
+            wash.partition_lots(copy.deepcopy(self.lots), groups), jobs=2)
+        self.assertTrue(serial.contents_equal(parallel))
+
+    def test_window_partitions(self):
+        lots = [
+            # A loss, and a lot bought 30 days after the sale.
+            create_lot(10, 2014, 1, 1, 2000, 2014, 1, 11, 1000),
+            create_lot(10, 2014, 2, 10, 2000),
+            # A gain is joined to its window too, since it can become a loss
+            # when it is used as a replacement.
+            create_lot(10, 2014, 4, 11, 1000, 2014, 4, 21, 1500),
+            create_lot(10, 2014, 3, 22, 1000),
+            # Bought 31 days after the last sale.
+            create_lot(10, 2014, 5, 22, 2000),
+        ]
+        self.assertEqual([[id(lots[0]), id(lots[1])],
+                          [id(lots[3]), id(lots[2])], [id(lots[4])]],
+                         [[id(lot) for lot in partition]
+                          for partition in wash.window_partitions(lots)])
+        self.assertEqual([], wash.window_partitions([]))
+
+    def test_wash_window_partitions(self):
+        # Washing each partition on its own gives the same lots as washing
+        # all of them together.
+        rand = random.Random(0)
+        for _ in range(50):
+            lots = []
+            for _ in range(rand.randint(1, 40)):
+                buy_date = datetime.date(2014, 1, 1) + datetime.timedelta(
+                    days=rand.randint(0, 1000))
+                num_shares = rand.randint(1, 20)
+                lot = create_lot(num_shares, buy_date.year, buy_date.month,
+                                 buy_date.day, num_shares * 100)
+                if rand.random() < 0.7:
+                    lot.sell_date = buy_date + datetime.timedelta(
+                        days=rand.randint(0, 200))
+                    lot.proceeds = num_shares * rand.randint(50, 150)
+                lots.append(lot)
+            # Numbers the buy lots once, for all of the partitions.
+            lots = lots_lib.Lots(lots)
+            expected = copy.deepcopy(lots)
+            wash.wash_all_lots(expected)
+            washed = []
+            for partition in wash.window_partitions(lots):
+                partition_lots = lots_lib.Lots(partition)
+                wash.wash_all_lots(partition_lots)
+                washed.extend(partition_lots)
+            self.assertSameLots(expected, lots_lib.Lots(washed))
+
+class TestStreamWashLots(unittest.TestCase):
+
+    def setUp(self):
+        # A year of trades, with a mix of gains, losses and unsold lots.
+        rand = random.Random(1)
+        self.lots = []
+        for i in range(300):
+            buy_date = datetime.date(2014, 1, 1) + datetime.timedelta(
+                days=i * 365 // 300)
+            lot = create_lot(rand.randint(1, 20), buy_date.year,
+                             buy_date.month, buy_date.day,
+                             rand.randint(100, 200))
+            if rand.random() < 0.8:
+                lot.sell_date = buy_date + datetime.timedelta(
+                    days=rand.randint(1, 120))
+                lot.proceeds = rand.randint(80, 220)
+            lot.form_position = str(i)
+            self.lots.append(lot)
+
+    def test_same_result_as_wash_all_lots(self):
+        expected = lots_lib.Lots(copy.deepcopy(self.lots))
+        wash.wash_all_lots(expected)
+
+        lots = lots_lib.Lots(self.lots)
+        washed = lots_lib.Lots(list(wash.stream_wash_lots(lots)))
+        self.assertEqual(expected, washed)
+
+    def test_lots_are_yielded_before_all_lots_are_read(self):
+        num_read = [0]
+
+        def read_lots():
+            for lot in lots_lib.Lots(self.lots):
+                num_read[0] += 1
+                yield lot
+
+        washed = wash.stream_wash_lots(read_lots())
+        next(washed)
+        self.assertLess(num_read[0], len(self.lots) // 2)
+
+    def test_unordered_lots(self):
+        lots = [create_lot(10, 2014, 2, 1, 100),
+                create_lot(10, 2014, 1, 1, 100)]
+        with self.assertRaises(wash.UnorderedLotsError):
+            list(wash.stream_wash_lots(lots))
+
+
+class TestIncrementalWashLots(unittest.TestCase):
+
+    def setUp(self):
+        # A year of trades, with a mix of gains, losses and unsold lots.
+        rand = random.Random(2)
+        self.lots = []
+        for i in range(300):
+            buy_date = datetime.date(2014, 1, 1) + datetime.timedelta(
+                days=i * 365 // 300)
+            lot = create_lot(rand.randint(1, 20), buy_date.year,
+                             buy_date.month, buy_date.day,
+                             rand.randint(100, 200))
+            if rand.random() < 0.8:
+                lot.sell_date = buy_date + datetime.timedelta(
+                    days=rand.randint(1, 120))
+                lot.proceeds = rand.randint(80, 220)
+            lot.form_position = str(i)
+            lot.buy_lot = '_{}'.format(i + 1)
+            self.lots.append(lot)
+        # The lots bought up to the cutoff are washed first, so they can't be
+        # sold after it. Nothing is bought in the weeks before the cutoff, so
+        # that losses sold then are only washed by the lots bought after it.
+        self.cutoff = datetime.date(2014, 7, 1)
+        gap_start = self.cutoff - datetime.timedelta(days=40)
+        self.lots = [lot for lot in self.lots
+                     if not gap_start < lot.buy_date <= self.cutoff]
+        for lot in self.lots:
+            if (lot.sell_date and
+                    lot.buy_date <= self.cutoff < lot.sell_date):
+                lot.sell_date = None
+                lot.proceeds = 0
+
+    def test_same_result_as_wash_all_lots(self):
+        expected = lots_lib.Lots(copy.deepcopy(self.lots))
+        wash.wash_all_lots(expected)
+
+        lots = lots_lib.Lots(
+            [lot for lot in self.lots if lot.buy_date <= self.cutoff])
+        new_lots = [lot for lot in self.lots if lot.buy_date > self.cutoff]
+        wash.wash_all_lots(lots)
+        # The previous result is read back the same way as from a file.
+        output = io.StringIO()
+        lots.write_csv_data(output)
+        output.seek(0)
+        lots = lots_lib.Lots.create_from_csv_data(output)
+
+        wash.incremental_wash_lots(lots, new_lots)
+        self.assertEqual(expected, lots)
+
+    def test_new_lot_bought_before_last_lot(self):
+        lots = lots_lib.Lots([create_lot(10, 2014, 2, 1, 100)])
+        with self.assertRaises(wash.UnorderedLotsError):
+            wash.incremental_wash_lots(lots,
+                                       [create_lot(10, 2014, 2, 1, 100)])
+
+    def test_new_lot_bought_before_last_sale(self):
+        lots = lots_lib.Lots([create_lot(10, 2014, 1, 1, 100, 2014, 3, 1, 90)])
+        with self.assertRaises(wash.UnorderedLotsError):
+            wash.incremental_wash_lots(lots,
+                                       [create_lot(10, 2014, 2, 1, 100)])
+
+    def test_main_rejects_partition_flags(self):
+        for flags in [['-s'], ['-g', 'groups.csv'], ['-b', 'table']]:
+            argv = ['wash.py', '-q', '-w', 'new.csv', '-p', 'out.csv'] + flags
+            stderr = io.StringIO()
+            with mock.patch.object(sys, 'argv', argv), \
+                    mock.patch.object(sys, 'stderr', stderr):
+                with self.assertRaises(SystemExit):
+                    wash.main()
+            self.assertIn('--previous does not support', stderr.getvalue())
+
+
+class TestStats(unittest.TestCase):
+
+    def test_counts(self):
+        for engine in sorted(wash.ENGINES):
+            loss = create_lot(10, 2014, 1, 1, 200, 2014, 2, 1, 100)
+            replacement = create_lot(20, 2014, 2, 5, 400)
+            logger = logger_lib.StatsLogger()
+            wash.ENGINES[engine](lots_lib.Lots([loss, replacement]), logger)
+            counts = logger.stats()['counts']
+            self.assertEqual(1, counts['losses_processed'], engine)
+            self.assertEqual(1, counts['losses_washed'], engine)
+            self.assertEqual(1, counts['replacement_lookups'], engine)
+            self.assertEqual(1, counts['candidates_scanned'], engine)
+            self.assertEqual(1, counts['splits'], engine)
+            self.assertIn('find_replacement', logger.stats()['seconds'])
+
+    def test_null_logger_ignores_stats(self):
+        logger = logger_lib.NullLogger()
+        logger.count('losses_processed')
+        with logger.timer('find_loss'):
+            pass
+
 
 # wash_all_lots is tested with run_integ_tests using the files in the tests/
 # directory.
@@ -0,0 +1,328 @@
+import argparse
+import datetime
+import hashlib
+import json
+import os
+import sys
+
+import lots as lots_lib
+import snapshot as snapshot_lib
+import wash as wash_lib
+
+# A loss sold on Dec 31 can be washed by a lot bought up to 30 days later, so
+# the wash of a year needs the lots bought up to Jan 30 of the next year.
+WINDOW = datetime.timedelta(days=30)
+
+
+def year_end(year):
+    """Returns the last day of a year, a datetime.date."""
+    return datetime.date(year, 12, 31)
+
+
+def read_year(path, first_buy_lot_number=1):
+    """Reads a file with the lots bought in one year.
+
+    Args:
+        path: The path of a csv file. Every lot in it must have been bought in
+            the same year.
+        first_buy_lot_number: An integer, the number used in the buy_lot of
+            the first row that has no buy_lot, as for
+            lots_lib.Lots.iter_csv_data.
+    Returns:
+        A tuple of the year, an integer, and a list of Lot objects in the
+        order of the rows.
+    Raises:
+        UnorderedLotsError: If the lots were not all bought in the same year,
+            or there are no lots.
+    """
+    with open(path, newline='') as f:
+        lots = list(lots_lib.Lots.iter_csv_data(f, first_buy_lot_number))
+    if not lots:
+        raise wash_lib.UnorderedLotsError('No lots in {}'.format(path))
+    year = lots[0].buy_date.year
+    for lot in lots:
+        if lot.buy_date.year != year:
+            raise wash_lib.UnorderedLotsError(
+                'Not bought in {}: {}'.format(year, lot))
+    return year, lots
+
+
+def wash_year(open_lots, new_lots, year):
+    """Washes the losses sold in a year, carrying forward the open lots.
+
+    Every loss sold by the end of the year is washed exactly as it would be
+    if the whole history was washed at once. This needs every lot that was
+    bought by Jan 30 of the next year, since those can be replacements for
+    losses sold in December.
+
+    Lots that were sold by the end of the year can't be washed against any
+    later loss, so they are final. Only the others need to be kept for the
+    next year.
+
+    Args:
+        open_lots: A list of Lot objects, the lots that were still open at the
+            end of the previous year, as returned by the previous call. They
+            were numbered before new_lots, in the same order as when they
+            were returned.
+        new_lots: A list of Lot objects, bought after every lot in open_lots
+            was bought, up to Jan 30 of the next year.
+        year: An integer, the year to wash.
+    Returns:
+        A tuple of two lists of Lot objects, the lots that were sold by the
+        end of the year, and the other lots, in the order that they were
+        created.
+    """
+    lots = lots_lib.Lots(open_lots + new_lots)
+    wash_lib.EventWasher(lots).wash_until(year_end(year))
+    closed = []
+    still_open = []
+    for lot in sorted(lots, key=lambda lot: lot._lot_number):
+        if lot.sell_date and lot.sell_date <= year_end(year):
+            closed.append(lot)
+        else:
+            still_open.append(lot)
+    return closed, still_open
+
+
+def _fingerprint(previous, lots):
+    """Hashes lots, following on from another fingerprint.
+
+    Args:
+        previous: A fingerprint, a string.
+        lots: A list of Lot objects, in order.
+    Returns:
+        A hex string.
+    """
+    digest = hashlib.sha1(previous.encode('utf-8'))
+    for lot in lots:
+        digest.update(repr(lot.key()).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def _scan(path):
+    """Finds the year of a file without reading all of its lots.
+
+    Returns:
+        A tuple of the buy year of its first lot, an integer, and a hex digest
+        of its bytes.
+    Raises:
+        UnorderedLotsError: If there are no lots.
+    """
+    with open(path, 'rb') as f:
+        digest = hashlib.sha1(f.read()).hexdigest()
+    with open(path, newline='') as f:
+        for lot in lots_lib.Lots.iter_csv_data(f):
+            return lot.buy_date.year, digest
+    raise wash_lib.UnorderedLotsError('No lots in {}'.format(path))
+
+
+class Checkpoints(object):
+    """The open lots at the end of each year, stored in a directory.
+
+    Each year has a snapshot of its open lots, <year>.snap, and a json file,
+    <year>.json, with the digests of the files that the wash of the year and
+    the years before it depended on.
+    """
+
+    def __init__(self, directory):
+        """Initializes the checkpoints.
+
+        Args:
+            directory: The path of the directory, which is made if needed.
+        """
+        self._directory = directory
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def _path(self, year, ext):
+        return os.path.join(self._directory, '{}{}'.format(year, ext))
+
+    def info(self, year):
+        """Returns the json dict of a year's checkpoint, or None."""
+        try:
+            with open(self._path(year, '.json')) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return None
+
+    def load(self, year):
+        """Reads the open lots of a year's checkpoint.
+
+        Returns:
+            A list of Lot objects, in the order that they were written.
+        """
+        with snapshot_lib.Snapshot(self._path(year, '.snap')) as snapshot:
+            return snapshot.lots()
+
+    def save(self, year, open_lots, info):
+        """Writes a year's checkpoint.
+
+        Args:
+            year: An integer.
+            open_lots: A list of Lot objects, in the order to number them in
+                when they are read back.
+            info: A json dict.
+        """
+        # The json is written last, so a checkpoint that was only partly
+        # written is never used.
+        if os.path.exists(self._path(year, '.json')):
+            os.remove(self._path(year, '.json'))
+        with open(self._path(year, '.snap'), 'wb') as f:
+            snapshot_lib.write_snapshot(open_lots, f)
+        self.save_info(year, info)
+
+    def save_info(self, year, info):
+        """Writes the json dict of a year's checkpoint, keeping its lots."""
+        with open(self._path(year, '.json'), 'w') as f:
+            json.dump(info, f, indent=2, sort_keys=True)
+
+
+def out_path_for(in_path):
+    """Returns the path that the lots sold in a year are written to."""
+    base, ext = os.path.splitext(in_path)
+    return base + '_out' + (ext or '.csv')
+
+
+def wash_years(paths, checkpoints):
+    """Washes the lots in a series of yearly files.
+
+    The file of a year has the lots bought in that year. Each year starts
+    from the checkpoint of the open lots at the end of the year before, so
+    only one year of lots is washed at a time. A year is skipped if its
+    checkpoint was made from the same files, and its output exists. The
+    files of skipped years are only hashed, not read, unless the lots bought
+    by Jan 30 of the next year need to be checked.
+
+    The lots sold in each year are written next to its file, with _out added
+    to the name. Together with the open lots that are returned, these are the
+    same lots as washing all of the files together.
+
+    Args:
+        paths: A list of paths of csv files, one per year, in order of year.
+        checkpoints: A Checkpoints object.
+    Returns:
+        A tuple of a list of Lot objects, the lots that are still open, with
+        every known loss washed, and a list of the years that were washed
+        instead of skipped.
+    Raises:
+        UnorderedLotsError: If a file has lots bought in more than one year,
+            or the years are not in order.
+    """
+    scans = [_scan(path) for path in paths]
+    for i in range(1, len(paths)):
+        if scans[i][0] <= scans[i - 1][0]:
+            raise wash_lib.UnorderedLotsError(
+                '{} is not after {}'.format(paths[i], paths[i - 1]))
+    read_lots = {}
+
+    def read(i, first_buy_lot_number):
+        # A file is read at most once, as the lookahead of the year before it
+        # or to wash its own year.
+        if i not in read_lots:
+            read_lots[i] = read_year(paths[i], first_buy_lot_number)[1]
+        return read_lots[i]
+
+    # The open lots at the end of the previous year, or None if they are only
+    # in the checkpoint of loaded_year.
+    open_lots = []
+    loaded_year = None
+    fingerprint = ''
+    buy_lot_number = 1
+    washed_years = []
+    for i, path in enumerate(paths):
+        year, digest = scans[i]
+        next_digest = None
+        if i + 1 < len(paths) and scans[i + 1][0] == year + 1:
+            next_digest = scans[i + 1][1]
+        info = checkpoints.info(year)
+        same_inputs = (info is not None and
+                       info['inputs'] == [fingerprint, digest] and
+                       os.path.exists(out_path_for(path)))
+
+        if same_inputs:
+            next_buy_lot_number = info['next_buy_lot_number']
+        else:
+            next_buy_lot_number = max(
+                buy_lot_number,
+                wash_lib._next_buy_lot_number(read(i, buy_lot_number)))
+        lookahead = []
+        if next_digest is None:
+            lookahead_fingerprint = _fingerprint('', lookahead)
+        elif same_inputs and info['next_digest'] == next_digest:
+            lookahead_fingerprint = info['lookahead']
+        else:
+            lookahead = [lot for lot in read(i + 1, next_buy_lot_number)
+                         if lot.buy_date <= year_end(year) + WINDOW]
+            lookahead_fingerprint = _fingerprint('', lookahead)
+
+        new_info = {
+            'inputs': [fingerprint, digest],
+            'next_digest': next_digest,
+            'lookahead': lookahead_fingerprint,
+            'next_buy_lot_number': next_buy_lot_number,
+        }
+        if same_inputs and info['lookahead'] == lookahead_fingerprint:
+            open_lots = None
+            if info != new_info:
+                # A new next year, or an edit after Jan 30 of it.
+                checkpoints.save_info(year, new_info)
+        else:
+            year_lots = read(i, buy_lot_number)
+            # The lots bought by Jan 30 were washed with the previous year.
+            if i and scans[i - 1][0] == year - 1:
+                year_lots = [lot for lot in year_lots
+                             if lot.buy_date > year_end(year - 1) + WINDOW]
+            new_lots = year_lots + lookahead
+            if open_lots is None:
+                open_lots = checkpoints.load(loaded_year)
+                # Lots are ordered by their number when they otherwise tie,
+                # and the new lots must come after the open lots, as they do
+                # when all of the files are washed together.
+                new_lots = [lot.clone() for lot in new_lots]
+            closed, open_lots = wash_year(open_lots, new_lots, year)
+            wash_lib.write_lots(lots_lib.Lots(closed), out_path_for(path))
+            checkpoints.save(year, open_lots, new_info)
+            washed_years.append(year)
+        loaded_year = year
+        buy_lot_number = next_buy_lot_number
+        # What the next year depends on. The rest of the next year's file is
+        # covered by its own digest.
+        fingerprint = hashlib.sha1(json.dumps(
+            [new_info['inputs'], lookahead_fingerprint, next_buy_lot_number]
+        ).encode('utf-8')).hexdigest()
+
+    if open_lots is None:
+        open_lots = checkpoints.load(loaded_year)
+    # The losses sold after the last year can still be washed by lots bought
+    # in later years, so these are only as final as the data allows.
+    lots = lots_lib.Lots(open_lots)
+    wash_lib.event_wash_all_lots(lots)
+    return lots.lots(), washed_years
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Washes one csv file per year, starting each year from '
+        'the open lots of the year before.')
+    parser.add_argument('paths', nargs='+',
+                        help='The csv files, one per year in order. Each has '
+                        'the lots bought in its year.')
+    parser.add_argument('-c', '--checkpoint_dir', required=True,
+                        help='Where to keep the open lots at the end of each '
+                        'year.')
+    parser.add_argument('-o', '--open_out', metavar='open_out_file',
+                        help='Write the lots that are still open, or were '
+                        'sold after the last year, to this file.')
+    parsed = parser.parse_args()
+
+    open_lots, washed_years = wash_years(
+        parsed.paths, Checkpoints(parsed.checkpoint_dir))
+    print('Washed {}'.format(', '.join(str(year) for year in washed_years)
+                             if washed_years else 'no years'))
+    if parsed.open_out:
+        wash_lib.write_lots(lots_lib.Lots(open_lots), parsed.open_out)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,149 @@
+import datetime
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+import lots as lots_lib
+import wash
+import yearly_wash
+
+
+def create_lot(num_shares, buy_date, basis, sell_date=None, proceeds=0):
+    return lots_lib.Lot(num_shares, 'ABC', '', buy_date, buy_date, basis,
+                        basis, sell_date, proceeds, '', 0, '', '', [], False,
+                        False)
+
+
+class TestYearlyWash(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.checkpoints = yearly_wash.Checkpoints(
+            os.path.join(self.dir, 'checkpoints'))
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write_years(self, lots):
+        """Writes the lots to one file per buy year, without buy lots."""
+        by_year = {}
+        for lot in lots:
+            by_year.setdefault(lot.buy_date.year, []).append(lot)
+        paths = []
+        for year in sorted(by_year):
+            path = os.path.join(self.dir, '{}.csv'.format(year))
+            with open(path, 'w', newline='') as f:
+                writer = lots_lib.Lots.csv_writer(f)
+                for lot in by_year[year]:
+                    row = lots_lib.Lots.csv_row(lot)
+                    row['buy_lot'] = ''
+                    writer.writerow(row)
+            paths.append(path)
+        return paths
+
+    def wash_together(self, paths):
+        lots = []
+        for path in paths:
+            with open(path, newline='') as f:
+                lots.extend(lots_lib.Lots.iter_csv_data(
+                    f, wash._next_buy_lot_number(lots)))
+        lots = lots_lib.Lots(lots)
+        wash.event_wash_all_lots(lots)
+        return lots
+
+    def read_outputs(self, paths, open_lots):
+        lots = list(open_lots)
+        for path in paths:
+            with open(yearly_wash.out_path_for(path), newline='') as f:
+                lots.extend(lots_lib.Lots.iter_csv_data(f))
+        return lots_lib.Lots(lots)
+
+    def test_loss_washed_by_next_year(self):
+        # A December loss is washed by a lot bought in January, which is then
+        # sold in the next year.
+        paths = self.write_years([
+            create_lot(10, datetime.date(2014, 6, 1), 2000,
+                       datetime.date(2014, 12, 20), 1000),
+            create_lot(10, datetime.date(2015, 1, 15), 1500,
+                       datetime.date(2015, 3, 1), 2000),
+            create_lot(10, datetime.date(2015, 6, 1), 1500),
+        ])
+        open_lots, washed_years = yearly_wash.wash_years(paths,
+                                                         self.checkpoints)
+        self.assertEqual([2014, 2015], washed_years)
+        self.assertEqual(1, len(open_lots))
+        with open(yearly_wash.out_path_for(paths[0]), newline='') as f:
+            loss, = lots_lib.Lots.iter_csv_data(f)
+        self.assertEqual('W', loss.adjustment_code)
+        with open(yearly_wash.out_path_for(paths[1]), newline='') as f:
+            replacement, = lots_lib.Lots.iter_csv_data(f)
+        self.assertEqual(2500, replacement.adjusted_basis)
+        self.assertEqual(self.wash_together(paths),
+                         self.read_outputs(paths, open_lots))
+
+    def test_same_as_washing_together(self):
+        rand = random.Random(0)
+        for _ in range(10):
+            lots = []
+            for _ in range(rand.randint(1, 60)):
+                buy_date = datetime.date(2013, 12, 1) + datetime.timedelta(
+                    days=rand.randint(0, 1000))
+                num_shares = rand.randint(1, 20)
+                sell_date = None
+                proceeds = 0
+                if rand.random() < 0.8:
+                    sell_date = buy_date + datetime.timedelta(
+                        days=rand.randint(0, 400))
+                    proceeds = num_shares * rand.randint(50, 150)
+                lots.append(create_lot(num_shares, buy_date, num_shares * 100,
+                                       sell_date, proceeds))
+            paths = self.write_years(lots)
+            open_lots, _ = yearly_wash.wash_years(paths, self.checkpoints)
+            self.assertEqual(self.wash_together(paths),
+                             self.read_outputs(paths, open_lots))
+            for path in paths:
+                os.remove(path)
+                os.remove(yearly_wash.out_path_for(path))
+
+    def test_skip_unchanged_years(self):
+        lots = [create_lot(10, datetime.date(2014 + year, month, 1), 2000,
+                           datetime.date(2014 + year, month, 20), 1000 + year)
+                for year in range(4) for month in [2, 6, 12]]
+        paths = self.write_years(lots)
+        open_lots, washed_years = yearly_wash.wash_years(paths[:3],
+                                                         self.checkpoints)
+        self.assertEqual([2014, 2015, 2016], washed_years)
+
+        # 2016 was washed before there was a 2017, but nothing was bought by
+        # Jan 30 2017, so its checkpoint is still good.
+        open_lots, washed_years = yearly_wash.wash_years(paths,
+                                                         self.checkpoints)
+        self.assertEqual([2017], washed_years)
+        self.assertEqual(self.wash_together(paths),
+                         self.read_outputs(paths, open_lots))
+
+        # An edit to one year washes it and the years after it.
+        with open(paths[1], 'a') as f:
+            f.write('5,ABC,,12/30/2015,,1000,,,,,,,,,,\n')
+        open_lots, washed_years = yearly_wash.wash_years(paths,
+                                                         self.checkpoints)
+        self.assertEqual([2015, 2016, 2017], washed_years)
+        self.assertEqual(self.wash_together(paths),
+                         self.read_outputs(paths, open_lots))
+
+    def test_errors(self):
+        paths = self.write_years([
+            create_lot(10, datetime.date(2014, 6, 1), 2000),
+            create_lot(10, datetime.date(2015, 6, 1), 2000)])
+        with self.assertRaises(wash.UnorderedLotsError):
+            yearly_wash.wash_years(list(reversed(paths)), self.checkpoints)
+        with open(paths[0], 'a') as f:
+            f.write('5,ABC,,12/30/2015,,1000,,,,,,,,,,\n')
+        with self.assertRaises(wash.UnorderedLotsError):
+            yearly_wash.wash_years(paths, self.checkpoints)
+
+
+if __name__ == '__main__':
+    unittest.main()